@@ -0,0 +1,63 @@
+# accesslog.py
+# Logging goes through a queue: request threads only enqueue a record, one
+# listener thread formats and writes it. Each request produces a single JSON
+# access record; successful ones can be sampled, errors and slow requests
+# are always kept.
+import json, logging, os, queue, random, time
+from logging.handlers import QueueHandler, QueueListener
+
+ACCESS_LOG_SAMPLE  = float(os.environ.get('ACCESS_LOG_SAMPLE', '1'))     # share of fast 2xx/3xx kept
+ACCESS_LOG_SLOW_MS = float(os.environ.get('ACCESS_LOG_SLOW_MS', '500'))  # always logged above this
+LOG_FORMAT = '[%(asctime)s] %(levelname)s: %(message)s'
+
+access_logger = logging.getLogger("access")
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, separators=(",", ":"), default=str)
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # access records carry a dict: leave the JSON encoding to the listener thread
+        if record.name == "access": return record
+        return super().prepare(record)
+
+_listener = None
+_listener_pid = None
+
+def setup_logging(level=logging.INFO):
+    """Route all logging through one queue + listener thread (again after a fork,
+    since the listener thread does not survive it)."""
+    global _listener, _listener_pid
+    if _listener_pid == os.getpid(): return
+    q = queue.SimpleQueue()
+    plain = logging.StreamHandler()
+    plain.setFormatter(logging.Formatter(LOG_FORMAT))
+    plain.addFilter(lambda r: r.name != "access")
+    access = logging.StreamHandler()
+    access.setFormatter(_JsonFormatter())
+    access.addFilter(lambda r: r.name == "access")
+
+    root = logging.getLogger()
+    for h in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(h)
+    root.addHandler(_QueueHandler(q))
+    root.setLevel(level)
+    _listener, _listener_pid = QueueListener(q, plain, access), os.getpid()
+    _listener.start()
+
+def stop_logging():
+    """Flush queued records (call before a worker exits)."""
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = _listener_pid = None
+
+def log_access(method, route, status, ms, db_ms=None, size=None, **extra):
+    if status < 400 and ms < ACCESS_LOG_SLOW_MS and ACCESS_LOG_SAMPLE < 1 \
+            and random.random() >= ACCESS_LOG_SAMPLE:
+        return
+    rec = {"ts": round(time.time(), 3), "method": method, "route": route, "status": status,
+           "ms": round(ms, 1), "db_ms": None if db_ms is None else round(db_ms, 1), "bytes": size}
+    rec.update(extra)
+    access_logger.info(rec)
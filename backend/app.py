@@ -1,41 +1,126 @@
 # app.py
-from flask import Flask, request, jsonify, g
+from flask import (Flask, Blueprint, Response, current_app, request, jsonify, g,
+                   make_response)
 from flask_cors import CORS
-import logging, time, os
-from datetime import date, datetime
+import time, os, hashlib, base64, json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from werkzeug.test import EnvironBuilder
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from decimal import Decimal
 import mysql.connector
-from db_config import get_connection
+from mysql.connector import errorcode
+from db_config import get_pool, PoolTimeout
+from rowconv import row_converter
+from respcache import response_cache
+from tokencache import TokenCache
+from accesslog import setup_logging, log_access
+from dbstats import QueryStats, TimedConnection
+import metrics
+import recurrence
+import search
 
 # Auth helpers
-import bcrypt
+import pwhash
+from pwhash import HashBusy
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
-app = Flask(__name__)
-CORS(app)
+# routes live on a blueprint; create_app() (bottom of file) builds the Flask app
+api = Blueprint("api", __name__)
 
-# ---------- logging ----------
-logging.basicConfig(level=logging.INFO,
-                    format='[%(asctime)s] %(levelname)s: %(message)s')
+# ---------- logging (queued; one JSON access record per request) ----------
+# create_app() starts it, so importing this module starts no threads
 
-@app.before_request
-def _log_request():
+@api.before_app_request
+def _start_request():
     g._t0 = time.perf_counter()
-    qs = request.query_string.decode() or ''
-    app.logger.info(">> %s %s%s from %s",
-                    request.method, request.path,
-                    f"?{qs}" if qs else "", request.remote_addr)
-
-@app.after_request
-def _log_response(resp):
-    dt_ms = (time.perf_counter() - getattr(g, "_t0", time.perf_counter())) * 1000
-    app.logger.info("<< %s %s %s (%.1f ms)",
-                    request.method, request.path, resp.status, dt_ms)
+    g._dbstats = QueryStats()
+    g._access_req = request._get_current_object()
+    metrics.request_started()
+
+def _rule():
+    return request.url_rule.rule if request.url_rule is not None else None
+
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'   # db/connect/serialize ms per response
+
+def _emit_access(method, rule, path, status, t0, stats, size):
+    dt = time.perf_counter() - t0
+    if stats: stats.report(f"{method} {rule or path}")
+    log_access(method, rule or path, status, dt * 1000,
+               stats.db_time * 1000 if stats else None, size)
+    metrics.request_finished(method, rule or "<unmatched>", status, dt,
+                             stats.queries if stats else None, stats.db_time if stats else None)
+
+@api.after_app_request
+def _note_response(resp):
+    stats = g.get("_dbstats")
+    if SERVER_TIMING and stats is not None and g.get("_access_req") is request._get_current_object():
+        resp.headers["Server-Timing"] = stats.server_timing()
+        resp.headers["Timing-Allow-Origin"] = "*"
+    if resp.is_streamed:
+        # the body goes out after teardown: log when the response is closed
+        resp.call_on_close(partial(_emit_access, request.method, _rule(), request.path,
+                                   resp.status_code, g._t0, g.get("_dbstats"),
+                                   resp.content_length))
+        g._access_req = None
+    else:
+        g._status = resp.status_code
+        g._size = resp.calculate_content_length()
     return resp
 
+@api.teardown_app_request
+def _log_access(exc):
+    # /batch sub-requests share g and are skipped
+    if g.get("_access_req") is not request._get_current_object(): return
+    _emit_access(request.method, _rule(), request.path, g.get("_status", 500), g._t0,
+                 g.get("_dbstats"), g.get("_size"))
+
 # ---------- helpers ----------
-def ok(payload=None, status=200): return (jsonify(payload or {}), status)
-def err(msg, status=400):         return (jsonify({"error": str(msg)}), status)
+def _json(payload):
+    t0 = time.perf_counter()
+    resp = jsonify(payload)
+    stats = g.get("_dbstats")
+    if stats is not None: stats.serialize_time += time.perf_counter() - t0
+    return resp
+
+def ok(payload=None, status=200): return (_json(payload or {}), status)
+def err(msg, status=400):         return (_json({"error": str(msg)}), status)
+
+# ---------- db (one pooled connection per request) ----------
+def db():
+    cn = g.get("_db")
+    if cn is None:
+        stats = g.get("_dbstats")
+        if stats is None: stats = g._dbstats = QueryStats()
+        t0 = time.perf_counter()
+        try: raw = get_pool().acquire()
+        finally: stats.connect_time += time.perf_counter() - t0
+        cn = g._db = TimedConnection(raw, stats)
+        g._db_owner = request._get_current_object()
+    return cn
+
+@api.teardown_app_request
+def _release_db(exc):
+    # /batch sub-requests share the batch's g: only the acquiring request releases
+    if g.get("_db_owner") is not request._get_current_object(): return
+    cn = g.pop("_db", None)
+    if cn is not None:
+        get_pool().release(cn.raw)
+
+@api.app_errorhandler(PoolTimeout)
+def _pool_timeout(e):
+    current_app.logger.warning("DB pool exhausted: %s", get_pool().stats())
+    resp = jsonify({"error": "database busy, retry shortly"})
+    resp.headers["Retry-After"] = "1"
+    return resp, 503
+
+@api.app_errorhandler(HashBusy)
+def _hash_busy(e):
+    current_app.logger.warning("password hashing saturated: %s", pwhash.stats())
+    resp = jsonify({"error": "too many sign-ins, retry shortly"})
+    resp.headers["Retry-After"] = "2"
+    return resp, 503
 
 def _coerce(v):
     # Datetime -> "YYYY-MM-DD HH:MM:SS"
@@ -55,93 +140,450 @@ def _coerce(v):
             return str(v)
     return v
 
-def _dict_rows(cur):
-    rows = cur.fetchall()
-    return [{k: _coerce(v) for k, v in r.items()} for r in rows]
+def _dict_rows(cur, sql):
+    # plain (tuple) cursor + converter compiled once per query text
+    return row_converter(sql, cur.description)(cur.fetchall())
+
+def query_rows(sql, params=()):
+    cur = db().cursor()
+    cur.execute(sql, params)
+    rows = _dict_rows(cur, sql)
+    cur.close()
+    return rows
+
+# ---------- streamed list responses ----------
+STREAM_BATCH = int(os.environ.get('STREAM_BATCH', '500'))
+
+def _wants_ndjson() -> bool:
+    return (request.args.get("format") == "ndjson"
+            or "application/x-ndjson" in request.headers.get("Accept", ""))
+
+def _wants_stream() -> bool:
+    return request.args.get("stream") in ("1", "true") or _wants_ndjson()
+
+def stream_rows(sql, params=()):
+    """Stream rows straight off an unbuffered cursor, `STREAM_BATCH` at a time,
+    as one JSON array (or NDJSON). Memory stays at one batch per request."""
+    ndjson = _wants_ndjson()
+    cn = db()
+    cur = cn.cursor()              # mysql.connector cursors are unbuffered by default
+    cur.execute(sql, params)
+    convert = row_converter(sql, cur.description)
+    dumps = current_app.json.dumps
+    # the connection now belongs to the response: the request is torn down
+    # before the body is sent, so it goes back to the pool when the response closes
+    g.pop("_db"); g.pop("_db_owner", None)
+
+    def generate():
+        try:
+            sep = "["
+            while True:
+                batch = cur.fetchmany(STREAM_BATCH)
+                if not batch: break
+                rows = convert(batch)
+                if ndjson:
+                    yield "".join(dumps(r, separators=(",", ":")) + "\n" for r in rows)
+                else:
+                    yield sep + dumps(rows, separators=(",", ":"))[1:-1]
+                    sep = ","
+            if not ndjson:
+                yield "[]\n" if sep == "[" else "]\n"
+        finally:
+            # a client that hangs up leaves rows unread and close() raises;
+            # that must not stop Response.close() from reaching release()
+            try: cur.close()
+            except Exception: pass
+
+    def release():
+        try: cur.close()
+        except Exception: pass
+        finally: get_pool().release(cn.raw)   # dropped by the pool if rows were left unread
+
+    resp = Response(generate(), mimetype="application/x-ndjson" if ndjson else "application/json")
+    resp.call_on_close(release)
+    return resp
+
+# ---------- keyset pagination (opt-in: ?cursor=, empty for the first page) ----------
+# A page is {"items": [...], "next_cursor": str|null}. The cursor holds the
+# last row's sort-key values and the next page seeks past them in the index,
+# so page 1000 costs the same as page 1. `order` is ((column, "ASC"|"DESC"), ...)
+# ending in a unique column, matching the query's ORDER BY. MySQL sorts NULL
+# first, so a nullable column must be ASC.
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', '50'))
+PAGE_MAX  = int(os.environ.get('PAGE_MAX', '200'))
+
+class BadQuery(ValueError):
+    """Malformed query-string parameter (filter, sort, cursor...)."""
+
+class BadPage(BadQuery):
+    """Malformed ?cursor= or ?limit=."""
+
+@api.app_errorhandler(BadQuery)
+def _bad_query(e):
+    return err(e, 422)
+
+def paginated(args) -> bool:
+    return "cursor" in args
+
+def encode_cursor(values) -> str:
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, n: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadPage("invalid cursor")
+    if not isinstance(values, list) or len(values) != n or \
+            not all(v is None or isinstance(v, (str, int, float)) for v in values):
+        raise BadPage("invalid cursor")
+    return values
+
+def page_limit(args, size=None) -> int:
+    try: limit = int(args.get("limit") or size or PAGE_SIZE)
+    except ValueError: raise BadPage("limit must be a number")
+    return min(max(limit, 1), PAGE_MAX)
+
+def order_by(order) -> str:
+    return ", ".join(f"{col} {d}" for col, d in order)
+
+def page_clause(args, order, size=None):
+    """(" AND <after cursor>", params, " LIMIT n+1") for a paginated request,
+    ("", [], "") otherwise. The seek is spelled out as ORs: MySQL only
+    range-scans a row comparison like (a, b) < (x, y) when all columns
+    share one direction, and some of our orders mix them."""
+    if not paginated(args): return "", [], ""
+    limit = page_limit(args, size)
+    if not args["cursor"]:
+        return "", [], f" LIMIT {limit + 1}"
+    values = decode_cursor(args["cursor"], len(order))
+    sql, params = None, []
+    for (col, d), v in zip(reversed(order), reversed(values)):
+        if v is None:   # ASC: every non-NULL value comes after NULL
+            past, same, p = f"{col} IS NOT NULL", f"{col} IS NULL", []
+        else:
+            past, same, p = f"{col} {'>' if d == 'ASC' else '<'} %s", f"{col} = %s", [v]
+        if sql is None:
+            sql, params = past, p
+        else:
+            sql, params = f"{past} OR ({same} AND ({sql}))", p + p + params
+    return f" AND ({sql})", params, f" LIMIT {limit + 1}"
+
+def page(rows, args, order, size=None):
+    """Rows from a page_clause() query -> the response payload."""
+    if not paginated(args): return rows
+    limit = page_limit(args, size)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {"items": rows,
+            "next_cursor": encode_cursor([rows[-1][col] for col, _ in order]) if more else None}
+
+def list_response(sql, params=(), order=None, size=None):
+    if order is not None and paginated(request.args):
+        return ok(page(query_rows(sql, params), request.args, order, size))
+    if _wants_stream(): return stream_rows(sql, params)
+    return ok(query_rows(sql, params))
 
 # Prefer Bearer token, fallback to ?userId=
-app.config['AUTH_SECRET'] = os.environ.get('AUTH_SECRET', 'dev-secret-change-me')
-_signer = URLSafeTimedSerializer(app.config['AUTH_SECRET'])
+AUTH_SECRET = os.environ.get('AUTH_SECRET', 'dev-secret-change-me')
+_signer = URLSafeTimedSerializer(AUTH_SECRET)
 TOKEN_MAX_AGE = 60 * 60 * 24 * 7  # 7 days
 
-def _uid_from_bearer():
-    auth = request.headers.get('Authorization', '')
-    if not auth.startswith('Bearer '): return None
-    token = auth[7:].strip()
+def _verify_token(token: str):
     try:
-        data = _signer.loads(token, max_age=TOKEN_MAX_AGE)
-        return int(data.get('uid'))
+        data, signed_at = _signer.loads(token, max_age=TOKEN_MAX_AGE, return_timestamp=True)
+        return int(data.get('uid')), signed_at.timestamp() + TOKEN_MAX_AGE
     except (BadSignature, SignatureExpired, Exception):
         return None
 
-def get_user_id() -> int:
-    uid = _uid_from_bearer()
+# verified tokens, so repeat requests skip the HMAC; token_cache.revoked can
+# be set to a (uid, token) -> bool check, token_cache.revoke() forgets entries
+token_cache = TokenCache(_verify_token)
+
+def uid_from_auth_header(auth: str):
+    if not auth.startswith('Bearer '): return None
+    return token_cache.uid(auth[7:].strip())
+
+def _uid_from_bearer():
+    return uid_from_auth_header(request.headers.get('Authorization', ''))
+
+def user_id_from(auth: str, args) -> int:
+    uid = uid_from_auth_header(auth)
     if uid is not None: return uid
     try:
-        return int(request.args.get("userId", "1"))
+        return int(args.get("userId", "1"))
     except Exception:
         return 1
 
+def get_user_id() -> int:
+    uid = g.get("_uid")
+    if uid is None:
+        uid = g._uid = user_id_from(request.headers.get('Authorization', ''), request.args)
+    return uid
+
+# ---------- per-user timezone ("today", nutrient_history.local_day) ----------
+# Looked up once per TZ_CACHE_TTL; other workers see a changed zone within that.
+TZ_CACHE_TTL = float(os.environ.get('TZ_CACHE_TTL', '60'))
+USER_TZ_SQL = "SELECT timezone FROM profile WHERE id=%s"
+_tz_cache = {}          # uid -> (ZoneInfo, expires)
+
+def zone(name) -> ZoneInfo:
+    """ZoneInfo for an IANA name such as 'Europe/Paris'; ValueError if unknown."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        raise ValueError(f"unknown timezone: {name!r}")
+
+def remember_tz(uid: int, name) -> ZoneInfo:
+    try: tz = zone(name or "UTC")
+    except ValueError: tz = ZoneInfo("UTC")
+    if len(_tz_cache) >= 10000: _tz_cache.clear()
+    _tz_cache[uid] = (tz, time.monotonic() + TZ_CACHE_TTL)
+    return tz
+
+def cached_tz(uid: int):
+    hit = _tz_cache.get(uid)
+    return hit[0] if hit is not None and hit[1] > time.monotonic() else None
+
+def user_tz(uid: int) -> ZoneInfo:
+    tz = cached_tz(uid)
+    if tz is None:
+        cur = db().cursor()
+        cur.execute(USER_TZ_SQL, (uid,))
+        row = cur.fetchone()
+        cur.close()
+        tz = remember_tz(uid, row[0] if row else None)
+    return tz
+
+def local_today(tz) -> str:
+    return datetime.now(tz).date().isoformat()
+
+def to_utc(value, tz):
+    """Parse an ISO datetime for storage as naive UTC; one without an offset
+    is the user's wall-clock time in `tz`. Returns (utc, local_day)."""
+    dt = datetime.fromisoformat(value) if isinstance(value, str) else value
+    if not isinstance(dt, datetime): raise ValueError(f"not a datetime: {value!r}")
+    if dt.tzinfo is None: dt = dt.replace(tzinfo=tz)
+    return dt.astimezone(timezone.utc).replace(tzinfo=None), dt.astimezone(tz).date()
+
+# ---------- conditional GETs (ETag from per-user data versions) ----------
+# Every write bumps data_versions(user_id, resource) in the same transaction;
+# GETs derive their ETag from those counters, so If-None-Match can be answered
+# with a 304 after one primary-key lookup instead of the real SELECTs.
+VERSIONS_SQL = "SELECT resource, version FROM data_versions WHERE user_id=%s"
+
+def user_versions(uid: int) -> dict:
+    """resource -> version for `uid`, read once per request (@cached and
+    @conditional share it; a write drops it)."""
+    hit = g.get("_versions")
+    if hit is None or hit[0] != uid:
+        cur = db().cursor()
+        cur.execute(VERSIONS_SQL, (uid,))
+        hit = g._versions = (uid, dict(cur.fetchall()))
+        cur.close()
+    return hit[1]
+
+def bump_version(cn, uid: int, *resources) -> int:
+    """Bump `resources` and the user's 'sync' sequence; returns the new sequence.
+    Call it before the write: the lock on the 'sync' row serialises a user's
+    writes, so sequence order is commit order (see /sync)."""
+    cur = cn.cursor()
+    for r in resources:
+        cur.execute("""
+            INSERT INTO data_versions (user_id, resource, version) VALUES (%s,%s,1)
+            ON DUPLICATE KEY UPDATE version=version+1
+        """, (uid, r))
+    cur.execute("""
+        INSERT INTO data_versions (user_id, resource, version) VALUES (%s,'sync',LAST_INSERT_ID(1))
+        ON DUPLICATE KEY UPDATE version=LAST_INSERT_ID(version+1)
+    """, (uid,))
+    seq = cur.lastrowid
+    cur.close()
+    g.pop("_versions", None)
+    # drop cached responses now, and again once the request is over (after
+    # commit), so nothing read in between outlives the write
+    response_cache.invalidate(uid, resources)
+    g.setdefault("_dirty", []).append((uid, resources))
+    return seq
+
+@api.teardown_app_request
+def _invalidate_cache(exc):
+    for uid, resources in g.pop("_dirty", ()):
+        response_cache.invalidate(uid, resources)
+
+def tombstone(cn, uid: int, table: str, row_id: int, seq: int):
+    cur = cn.cursor()
+    cur.execute("""
+        INSERT INTO sync_tombstones (user_id, tbl, row_id, row_version) VALUES (%s,%s,%s,%s)
+        ON DUPLICATE KEY UPDATE row_version=VALUES(row_version)
+    """, (uid, table, row_id, seq))
+    cur.close()
+
+def make_etag(uid: int, resources, versions: dict, path: str, args, vary: str = "") -> str:
+    key = "&".join(f"{k}={v}" for k, v in sorted(args.items()) if k != "userId")
+    digest = hashlib.blake2s(f"{path}?{key}|{vary}".encode(), digest_size=6).hexdigest()
+    vs = ".".join(str(versions.get(r, 0)) for r in resources)
+    return f"{uid}.{vs}.{digest}"
+
+def conditional(*resources, vary=None):
+    """Serve If-None-Match from the data versions of `resources`. `vary(args, tz)`
+    adds anything else the payload depends on (e.g. the user's implicit "today")."""
+    def deco(view):
+        @wraps(view)
+        def wrapper(*a, **kw):
+            uid = get_user_id()
+            versions = user_versions(uid)
+            etag = make_etag(uid, resources, versions, request.path, request.args,
+                             vary(request.args, user_tz(uid)) if vary else "")
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+            else:
+                resp = make_response(view(*a, **kw))
+                if resp.status_code != 200: return resp
+            resp.set_etag(etag, weak=True)
+            return resp
+        wrapper.versioned = (resources, vary)     # read by asgi.py
+        return wrapper
+    return deco
+
+# ---------- response cache (serialized bytes, per user) ----------
+# The key holds the current versions of the view's resources: the cache is
+# per process, and a write served by another serve.py worker cannot drop
+# this one's entries, but it does move the versions on. So a hit costs the
+# one data_versions lookup and is never older than the last commit.
+def cache_key(uid: int, path: str, args, resources, versions: dict, vary=None, tz=None) -> tuple:
+    query = tuple(sorted((k, v) for k, v in args.items() if k != "userId"))
+    return (uid, path, query, tuple(versions.get(r, 0) for r in resources),
+            vary(args, tz) if vary else "")
+
+def cached(*resources):
+    """Keep this GET's 200 body in `response_cache` until a write bumps one
+    of `resources` (or the TTL runs out). A hit skips the view's queries
+    and jsonify."""
+    def deco(view):
+        vary = getattr(view, "versioned", (None, None))[1]
+        @wraps(view)
+        def wrapper(*a, **kw):
+            if not response_cache.enabled or _wants_stream():
+                return view(*a, **kw)
+            uid = get_user_id()
+            key = cache_key(uid, request.path, request.args, resources, user_versions(uid),
+                            vary, user_tz(uid) if vary else None)
+            hit = response_cache.get(key)
+            if hit is not None:
+                body, etag = hit
+                if etag and request.if_none_match.contains_weak(etag):
+                    resp = Response(status=304)
+                else:
+                    resp = Response(body, mimetype="application/json")
+                if etag: resp.set_etag(etag, weak=True)
+                return resp
+            gen = response_cache.generation(uid)
+            resp = make_response(view(*a, **kw))
+            if resp.status_code == 200 and not resp.is_streamed:
+                response_cache.put(key, resources, resp.get_data(), resp.get_etag()[0], gen)
+            return resp
+        wrapper.cached = resources                # read by asgi.py
+        return wrapper
+    return deco
+
 # ---------- health ----------
-@app.get("/__ping")
+@api.get("/__ping")
 def ping(): return ok({"ok": True, "ts": time.time()})
 
-@app.get("/__dbcheck")
+@api.get("/__dbcheck")
 def dbcheck():
     try:
-        cn = get_connection(); cur = cn.cursor()
+        cn = db(); cur = cn.cursor()
         cur.execute("SELECT 1"); cur.fetchone()
-        cur.close(); cn.close()
-        return ok({"ok": True})
+        cur.close()
+        return ok({"ok": True, "pool": get_pool().stats()})
     except Exception as e:
-        app.logger.exception("DB check failed")
+        current_app.logger.exception("DB check failed")
         return err(e, 500)
 
+@api.get("/__cache")
+def cache_stats(): return ok({"responses": response_cache.stats(), "tokens": token_cache.stats(),
+                              "recurrence": recurrence.expansions.stats()})
+
+@api.get("/__metrics")
+def metrics_text():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@metrics.registry.collector
+def _collect():
+    p = get_pool().stats()
+    out = [("gauge", "db_pool_connections", (("state", "in_use"),), p["in_use"]),
+           ("gauge", "db_pool_connections", (("state", "idle"),), p["idle"]),
+           ("gauge", "db_pool_connections", (("state", "max"),), p["size"] + p["max_overflow"]),
+           ("counter", "db_pool_waits_total", (), p["waits"]),
+           ("counter", "db_pool_timeouts_total", (), p["timeouts"]),
+           ("counter", "pwhash_rejected_total", (), pwhash.stats()["rejected"])]
+    for name, st in (("responses", response_cache.stats()), ("tokens", token_cache.stats()),
+                     ("recurrence", recurrence.expansions.stats())):
+        out += [("counter", "cache_hits_total", (("cache", name),), st["hits"]),
+                ("counter", "cache_misses_total", (("cache", name),), st["misses"]),
+                ("counter", "cache_evictions_total", (("cache", name),), st["evictions"])]
+    return out
+
 # =========================================================
 #                          AUTH
 # =========================================================
+# bcrypt runs in pwhash's process pool (BCRYPT_ROUNDS, PW_WORKERS, PW_QUEUE);
+# both raise HashBusy -> 503 when it is saturated
 def _hash_pw(plain: str) -> bytes:
-    return bcrypt.hashpw(plain.encode('utf-8'), bcrypt.gensalt(rounds=12))
+    return pwhash.hash_pw(plain)
 
 def _check_pw(plain: str, hashed: bytes) -> bool:
-    try:    return bcrypt.checkpw(plain.encode('utf-8'), hashed)
-    except: return False
+    return pwhash.check_pw(plain, hashed)
 
 def _make_token(user_id: int) -> str:
     return _signer.dumps({"uid": user_id})
 
-@app.post("/auth/signup")
+@api.post("/auth/signup")
 def auth_signup():
     data = request.get_json(force=True) or {}
     email = (data.get("email") or "").strip().lower()
     password = data.get("password") or ""
     display_name = (data.get("display_name") or "").strip() or "User"
+    tz_name = data.get("timezone") or "UTC"
 
     if not email or not password:
         return err("email and password required", 422)
-
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
-    cur.execute("SELECT id FROM profile WHERE email=%s", (email,))
-    if cur.fetchone():
-        cur.close(); cn.close()
-        return err("email already in use", 409)
-
-    cur.execute("SELECT COALESCE(MAX(id),0)+1 AS next_id FROM profile")
-    next_id = int(cur.fetchone()["next_id"])
+    try: zone(tz_name)
+    except ValueError as e: return err(e, 422)
+
+    # a taken email is answered before paying for a hash; the pooled
+    # connection goes back while bcrypt runs
+    cn = db(); cur = cn.cursor()
+    cur.execute("SELECT 1 FROM profile WHERE email=%s", (email,))
+    taken = cur.fetchone() is not None
+    cur.close()
+    if taken: return err("email already in use", 409)
+    _release_db(None)
 
     pw_hash = _hash_pw(password)
-    cur2 = cn.cursor()
-    cur2.execute("""
-        INSERT INTO profile (id, display_name, email, password_hash)
-        VALUES (%s,%s,%s,%s)
-    """, (next_id, display_name, email, pw_hash))
+
+    # profile.id is AUTO_INCREMENT and email is UNIQUE: one insert allocates
+    # the id and settles races between concurrent signups
+    cn = db(); cur = cn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO profile (display_name, email, password_hash, timezone)
+            VALUES (%s,%s,%s,%s)
+        """, (display_name, email, pw_hash, tz_name))
+    except mysql.connector.IntegrityError as e:
+        cur.close(); cn.rollback()
+        if e.errno == errorcode.ER_DUP_ENTRY: return err("email already in use", 409)
+        raise
+    next_id = cur.lastrowid
     cn.commit()
-    cur2.close(); cur.close(); cn.close()
+    cur.close()
 
     token = _make_token(next_id)
     return ok({"user_id": next_id, "token": token}, 201)
 
-@app.post("/auth/login")
+@api.post("/auth/login")
 def auth_login():
     data = request.get_json(force=True) or {}
     email = (data.get("email") or "").strip().lower()
@@ -149,60 +591,76 @@ def auth_login():
     if not email or not password:
         return err("email and password required", 422)
 
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
+    cn = db(); cur = cn.cursor(dictionary=True)
     cur.execute("SELECT id, password_hash FROM profile WHERE email=%s", (email,))
     row = cur.fetchone()
-    cur.close(); cn.close()
+    cur.close()
+    _release_db(None)                            # not held while bcrypt runs
 
     # Return a clean error for bad creds
     if not row or not row.get("password_hash"):
         return err("invalid credentials", 401)
-    if not _check_pw(password, row["password_hash"].encode('utf-8')):
+    if not _check_pw(password, row["password_hash"]):
         return err("invalid credentials", 401)
 
+    # BCRYPT_ROUNDS changed since this hash was made: upgrade it while we have the password
+    if pwhash.needs_rehash(row["password_hash"]):
+        try:
+            pw_hash = _hash_pw(password)
+            cn = db(); cur = cn.cursor()
+            cur.execute("UPDATE profile SET password_hash=%s WHERE id=%s", (pw_hash, row["id"]))
+            cn.commit(); cur.close()
+        except HashBusy:
+            pass                                   # next login will try again
+
     token = _make_token(int(row["id"]))
     return ok({"user_id": int(row["id"]), "token": token})
 
-@app.get("/auth/me")
+@api.get("/auth/me")
 def auth_me():
     uid = _uid_from_bearer()
     if uid is None: return err("no/invalid token", 401)
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
+    cn = db(); cur = cn.cursor(dictionary=True)
     cur.execute("""
-        SELECT id AS user_id, display_name, email, avatar_url, bio, updated_at
+        SELECT id AS user_id, display_name, email, avatar_url, bio, timezone, updated_at
         FROM profile WHERE id=%s
     """, (uid,))
     row = cur.fetchone()
-    cur.close(); cn.close()
+    cur.close()
     if not row: return err("user not found", 404)
     return ok({k: _coerce(v) for k, v in row.items()})
 
 # =========================================================
 #                          PROFILE
 # =========================================================
-@app.get("/profile")
+@api.get("/profile")
+@cached("profile")
+@conditional("profile")
 def profile_get():
     uid = get_user_id()
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
+    cn = db(); cur = cn.cursor(dictionary=True)
     cur.execute("""
-        SELECT id AS user_id, display_name, email, avatar_url, bio, updated_at
+        SELECT id AS user_id, display_name, email, avatar_url, bio, timezone, updated_at
         FROM profile WHERE id=%s
     """, (uid,))
     row = cur.fetchone()
-    cur.close(); cn.close()
+    cur.close()
     if not row:
         row = {"user_id": uid, "display_name": "Your Name",
                "email": "you@example.com", "avatar_url": None, "bio": "",
-               "updated_at": None}
+               "timezone": "UTC", "updated_at": None}
     return ok({k: _coerce(v) for k, v in row.items()})
 
-@app.put("/profile")
+@api.put("/profile")
 def profile_put():
     uid = get_user_id()
     data = request.get_json(force=True) or {}
 
     # Allow only these fields to be updated
-    allowed = ("display_name", "email", "avatar_url", "bio")
+    allowed = ("display_name", "email", "avatar_url", "bio", "timezone")
+    if "timezone" in data:
+        try: zone(data["timezone"])
+        except ValueError as e: return err(e, 422)
     fields, vals = [], []
 
     for k in allowed:
@@ -213,7 +671,7 @@ def profile_put():
     if not fields:
         return err("no fields", 422)
 
-    cn = get_connection()
+    cn = db()
     cur = cn.cursor()
 
     # 1) Try update first
@@ -222,43 +680,108 @@ def profile_put():
         f"UPDATE profile SET {', '.join(fields)} WHERE id=%s",
         vals_update
     )
-    cn.commit()
 
-    # 2) If no row updated, insert a new row safely
-    if cur.rowcount == 0:
+    # 2) If no row updated, insert a new row safely (rowcount is 0 for an
+    #    existing row left unchanged too, so look before inserting)
+    missing = cur.rowcount == 0
+    if missing:
+        cur.execute("SELECT 1 FROM profile WHERE id=%s", (uid,))
+        missing = cur.fetchone() is None
+    if missing:
         display_name = data.get("display_name", "User")
         email = data.get("email", None)          # allow NULL
         avatar_url = data.get("avatar_url", None)
         bio = data.get("bio", "")
+        tz_name = data.get("timezone", "UTC")
 
         cur.execute("""
-            INSERT INTO profile (id, display_name, email, avatar_url, bio)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (uid, display_name, email, avatar_url, bio))
-        cn.commit()
-
+            INSERT INTO profile (id, display_name, email, avatar_url, bio, timezone)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (uid, display_name, email, avatar_url, bio, tz_name))
+
+    # after the write: data_versions.user_id references profile, so a first
+    # profile row has to exist before its version can be bumped (profile rows
+    # are not in /sync, so the bump need not come first)
+    bump_version(cn, uid, "profile")
+    cn.commit()
     cur.close()
-    cn.close()
+    _tz_cache.pop(uid, None)
     return ok({"ok": True})
 
 # =========================================================
 #                          TASKS
 # =========================================================
-@app.get("/tasks")
-def tasks_list():
-    uid = get_user_id()
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
-    cur.execute("""
+# Read queries return (sql, params) so the sync views and the async ones in
+# asgi.py always run the same SQL.
+TASKS_ORDER = (("done", "ASC"), ("created_at", "DESC"), ("id", "DESC"))
+TASKS_SORTS = {
+    "default": TASKS_ORDER,                            # open first, newest first: idx_tasks_user_done
+    "due":     (("due_date", "ASC"), ("id", "ASC")),   # undated first, then soonest: idx_tasks_user_due
+}
+URGENCIES = (1, 2, 3)
+
+def tasks_order(args):
+    order = TASKS_SORTS.get(args.get("sort") or "default")
+    if order is None: raise BadQuery(f"sort must be one of: {', '.join(TASKS_SORTS)}")
+    return order
+
+def _date_arg(args, name):
+    try: return date.fromisoformat(args[name])
+    except ValueError: raise BadQuery(f"{name} must be YYYY-MM-DD")
+
+def tasks_filter(args):
+    """(" AND ...", params) for ?done=0|1, ?urgency=1[,2...], ?due_on=,
+    ?due_before= and ?due_after= (dates, both exclusive). Any due filter
+    leaves out undated tasks."""
+    sql, params = "", []
+    done = args.get("done")
+    if done:
+        if done not in ("0", "1", "false", "true"): raise BadQuery("done must be 0 or 1")
+        sql += " AND done=%s"; params.append(int(done in ("1", "true")))
+    if args.get("urgency"):
+        try: levels = sorted({int(u) for u in args["urgency"].split(",")})
+        except ValueError: levels = None
+        if not levels or not set(levels) <= set(URGENCIES):
+            raise BadQuery("urgency must be a comma-separated list of 1, 2, 3")
+        sql += f" AND urgency IN ({', '.join(['%s'] * len(levels))})"; params += levels
+    for name, op in (("due_on", "="), ("due_after", ">"), ("due_before", "<")):
+        if args.get(name):
+            sql += f" AND due_date {op} %s"; params.append(_date_arg(args, name))
+    return sql, params
+
+def tasks_query(uid: int, args):
+    order = tasks_order(args)
+    where, fparams = tasks_filter(args)
+    after, params, limit = page_clause(args, order)
+    return (f"""
         SELECT id, user_id, title, urgency, due_date, done, created_at
         FROM tasks
-        WHERE user_id=%s
-        ORDER BY done ASC, created_at DESC
-    """, (uid,))
-    rows = _dict_rows(cur)
-    cur.close(); cn.close()
-    return ok(rows)
+        WHERE user_id=%s{where}{after}
+        ORDER BY {order_by(order)}{limit}
+    """, (uid, *fparams, *params))
+
+def counts_apply(cn, uid: int, task_id: int, sign: int = 1):
+    """Add (sign=1) or take back (sign=-1) task `task_id` in task_counts.
+    Same rules as daily_apply(): after an insert, before a delete, and on
+    both sides of an update."""
+    cur = cn.cursor()
+    cur.execute("""
+        INSERT INTO task_counts (user_id, urgency, dated, total, done)
+        SELECT t.user_id, t.urgency, t.due_date IS NOT NULL, %s, %s*(t.done<>0)
+        FROM tasks t WHERE t.user_id=%s AND t.id=%s
+        ON DUPLICATE KEY UPDATE
+          total=task_counts.total+VALUES(total),
+          done=task_counts.done+VALUES(done)
+    """, (sign, sign, uid, task_id))
+    cur.close()
+
+@api.get("/tasks")
+@conditional("tasks")
+def tasks_list():
+    uid = get_user_id()
+    return list_response(*tasks_query(uid, request.args), tasks_order(request.args))
 
-@app.post("/tasks")
+@api.post("/tasks")
 def tasks_create():
     uid = get_user_id()
     data = request.get_json(force=True) or {}
@@ -266,17 +789,19 @@ def tasks_create():
     urgency = int(data.get("urgency", 1))
     due = data.get("due_date")
     if not title: return err("title required", 422)
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); seq = bump_version(cn, uid, "tasks"); cur = cn.cursor()
     cur.execute("""
-        INSERT INTO tasks (user_id, title, urgency, due_date)
-        VALUES (%s,%s,%s,%s)
-    """, (uid, title, urgency, due))
-    cn.commit()
+        INSERT INTO tasks (user_id, title, urgency, due_date, row_version)
+        VALUES (%s,%s,%s,%s,%s)
+    """, (uid, title, urgency, due, seq))
     new_id = cur.lastrowid
-    cur.close(); cn.close()
+    counts_apply(cn, uid, new_id)
+    search_apply(cn, uid, "task", new_id)
+    cn.commit()
+    cur.close()
     return ok({"id": new_id}, 201)
 
-@app.put("/tasks/<int:task_id>")
+@api.put("/tasks/<int:task_id>")
 def tasks_update(task_id: int):
     uid = get_user_id()
     data = request.get_json(force=True) or {}
@@ -285,82 +810,150 @@ def tasks_update(task_id: int):
         if k in data:
             fields.append(f"{k}=%s"); vals.append(data[k])
     if not fields: return err("no fields to update", 422)
-    vals.extend([uid, task_id])
-    cn = get_connection(); cur = cn.cursor()
+    counted = any(k in data for k in ("urgency", "due_date", "done"))
+    cn = db(); seq = bump_version(cn, uid, "tasks"); cur = cn.cursor()
+    if counted: counts_apply(cn, uid, task_id, -1)
+    fields.append("row_version=%s"); vals.extend([seq, uid, task_id])
     cur.execute(f"UPDATE tasks SET {', '.join(fields)} WHERE user_id=%s AND id=%s", vals)
-    cn.commit()
     count = cur.rowcount
-    cur.close(); cn.close()
-    if count == 0: return err("not found", 404)
+    cur.close()
+    if count == 0: cn.rollback(); return err("not found", 404)
+    if counted: counts_apply(cn, uid, task_id, +1)
+    if "title" in data: search_apply(cn, uid, "task", task_id)
+    cn.commit()
     return ok({"updated": count})
 
-@app.delete("/tasks/<int:task_id>")
+@api.delete("/tasks/<int:task_id>")
 def tasks_delete(task_id: int):
     uid = get_user_id()
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); seq = bump_version(cn, uid, "tasks")
+    counts_apply(cn, uid, task_id, -1)
+    cur = cn.cursor()
     cur.execute("DELETE FROM tasks WHERE user_id=%s AND id=%s", (uid, task_id))
-    cn.commit(); count = cur.rowcount
-    cur.close(); cn.close()
-    if count == 0: return err("not found", 404)
+    count = cur.rowcount
+    cur.close()
+    if count == 0: cn.rollback(); return err("not found", 404)
+    search_apply(cn, uid, "task", task_id)
+    tombstone(cn, uid, "tasks", task_id, seq)
+    cn.commit()
     return ok({"deleted": count})
 
 # =========================================================
 #                           GOAL
 # =========================================================
-@app.get("/goal")
+@api.get("/goal")
+@cached("goal")
 def goal_get():
     uid = get_user_id()
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
+    cn = db(); cur = cn.cursor(dictionary=True)
     cur.execute("SELECT user_id, progress FROM goals WHERE user_id=%s", (uid,))
     row = cur.fetchone()
-    cur.close(); cn.close()
+    cur.close()
     if not row: return ok({"user_id": uid, "progress": 0.0})
     row["user_id"] = uid
     row["progress"] = _coerce(row["progress"])
     return ok(row)
 
-@app.put("/goal")
+@api.put("/goal")
 def goal_put():
     uid = get_user_id()
     data = request.get_json(force=True) or {}
     progress = float(data.get("progress", 0))
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); bump_version(cn, uid, "goal"); cur = cn.cursor()
     cur.execute("""
         INSERT INTO goals (user_id, progress)
         VALUES (%s,%s)
         ON DUPLICATE KEY UPDATE progress=VALUES(progress)
     """, (uid, progress))
     cn.commit()
-    cur.close(); cn.close()
+    cur.close()
     return ok({"ok": True, "progress": progress})
 
+# Task progress comes from task_counts, a few rows per user (urgency x
+# dated) kept in step with `tasks` by counts_apply(), so it never reads
+# the task list. rebuild/verify: python manage.py counts-rebuild | counts-verify
+TASK_COUNTS_SQL = "SELECT urgency, dated, total, done FROM task_counts WHERE user_id=%s"
+
+def progress_payload(rows) -> dict:
+    total = done = 0
+    by_urgency, undated = {}, {"total": 0, "done": 0}
+    for r in rows:
+        n, d = int(r["total"]), int(r["done"])
+        bucket = by_urgency.setdefault(str(r["urgency"]), {"total": 0, "done": 0})
+        for acc in (bucket,) if r["dated"] else (bucket, undated):
+            acc["total"] += n; acc["done"] += d
+        total += n; done += d
+    return {"total": total, "done": done,
+            "progress": round(done / total, 4) if total else 0.0,
+            "by_urgency": by_urgency, "undated": undated}
+
+@api.get("/goal/progress")
+@cached("tasks")
+@conditional("tasks")
+def goal_progress():
+    uid = get_user_id()
+    return ok(progress_payload(query_rows(TASK_COUNTS_SQL, (uid,))))
+
 # =========================================================
 #                        NUTRIENTS
-#   - current = computed from nutrient_history
+#   - current = daily totals of nutrient_history (nutrient_daily)
 #   - goal    = stored in `nutrients` (kind='goal')
 # =========================================================
-@app.get("/nutrients")
+# totals come from nutrient_daily, maintained by daily_apply() on every
+# nutrient_history write: one primary-key lookup instead of a SUM
+NUTRIENT_SUMS_SQL = """
+      SELECT veg_g, carb_g, protein_g
+      FROM nutrient_daily WHERE user_id=%s AND day=%s
+"""
+NUTRIENT_GOAL_SQL = """
+      SELECT veg, carb, protein, updated_at
+      FROM nutrients WHERE user_id=%s AND kind='goal'
+"""
+
+def nutrients_day(args, tz) -> str:
+    # Optional date filter (?date=YYYY-MM-DD), default = today in the user's timezone
+    return args.get("date") or local_today(tz)
+
+@api.get("/nutrients")
+@cached("nutrient_goal", "nutrient_history")
+@conditional("nutrient_goal", "nutrient_history", vary=nutrients_day)
 def nutrients_get():
     uid = get_user_id()
+    day = nutrients_day(request.args, user_tz(uid))
+
+    # 1) CURRENT = that day's totals
+    cn = db(); cur = cn.cursor(dictionary=True)
+    cur.execute(NUTRIENT_SUMS_SQL, (uid, day))
+    sums = cur.fetchone()
+    cur.close()
+
+    # 2) Read GOAL from nutrients(kind='goal')
+    cur = cn.cursor(dictionary=True)
+    cur.execute(NUTRIENT_GOAL_SQL, (uid,))
+    row = cur.fetchone()
+    cur.close()
 
-    # Optional date filter (?date=YYYY-MM-DD), default = today
-    day = request.args.get("date")
-    if not day:
-        day = datetime.utcnow().date().isoformat()
+    return ok(nutrients_payload(day, sums, row))
 
-    # 1) Compute CURRENT from history of that date
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
+def daily_apply(cn, uid: int, hid: int, sign: int = 1):
+    """Add (sign=1) or take back (sign=-1) history row `hid` in nutrient_daily.
+    Call inside the write's transaction: after an insert, before a delete,
+    and on both sides of an update."""
+    cur = cn.cursor()
     cur.execute("""
-      SELECT
-        COALESCE(SUM(veg_g),0)     AS veg_g,
-        COALESCE(SUM(carb_g),0)    AS carb_g,
-        COALESCE(SUM(protein_g),0) AS protein_g
-      FROM nutrient_history
-      WHERE user_id=%s AND DATE(eaten_at)=%s
-    """, (uid, day))
-    sums = cur.fetchone() or {"veg_g":0,"carb_g":0,"protein_g":0}
-    cur.close(); cn.close()
+        INSERT INTO nutrient_daily (user_id, day, veg_g, carb_g, protein_g, entries)
+        SELECT h.user_id, h.local_day, %s*h.veg_g, %s*h.carb_g, %s*h.protein_g, %s
+        FROM nutrient_history h WHERE h.user_id=%s AND h.id=%s
+        ON DUPLICATE KEY UPDATE
+          veg_g=nutrient_daily.veg_g+VALUES(veg_g),
+          carb_g=nutrient_daily.carb_g+VALUES(carb_g),
+          protein_g=nutrient_daily.protein_g+VALUES(protein_g),
+          entries=nutrient_daily.entries+VALUES(entries)
+    """, (sign, sign, sign, sign, uid, hid))
+    cur.close()
 
+def nutrients_payload(day: str, sums, row) -> dict:
+    sums = sums or {"veg_g":0,"carb_g":0,"protein_g":0}
     veg_g = float(sums["veg_g"]); carb_g = float(sums["carb_g"]); protein_g = float(sums["protein_g"])
     total = max(veg_g + carb_g + protein_g, 0.0)
     if total > 0:
@@ -376,25 +969,16 @@ def nutrients_get():
                    "grams": {"veg_g": 0, "carb_g": 0, "protein_g": 0, "total_g": 0},
                    "date": day}
 
-    # 2) Read GOAL from nutrients(kind='goal')
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
-    cur.execute("""
-      SELECT veg, carb, protein, updated_at
-      FROM nutrients WHERE user_id=%s AND kind='goal'
-    """, (uid,))
-    row = cur.fetchone()
-    cur.close(); cn.close()
-
     if row:
         goal = {"veg": float(row["veg"]), "carb": float(row["carb"]),
                 "protein": float(row["protein"]), "updated_at": _coerce(row["updated_at"])}
     else:
         goal = {"veg": 0.48, "carb": 0.30, "protein": 0.22, "updated_at": None}
 
-    return ok({"current": current, "goal": goal})
+    return {"current": current, "goal": goal}
 
 # Keep body-style PUT (backward compat), but only persist GOAL
-@app.put("/nutrients")
+@api.put("/nutrients")
 def nutrients_put_body():
     uid = get_user_id()
     data = request.get_json(force=True) or {}
@@ -405,7 +989,7 @@ def nutrients_put_body():
     return err("only 'goal' is editable now", 422)
 
 # Allow PUT /nutrients/goal
-@app.put("/nutrients/<kind>")
+@api.put("/nutrients/<kind>")
 def nutrients_put(kind: str):
     kind = kind.lower()
     if kind != "goal":
@@ -416,17 +1000,17 @@ def nutrients_put(kind: str):
     return _write_goal(uid, veg, carb, protein)
 
 def _write_goal(uid: int, veg: float, carb: float, protein: float):
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); bump_version(cn, uid, "nutrient_goal"); cur = cn.cursor()
     cur.execute("""
         INSERT INTO nutrients (user_id, kind, veg, carb, protein)
         VALUES (%s,'goal',%s,%s,%s)
         ON DUPLICATE KEY UPDATE veg=VALUES(veg), carb=VALUES(carb), protein=VALUES(protein)
     """, (uid, veg, carb, protein))
-    cn.commit(); cur.close(); cn.close()
+    cn.commit(); cur.close()
     return ok({"ok": True})
 
 #edit
-@app.put("/nutrients/history/<int:hid>")
+@api.put("/nutrients/history/<int:hid>")
 def nutrients_history_update(hid: int):
     uid = get_user_id()
     d = request.get_json(force=True) or {}
@@ -443,101 +1027,221 @@ def nutrients_history_update(hid: int):
     if not fields:
         return err("no fields to update", 422)
 
-    vals += [uid, hid]
+    if "eaten_at" in d:
+        try: utc, local_day = to_utc(d["eaten_at"], user_tz(uid))
+        except ValueError: return err("eaten_at must be an ISO datetime", 422)
+        vals[fields.index("eaten_at=%s")] = utc
+        fields.append("local_day=%s"); vals.append(local_day)
+
+    cn = db()
+    seq = bump_version(cn, uid, "nutrient_history")
+    fields.append("row_version=%s")
+    vals += [seq, uid, hid]
 
-    cn = get_connection()
+    daily_apply(cn, uid, hid, -1)
     cur = cn.cursor()
     cur.execute(
         f"UPDATE nutrient_history SET {', '.join(fields)} WHERE user_id=%s AND id=%s",
         vals
     )
-    cn.commit()
     count = cur.rowcount
     cur.close()
-    cn.close()
 
     if count == 0:
+        cn.rollback()
         return err("not found", 404)
+    daily_apply(cn, uid, hid, +1)
+    cn.commit()
 
     return ok({"updated": count})
 
 # =========================================================
 #                         DIARY
 # =========================================================
-@app.get("/diary")
-def diary_list():
-    uid = get_user_id()
-    d = request.args.get("date")  # YYYY-MM-DD
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
+DIARY_ORDER     = (("entry_date", "DESC"), ("created_at", "DESC"), ("id", "DESC"))
+DIARY_DAY_ORDER = (("created_at", "DESC"), ("id", "DESC"))
+
+def diary_order(args):
+    return DIARY_DAY_ORDER if args.get("date") else DIARY_ORDER
+
+def diary_query(uid: int, args):
+    d = args.get("date")  # YYYY-MM-DD
+    order = diary_order(args)
+    after, params, limit = page_clause(args, order)
     if d:
-        cur.execute("""
+        return (f"""
             SELECT id, user_id, entry_date, title, content, mood, created_at, updated_at
             FROM diary_entries
-            WHERE user_id=%s AND entry_date=%s
-            ORDER BY created_at DESC
-        """, (uid, d))
-    else:
-        cur.execute("""
+            WHERE user_id=%s AND entry_date=%s{after}
+            ORDER BY {order_by(order)}{limit}
+        """, (uid, d, *params))
+    return (f"""
             SELECT id, user_id, entry_date, title, content, mood, created_at, updated_at
             FROM diary_entries
-            WHERE user_id=%s
-            ORDER BY entry_date DESC, created_at DESC
-            LIMIT 50
-        """, (uid,))
-    rows = _dict_rows(cur)
-    cur.close(); cn.close()
-    return ok(rows)
-
-@app.post("/diary")
+            WHERE user_id=%s{after}
+            ORDER BY {order_by(order)}
+            {limit or "LIMIT 50"}
+        """, (uid, *params))
+
+@api.get("/diary")
+def diary_list():
+    uid = get_user_id()
+    rows = query_rows(*diary_query(uid, request.args))
+    return ok(page(rows, request.args, diary_order(request.args)))
+
+@api.post("/diary")
 def diary_add():
     uid = get_user_id()
     data = request.get_json(force=True) or {}
-    entry_date = data.get("date") or datetime.utcnow().date().isoformat()
+    entry_date = data.get("date") or local_today(user_tz(uid))
     title = (data.get("title") or "").strip()
     content = (data.get("content") or "").strip()
     mood = data.get("mood")
     if not title and not content:
         return err("title or content required", 422)
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); seq = bump_version(cn, uid, "diary"); cur = cn.cursor()
     cur.execute("""
-        INSERT INTO diary_entries (user_id, entry_date, title, content, mood)
-        VALUES (%s,%s,%s,%s,%s)
-    """, (uid, entry_date, title, content, mood))
-    cn.commit()
+        INSERT INTO diary_entries (user_id, entry_date, title, content, mood, row_version)
+        VALUES (%s,%s,%s,%s,%s,%s)
+    """, (uid, entry_date, title, content, mood, seq))
     new_id = cur.lastrowid
-    cur.close(); cn.close()
+    cur.close()
+    search_apply(cn, uid, "diary", new_id)
+    cn.commit()
     return ok({"id": new_id}, 201)
 
-@app.delete("/diary/<int:item_id>")
+@api.delete("/diary/<int:item_id>")
 def diary_delete(item_id: int):
     uid = get_user_id()
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); seq = bump_version(cn, uid, "diary"); cur = cn.cursor()
     cur.execute("DELETE FROM diary_entries WHERE user_id=%s AND id=%s", (uid, item_id))
-    cn.commit(); count = cur.rowcount
-    cur.close(); cn.close()
-    if count == 0: return err("not found", 404)
+    count = cur.rowcount
+    cur.close()
+    if count == 0: cn.rollback(); return err("not found", 404)
+    search_apply(cn, uid, "diary", item_id)
+    tombstone(cn, uid, "diary_entries", item_id, seq)
+    cn.commit()
     return ok({"deleted": count})
 
 # =========================================================
 #                     CALENDAR EVENTS
 # =========================================================
-@app.get("/calendar/events")
+# An event occupies [starts_at, span_end): span_end is a generated column
+# (mobile.sql) that gives all-day events whole days and a timed event
+# without ends_at no length. It overlaps the window [ws, we) when
+# starts_at < we AND (span_end > ws OR starts_at >= ws), which is three
+# index ranges instead of one scan over the user's whole history:
+#   1. events starting inside the window          idx_cal_user_time
+#   2. events that started earlier and still run  calendar_days(user, day=ws)
+#   3. the same for long events (long_span=1, no  idx_cal_user_long
+#      calendar_days rows; a user has few)
+# A recurring event (rrule set) is one row for the whole series, found by
+# series_query() and expanded in Python for the window only (recurrence.py).
+# Its occurrences come back as rows with the series' id and rrule.
+CALENDAR_ORDER = (("starts_at", "ASC"), ("id", "ASC"))
+CALENDAR_COLS = ("e.id, e.user_id, e.title, e.note, e.starts_at, e.ends_at, e.all_day, e.color, "
+                 "e.created_at, e.rrule")
+
+def calendar_window(args):
+    """?start=&end= (YYYY-MM-DD, both days included) -> (ws, we) datetimes."""
+    if not args.get("start") or not args.get("end"):
+        raise ValueError("start and end required (YYYY-MM-DD)")
+    try: start, end = date.fromisoformat(args["start"]), date.fromisoformat(args["end"])
+    except ValueError: raise ValueError("start and end must be YYYY-MM-DD")
+    if end < start: raise ValueError("end is before start")
+    midnight = datetime.min.time()
+    return datetime.combine(start, midnight), datetime.combine(end + timedelta(days=1), midnight)
+
+def calendar_query(uid: int, args):
+    ws, we = calendar_window(args)
+    after, params, limit = page_clause(args, (("e.starts_at", "ASC"), ("e.id", "ASC")))
+    return (f"""
+        SELECT * FROM (
+          (SELECT {CALENDAR_COLS} FROM calendar_events e
+           WHERE e.user_id=%s AND e.starts_at>=%s AND e.starts_at<%s AND e.recurring=0{after}
+           ORDER BY e.starts_at, e.id{limit})
+          UNION ALL
+          (SELECT {CALENDAR_COLS} FROM calendar_days d JOIN calendar_events e ON e.id=d.event_id
+           WHERE d.user_id=%s AND d.day=%s AND e.starts_at<%s AND e.span_end>%s{after})
+          UNION ALL
+          (SELECT {CALENDAR_COLS} FROM calendar_events e
+           WHERE e.user_id=%s AND e.long_span=1 AND e.starts_at<%s AND e.span_end>%s
+             AND e.recurring=0{after})
+        ) ev
+        ORDER BY {order_by(CALENDAR_ORDER)}{limit}
+    """, (uid, ws, we, *params,
+          uid, ws.date(), ws, ws, *params,
+          uid, ws, ws, *params))
+
+def series_query(uid: int, args):
+    ws, we = calendar_window(args)
+    return (f"""
+        SELECT {CALENDAR_COLS}, e.exdates, e.row_version
+        FROM calendar_events e
+        WHERE e.user_id=%s AND e.recurring=1 AND e.starts_at<%s
+          AND (e.series_end IS NULL OR e.series_end>=%s)
+    """, (uid, we, ws))
+
+def _dt(v):
+    return v if isinstance(v, datetime) else datetime.fromisoformat(str(v))
+
+def _fmt(v: datetime) -> str:
+    return v.isoformat(" ", "seconds")
+
+def series_occurrences(s, ws, we) -> list:
+    """Rows for the occurrences of series row `s` overlapping [ws, we)."""
+    start = _dt(s["starts_at"])
+    length = _dt(s["ends_at"]) - start if s["ends_at"] else timedelta(0)
+    def expand():
+        exdates = [_dt(x) for x in (s["exdates"] or "").split(",") if x]
+        return recurrence.occurrences(start, length, bool(s["all_day"]), recurrence.parse(s["rrule"]),
+                                      ws, we, exdates)
+    row = {k: v for k, v in s.items() if k not in ("exdates", "row_version")}
+    return [dict(row, starts_at=_fmt(o), ends_at=_fmt(o + length) if s["ends_at"] else None)
+            for o in recurrence.expansions.get((s["id"], s["row_version"], ws, we), expand)]
+
+def calendar_rows(args, singles, series) -> list:
+    """calendar_query() rows plus the window's occurrences of every
+    series_query() row, in CALENDAR_ORDER (one page + 1 if paginated)."""
+    ws, we = calendar_window(args)
+    rows = list(singles)
+    after = tuple(decode_cursor(args["cursor"], 2)) if paginated(args) and args["cursor"] else None
+    for s in series:
+        try: occ = series_occurrences(s, ws, we)
+        except ValueError as e: raise BadQuery(str(e))
+        rows += [o for o in occ if after is None or (o["starts_at"], o["id"]) > after]
+    rows.sort(key=lambda r: (str(r["starts_at"]), r["id"]))
+    return rows[:page_limit(args) + 1] if paginated(args) else rows
+
+# one row per day an event touches: its first day, then every midnight before span_end
+CALENDAR_DAYS_SQL = """
+    INSERT INTO calendar_days (user_id, day, event_id)
+    WITH RECURSIVE d (user_id, event_id, day, span_end) AS (
+      SELECT user_id, id, DATE(starts_at), span_end FROM calendar_events
+      WHERE long_span=0 AND recurring=0 {where}
+      UNION ALL
+      SELECT user_id, event_id, day + INTERVAL 1 DAY, span_end FROM d
+      WHERE day + INTERVAL 1 DAY < span_end
+    )
+    SELECT user_id, day, event_id FROM d
+"""
+
+def calendar_days_apply(cn, uid: int, eid: int):
+    """Write event `eid`'s calendar_days rows (none for a long event). Call
+    after the insert, in its transaction; deletes cascade."""
+    cur = cn.cursor()
+    cur.execute(CALENDAR_DAYS_SQL.format(where="AND user_id=%s AND id=%s"), (uid, eid))
+    cur.close()
+
+@api.get("/calendar/events")
 def calendar_events_list():
     uid = get_user_id()
-    start = request.args.get("start"); end = request.args.get("end")
-    if not start or not end: return err("start and end required (YYYY-MM-DD)", 422)
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
-    cur.execute("""
-        SELECT id, user_id, title, note, starts_at, ends_at, all_day, color, created_at
-        FROM calendar_events
-        WHERE user_id=%s AND starts_at>=CONCAT(%s,' 00:00:00') AND ends_at<=CONCAT(%s,' 23:59:59')
-        ORDER BY starts_at ASC
-    """, (uid, start, end))
-    rows = _dict_rows(cur)
-    cur.close(); cn.close()
-    return ok(rows)
-
-@app.post("/calendar/events")
+    try: query, series = calendar_query(uid, request.args), series_query(uid, request.args)
+    except ValueError as e: return err(e, 422)
+    rows = calendar_rows(request.args, query_rows(*query), query_rows(*series))
+    return ok(page(rows, request.args, CALENDAR_ORDER))
+
+@api.post("/calendar/events")
 def calendar_events_add():
     uid = get_user_id()
     data = request.get_json(force=True) or {}
@@ -547,53 +1251,196 @@ def calendar_events_add():
     note      = data.get("note")
     all_day   = int(bool(data.get("all_day", 0)))
     color     = data.get("color")
+    rrule     = data.get("rrule") or None         # e.g. "FREQ=WEEKLY;INTERVAL=2;COUNT=10"
     if not title or not starts_at:
         return err("title and starts_at required", 422)
-    cn = get_connection(); cur = cn.cursor()
+    try:
+        start = datetime.fromisoformat(starts_at)
+        if ends_at and datetime.fromisoformat(ends_at) < start:
+            return err("ends_at is before starts_at", 422)
+        exdates = [datetime.fromisoformat(x) for x in data.get("exdates") or ()]
+    except (TypeError, ValueError):
+        return err("starts_at, ends_at and exdates must be YYYY-MM-DD[ HH:MM[:SS]]", 422)
+    if exdates and not rrule:
+        return err("exdates need an rrule", 422)
+    series_end = None
+    if rrule:
+        try:
+            length = datetime.fromisoformat(ends_at) - start if ends_at else timedelta(0)
+            series_end = recurrence.series_end(start, length, bool(all_day), recurrence.parse(rrule))
+        except ValueError as e:
+            return err(f"rrule: {e}", 422)
+    cn = db(); seq = bump_version(cn, uid, "calendar"); cur = cn.cursor()
     cur.execute("""
-        INSERT INTO calendar_events (user_id, title, note, starts_at, ends_at, all_day, color)
-        VALUES (%s,%s,%s,%s,%s,%s,%s)
-    """, (uid, title, note, starts_at, ends_at, all_day, color))
-    cn.commit()
+        INSERT INTO calendar_events (user_id, title, note, starts_at, ends_at, all_day, color,
+                                     rrule, exdates, series_end, row_version)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+    """, (uid, title, note, starts_at, ends_at, all_day, color,
+          rrule, ",".join(map(_fmt, exdates)) or None, series_end, seq))
     new_id = cur.lastrowid
-    cur.close(); cn.close()
+    cur.close()
+    calendar_days_apply(cn, uid, new_id)
+    search_apply(cn, uid, "event", new_id)
+    cn.commit()
     return ok({"id": new_id}, 201)
 
-@app.delete("/calendar/events/<int:eid>")
+@api.delete("/calendar/events/<int:eid>")
 def calendar_events_delete(eid: int):
     uid = get_user_id()
-    cn = get_connection(); cur = cn.cursor()
+    if request.args.get("occurrence"):
+        return _calendar_skip(uid, eid, request.args["occurrence"])
+    cn = db(); seq = bump_version(cn, uid, "calendar"); cur = cn.cursor()
     cur.execute("DELETE FROM calendar_events WHERE user_id=%s AND id=%s", (uid, eid))
-    cn.commit(); count = cur.rowcount
-    cur.close(); cn.close()
-    if count == 0: return err("not found", 404)
+    count = cur.rowcount
+    cur.close()
+    if count == 0: cn.rollback(); return err("not found", 404)
+    search_apply(cn, uid, "event", eid)
+    tombstone(cn, uid, "calendar_events", eid, seq)
+    cn.commit()
     return ok({"deleted": count})
 
+def _calendar_skip(uid: int, eid: int, occurrence: str):
+    """DELETE ?occurrence=<its starts_at>: one occurrence of a series -> exdates."""
+    try: occurrence = _fmt(datetime.fromisoformat(occurrence))
+    except ValueError: return err("occurrence must be YYYY-MM-DD HH:MM:SS", 422)
+    cn = db(); seq = bump_version(cn, uid, "calendar"); cur = cn.cursor()
+    cur.execute("""
+        UPDATE calendar_events SET exdates=CONCAT_WS(',', exdates, %s), row_version=%s
+        WHERE user_id=%s AND id=%s AND recurring=1
+    """, (occurrence, seq, uid, eid))
+    count = cur.rowcount
+    cur.close()
+    if count == 0: cn.rollback(); return err("not found", 404)
+    cn.commit()
+    return ok({"deleted": 1, "occurrence": occurrence})
+
 # =========================================================
-#                         FOODS (catalog)
+#                          AGENDA
 # =========================================================
-@app.get("/foods")
-def foods_list():
+# One response per month view: per-day buckets of tasks due, calendar
+# events (series expanded) and diary entries, from one index range each.
+# ?counts=1 returns only per-day counts (month dots).
+AGENDA_MAX_DAYS = int(os.environ.get('AGENDA_MAX_DAYS', '92'))
+
+def agenda_window(args):
+    ws, we = calendar_window(args)
+    if (we - ws).days > AGENDA_MAX_DAYS:
+        raise BadQuery(f"at most {AGENDA_MAX_DAYS} days per request")
+    return ws, we
+
+def agenda_counts(args) -> bool:
+    return args.get("counts") in ("1", "true")
+
+def agenda_queries(uid: int, args) -> dict:
+    """name -> (sql, params); run them in any order (or concurrently)."""
+    ws, we = agenda_window(args)
+    first, last = ws.date(), we.date() - timedelta(days=1)
+    window = {"start": args["start"], "end": args["end"]}
+    queries = {"events": calendar_query(uid, window), "series": series_query(uid, window)}
+    if agenda_counts(args):
+        queries["tasks"] = ("""
+            SELECT due_date AS day, COUNT(*) AS n, SUM(done=0) AS open
+            FROM tasks WHERE user_id=%s AND due_date BETWEEN %s AND %s
+            GROUP BY due_date
+        """, (uid, first, last))
+        queries["diary"] = ("""
+            SELECT entry_date AS day, COUNT(*) AS n
+            FROM diary_entries WHERE user_id=%s AND entry_date BETWEEN %s AND %s
+            GROUP BY entry_date
+        """, (uid, first, last))
+    else:
+        queries["tasks"] = ("""
+            SELECT id, title, urgency, due_date, done
+            FROM tasks WHERE user_id=%s AND due_date BETWEEN %s AND %s
+            ORDER BY due_date, id
+        """, (uid, first, last))
+        queries["diary"] = ("""
+            SELECT id, entry_date, title, mood
+            FROM diary_entries WHERE user_id=%s AND entry_date BETWEEN %s AND %s
+            ORDER BY entry_date, created_at, id
+        """, (uid, first, last))
+    return queries
+
+def event_days(row, ws, we) -> list:
+    """The days of [ws, we) that event (or occurrence) `row` touches."""
+    start = _dt(row["starts_at"])
+    length = _dt(row["ends_at"]) - start if row["ends_at"] else timedelta(0)
+    begin, end = recurrence.span(start, length, bool(row["all_day"]))
+    day = max(begin, ws).date()
+    last = (min(end, we) - timedelta(microseconds=1)).date() if end > begin else begin.date()
+    return [day + timedelta(days=i) for i in range((last - day).days + 1)]
+
+def agenda_payload(args, rows: dict) -> dict:
+    """agenda_queries() results -> {"start", "end", "days": {"YYYY-MM-DD": ...}}."""
+    ws, we = agenda_window(args)
+    window = {"start": args["start"], "end": args["end"]}
+    events = calendar_rows(window, rows["events"], rows["series"])
+    days = {}
+    if agenda_counts(args):
+        day = lambda d: days.setdefault(str(d), {"tasks": 0, "tasks_open": 0, "events": 0, "diary": 0})
+        for r in rows["tasks"]:
+            day(r["day"]).update(tasks=int(r["n"]), tasks_open=int(r["open"]))
+        for r in rows["diary"]:
+            day(r["day"])["diary"] = int(r["n"])
+        for e in events:
+            for d in event_days(e, ws, we): day(d)["events"] += 1
+    else:
+        day = lambda d: days.setdefault(str(d), {"tasks": [], "events": [], "diary": []})
+        for r in rows["tasks"]:
+            day(r["due_date"])["tasks"].append(r)
+        for r in rows["diary"]:
+            day(r["entry_date"])["diary"].append(r)
+        for e in events:
+            for d in event_days(e, ws, we): day(d)["events"].append(e)
+    return {"start": args["start"], "end": args["end"], "days": dict(sorted(days.items()))}
+
+@api.get("/agenda")
+@cached("tasks", "calendar", "diary")
+@conditional("tasks", "calendar", "diary")
+def agenda():
     uid = get_user_id()
-    q = (request.args.get("q") or "").strip()
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
-    if q:
-        cur.execute("""
+    try: queries = agenda_queries(uid, request.args)
+    except ValueError as e: return err(e, 422)
+    return ok(agenda_payload(request.args, {k: query_rows(*q) for k, q in queries.items()}))
+
+# =========================================================
+#                         FOODS (catalog)
+# =========================================================
+FOODS_ORDER = (("name", "ASC"),)          # unique per user (uq_food_user_name)
+
+def foods_query(uid: int, args):
+    # ?q= matches words of the name by prefix through search_index ("app"
+    # finds "Green apple"); a LIKE '%q%' would read every food the user has
+    q = (args.get("q") or "").strip()
+    after, params, limit = page_clause(args, FOODS_ORDER)
+    qterms = search.query_terms(q)
+    if qterms:
+        match = " ".join(["AND id IN (SELECT row_id FROM search_index "
+                          "WHERE user_id=%s AND kind='food' AND term LIKE %s)"] * len(qterms))
+        return (f"""
           SELECT id, user_id, name, veg_g, carb_g, protein_g, per_unit_g, created_at
-          FROM food_items WHERE user_id=%s AND name LIKE %s
-          ORDER BY name ASC
-        """, (uid, f"%{q}%"))
-    else:
-        cur.execute("""
+          FROM food_items WHERE user_id=%s {match}{after}
+          ORDER BY name ASC{limit}
+        """, (uid, *(p for t in qterms for p in (uid, search.like_prefix(t))), *params))
+    if q:   # a single letter (or only stopwords): names starting with it
+        return (f"""
+          SELECT id, user_id, name, veg_g, carb_g, protein_g, per_unit_g, created_at
+          FROM food_items WHERE user_id=%s AND name LIKE %s{after}
+          ORDER BY name ASC{limit}
+        """, (uid, search.like_prefix(q), *params))
+    return (f"""
           SELECT id, user_id, name, veg_g, carb_g, protein_g, per_unit_g, created_at
-          FROM food_items WHERE user_id=%s
-          ORDER BY name ASC
-        """, (uid,))
-    rows = _dict_rows(cur)
-    cur.close(); cn.close()
-    return ok(rows)
-
-@app.post("/foods")
+          FROM food_items WHERE user_id=%s{after}
+          ORDER BY name ASC{limit}
+        """, (uid, *params))
+
+@api.get("/foods")
+@cached("foods")
+def foods_list():
+    uid = get_user_id()
+    return list_response(*foods_query(uid, request.args), FOODS_ORDER)
+
+@api.post("/foods")
 def foods_create():
     uid = get_user_id()
     d = request.get_json(force=True) or {}
@@ -601,16 +1448,18 @@ def foods_create():
     if not name: return err("name required", 422)
     veg = float(d.get("veg_g", 0)); carb = float(d.get("carb_g", 0)); prot = float(d.get("protein_g", 0))
     per  = float(d.get("per_unit_g", 100))
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); seq = bump_version(cn, uid, "foods"); cur = cn.cursor()
     cur.execute("""
-      INSERT INTO food_items (user_id, name, veg_g, carb_g, protein_g, per_unit_g)
-      VALUES (%s,%s,%s,%s,%s,%s)
-    """, (uid, name, veg, carb, prot, per))
-    cn.commit(); nid = cur.lastrowid
-    cur.close(); cn.close()
+      INSERT INTO food_items (user_id, name, veg_g, carb_g, protein_g, per_unit_g, row_version)
+      VALUES (%s,%s,%s,%s,%s,%s,%s)
+    """, (uid, name, veg, carb, prot, per, seq))
+    nid = cur.lastrowid
+    cur.close()
+    search_apply(cn, uid, "food", nid)
+    cn.commit()
     return ok({"id": nid}, 201)
 
-@app.put("/foods/<int:fid>")
+@api.put("/foods/<int:fid>")
 def foods_update(fid):
     uid = get_user_id()
     d = request.get_json(force=True) or {}
@@ -618,56 +1467,72 @@ def foods_update(fid):
     for k in ("name", "veg_g", "carb_g", "protein_g", "per_unit_g"):
         if k in d: fields.append(f"{k}=%s"); vals.append(d[k])
     if not fields: return err("no fields", 422)
-    vals += [uid, fid]
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); seq = bump_version(cn, uid, "foods"); cur = cn.cursor()
+    fields.append("row_version=%s"); vals += [seq, uid, fid]
     cur.execute(f"UPDATE food_items SET {', '.join(fields)} WHERE user_id=%s AND id=%s", vals)
-    cn.commit(); count = cur.rowcount
-    cur.close(); cn.close()
-    return ok({"updated": count}) if count else err("not found", 404)
+    count = cur.rowcount
+    cur.close()
+    if count == 0: cn.rollback(); return err("not found", 404)
+    if "name" in d: search_apply(cn, uid, "food", fid)
+    cn.commit()
+    return ok({"updated": count})
 
-@app.delete("/foods/<int:fid>")
+@api.delete("/foods/<int:fid>")
 def foods_delete(fid):
     uid = get_user_id()
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); seq = bump_version(cn, uid, "foods", "nutrient_history"); cur = cn.cursor()
+    # the FK sets nutrient_history.food_id to NULL: stamp those rows so /sync sees it
+    cur.execute("UPDATE nutrient_history SET row_version=%s WHERE user_id=%s AND food_id=%s",
+                (seq, uid, fid))
     cur.execute("DELETE FROM food_items WHERE user_id=%s AND id=%s", (uid, fid))
-    cn.commit(); count = cur.rowcount
-    cur.close(); cn.close()
-    return ok({"deleted": count}) if count else err("not found", 404)
+    count = cur.rowcount
+    cur.close()
+    if count == 0: cn.rollback(); return err("not found", 404)
+    search_apply(cn, uid, "food", fid)
+    tombstone(cn, uid, "food_items", fid, seq)
+    cn.commit()
+    return ok({"deleted": count})
 
 # =========================================================
 #                   NUTRIENT HISTORY (list/add/remove)
 # =========================================================
-@app.get("/nutrients/history")
-def nutrients_history_list():
-    uid = get_user_id()
-    limit = int(request.args.get("limit", "20"))
-    day   = request.args.get("date")  # optional YYYY-MM-DD
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
+HISTORY_ORDER = (("eaten_at", "DESC"), ("id", "DESC"))
+HISTORY_PAGE  = 20
+
+def history_query(uid: int, args):
+    day   = args.get("date")  # optional YYYY-MM-DD
+    after, params, limit = page_clause(args, HISTORY_ORDER, HISTORY_PAGE)
+    if not limit:
+        limit, params = " LIMIT %s", [page_limit(args, HISTORY_PAGE)]
     if day:
-        cur.execute("""
-          SELECT id, user_id, eaten_at, food_id, name, veg_g, carb_g, protein_g, amount_g, note
+        return (f"""
+          SELECT id, user_id, eaten_at, local_day, food_id, name, veg_g, carb_g, protein_g, amount_g, note
           FROM nutrient_history
-          WHERE user_id=%s AND DATE(eaten_at) = %s
-          ORDER BY eaten_at DESC
-          LIMIT %s
-        """, (uid, day, limit))
-    else:
-        cur.execute("""
-          SELECT id, user_id, eaten_at, food_id, name, veg_g, carb_g, protein_g, amount_g, note
+          WHERE user_id=%s AND local_day = %s{after}
+          ORDER BY {order_by(HISTORY_ORDER)}{limit}
+        """, (uid, day, *params))
+    return (f"""
+          SELECT id, user_id, eaten_at, local_day, food_id, name, veg_g, carb_g, protein_g, amount_g, note
           FROM nutrient_history
-          WHERE user_id=%s
-          ORDER BY eaten_at DESC
-          LIMIT %s
-        """, (uid, limit))
-    rows = _dict_rows(cur); cur.close(); cn.close()
-    return ok(rows)
-
-@app.post("/nutrients/history")
+          WHERE user_id=%s{after}
+          ORDER BY {order_by(HISTORY_ORDER)}{limit}
+        """, (uid, *params))
+
+@api.get("/nutrients/history")
+@conditional("nutrient_history")
+def nutrients_history_list():
+    uid = get_user_id()
+    rows = query_rows(*history_query(uid, request.args))
+    return ok(page(rows, request.args, HISTORY_ORDER, HISTORY_PAGE))
+
+@api.post("/nutrients/history")
 def nutrients_history_add():
     uid = get_user_id()
     d = request.get_json(force=True) or {}
-    eaten_at = d.get("eaten_at")  # optional ISO string
-    cn = get_connection(); cur = cn.cursor(dictionary=True)
+    # optional ISO string; stored in UTC, its day taken in the user's timezone
+    try: eaten_at, local_day = to_utc(d.get("eaten_at") or datetime.now(timezone.utc), user_tz(uid))
+    except ValueError: return err("eaten_at must be an ISO datetime", 422)
+    cn = db(); cur = cn.cursor(dictionary=True)
 
     if d.get("food_id"):
         fid = int(d["food_id"])
@@ -676,7 +1541,7 @@ def nutrients_history_add():
                     (uid, fid))
         row = cur.fetchone()
         if not row:
-            cur.close(); cn.close()
+            cur.close()
             return err("food not found", 404)
         scale = amt / float(row["per_unit_g"])
         veg = float(row["veg_g"]) * scale
@@ -689,25 +1554,290 @@ def nutrients_history_add():
         carb = float(d.get("carb_g", 0))
         prot = float(d.get("protein_g", 0))
 
+    seq = bump_version(cn, uid, "nutrient_history")
     cur2 = cn.cursor()
     cur2.execute("""
-      INSERT INTO nutrient_history (user_id, eaten_at, food_id, name, veg_g, carb_g, protein_g, amount_g, note)
-      VALUES (%s, COALESCE(%s, NOW()), %s, %s, %s, %s, %s, %s, %s)
-    """, (uid, eaten_at, d.get("food_id"), name, veg, carb, prot,
-          d.get("amount_g"), d.get("note")))
-    cn.commit(); nid = cur2.lastrowid
-    cur2.close(); cur.close(); cn.close()
+      INSERT INTO nutrient_history (user_id, eaten_at, local_day, food_id, name, veg_g, carb_g, protein_g, amount_g, note, row_version)
+      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (uid, eaten_at, local_day, d.get("food_id"), name, veg, carb, prot,
+          d.get("amount_g"), d.get("note"), seq))
+    nid = cur2.lastrowid
+    daily_apply(cn, uid, nid)
+    cn.commit()
+    cur2.close(); cur.close()
     return ok({"id": nid}, 201)
 
-@app.delete("/nutrients/history/<int:hid>")
+@api.delete("/nutrients/history/<int:hid>")
 def nutrients_history_delete(hid):
     uid = get_user_id()
-    cn = get_connection(); cur = cn.cursor()
+    cn = db(); seq = bump_version(cn, uid, "nutrient_history"); cur = cn.cursor()
+    daily_apply(cn, uid, hid, -1)
     cur.execute("DELETE FROM nutrient_history WHERE user_id=%s AND id=%s", (uid, hid))
-    cn.commit(); count = cur.rowcount
-    cur.close(); cn.close()
-    return ok({"deleted": count}) if count else err("not found", 404)
+    count = cur.rowcount
+    cur.close()
+    if count == 0: cn.rollback(); return err("not found", 404)
+    tombstone(cn, uid, "nutrient_history", hid, seq)
+    cn.commit()
+    return ok({"deleted": count})
+
+# =========================================================
+#                          SEARCH
+# =========================================================
+# search_index (mobile.sql) maps each word of a diary entry, task, event
+# or food to the rows holding it, with a weight (search.py). Every term of
+# ?q= is a prefix range of its primary key; a row must match all of them
+# and is ranked by the summed weights, a whole-word match counting double.
+# The writes below keep it in step through search_apply().
+SEARCH_ORDER = (("score", "DESC"), ("kind", "ASC"), ("row_id", "DESC"))
+SEARCH_ROWS = {     # kind -> its rows as (id, title, date, body)
+    "diary": "SELECT id, title, entry_date AS date, content AS body FROM diary_entries",
+    "task":  "SELECT id, title, due_date AS date, NULL AS body FROM tasks",
+    "event": "SELECT id, title, starts_at AS date, note AS body FROM calendar_events",
+    "food":  "SELECT id, name AS title, NULL AS date, NULL AS body FROM food_items",
+}
+
+def search_apply(cn, uid: int, kind: str, row_id: int):
+    """Re-index row `row_id` of `kind`: drop its terms and add the current
+    ones (none once it is deleted). Call after the write, in its transaction."""
+    table, weights = search.SOURCES[kind]
+    cur = cn.cursor()
+    cur.execute("DELETE FROM search_index WHERE user_id=%s AND kind=%s AND row_id=%s",
+                (uid, kind, row_id))
+    cur.execute(f"SELECT {', '.join(weights)} FROM {table} WHERE user_id=%s AND id=%s",
+                (uid, row_id))
+    row = cur.fetchone()
+    rows = search.index_rows(uid, kind, row_id, dict(zip(weights, row))) if row else []
+    if rows: cur.executemany(search.INSERT_SQL, rows)
+    cur.close()
+
+def search_kinds(args) -> list:
+    kinds = [k for k in (args.get("kind") or "").split(",") if k]
+    bad = [k for k in kinds if k not in search.SOURCES]
+    if bad: raise BadQuery(f"kind must be any of {', '.join(search.SOURCES)}")
+    return kinds
+
+def search_query(uid: int, qterms, kinds, args):
+    """(sql, params) -> (kind, row_id, score) of the rows matching every term."""
+    after, params, limit = page_clause(args, SEARCH_ORDER)
+    in_kind = f" AND kind IN ({', '.join(['%s'] * len(kinds))})" if kinds else ""
+    branches, bparams = [], []
+    for t in qterms:
+        branches.append(f"""
+            SELECT kind, row_id, MAX(weight * IF(term=%s, 2, 1)) AS s
+            FROM search_index WHERE user_id=%s AND term LIKE %s{in_kind}
+            GROUP BY kind, row_id""")
+        bparams += [t, uid, search.like_prefix(t), *kinds]
+    return (f"""
+        SELECT kind, row_id, CAST(SUM(s) AS UNSIGNED) AS score
+        FROM ({" UNION ALL ".join(branches)}) m
+        GROUP BY kind, row_id
+        HAVING COUNT(*)=%s{after}
+        ORDER BY {order_by(SEARCH_ORDER)}
+        {limit or f"LIMIT {PAGE_SIZE}"}
+    """, (*bparams, len(qterms), *params))
+
+def search_items(uid: int, ranked, qterms) -> list:
+    """search_query() rows -> results, one primary-key lookup per kind."""
+    ids, found = {}, {}
+    for r in ranked: ids.setdefault(r["kind"], []).append(r["row_id"])
+    for kind, rids in ids.items():
+        sql = f"{SEARCH_ROWS[kind]} WHERE user_id=%s AND id IN ({', '.join(['%s'] * len(rids))})"
+        for row in query_rows(sql, (uid, *rids)): found[kind, row["id"]] = row
+    out = []
+    for r in ranked:
+        row = found.get((r["kind"], r["row_id"]))
+        if row is None: continue
+        out.append({"kind": r["kind"], "id": r["row_id"], "score": r["score"],
+                    "title": row["title"], "date": row["date"],
+                    "snippet": search.snippet(row["body"] or row["title"], qterms)})
+    return out
+
+@api.get("/search")
+@cached("tasks", "diary", "calendar", "foods")
+@conditional("tasks", "diary", "calendar", "foods")
+def search_get():
+    uid = get_user_id()
+    qterms, kinds = search.query_terms(request.args.get("q")), search_kinds(request.args)
+    ranked = query_rows(*search_query(uid, qterms, kinds, request.args)) if qterms else []
+    res = page(ranked, request.args, SEARCH_ORDER)
+    if not paginated(request.args): return ok(search_items(uid, res, qterms))
+    return ok({**res, "items": search_items(uid, res["items"], qterms)})
+
+# =========================================================
+#                 BATCH (many calls, one round trip)
+#   body: {"requests": [{method, path, query, body}, ...]}
+#   -> [{status, body}, ...] in the same order
+# =========================================================
+BATCH_MAX = int(os.environ.get('BATCH_MAX', '20'))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '4'))
+_batch_pool = None
+_batch_pid = None
+
+def _batch_executor() -> ThreadPoolExecutor:
+    # created lazily, and again in a forked worker (threads don't survive fork)
+    global _batch_pool, _batch_pid
+    if _batch_pid != os.getpid():
+        _batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+        _batch_pid = os.getpid()
+    return _batch_pool
+
+def _sub_environ(sub: dict, uid: int):
+    method = str(sub.get("method", "GET")).upper()
+    path = str(sub.get("path", ""))
+    if not path.startswith("/") or path.startswith("/batch"):
+        raise ValueError(f"bad path: {path!r}")
+    query = {k: str(v) for k, v in (sub.get("query") or {}).items()}
+    query["userId"] = str(uid)                 # one identity for the whole batch
+    return EnvironBuilder(
+        path=path, method=method, query_string=query,
+        json=sub.get("body") if method in ("POST", "PUT", "PATCH") else None,
+        headers={"Authorization": request.headers.get("Authorization", "")},
+        environ_base={"REMOTE_ADDR": request.remote_addr},
+    ).get_environ()
+
+def _sub_dispatch(flask_app, environ, uid: int, stats) -> dict:
+    # no before/after_request hooks: the batch itself is logged once, with
+    # every sub-request's statements counted in its `stats`
+    with flask_app.request_context(environ):
+        g._uid = uid
+        g._dbstats = stats
+        failed = False
+        try:
+            resp = flask_app.make_response(flask_app.dispatch_request())
+        except Exception as e:
+            failed = True
+            try:
+                resp = flask_app.make_response(flask_app.handle_user_exception(e))
+            except Exception:
+                flask_app.logger.exception("batch %s %s failed", request.method, request.path)
+                resp = flask_app.make_response(err("internal error", 500))
+        body = resp.get_json(silent=True) if resp.status_code != 304 else None
+        resp.close()                              # releases a streamed sub-response's connection
+        # sequential sub-requests share the batch's connection: a failed one must
+        # not leave its half-done writes for the next one to commit
+        cn = g.get("_db")
+        if cn is not None and (failed or cn.in_transaction):
+            cn.rollback()
+        if body is None and resp.status_code >= 400:
+            body = {"error": resp.status}           # werkzeug's HTML error pages
+        return {"status": resp.status_code, "body": body}
+
+@api.post("/batch")
+def batch():
+    data = request.get_json(force=True) or {}
+    subs = data.get("requests") if isinstance(data, dict) else data
+    if not isinstance(subs, list) or not subs:
+        return err("requests must be a non-empty list", 422)
+    if len(subs) > BATCH_MAX:
+        return err(f"at most {BATCH_MAX} requests per batch", 422)
+    uid = get_user_id()
+    try:
+        environs = [_sub_environ(s, uid) for s in subs]
+    except (ValueError, AttributeError, TypeError) as e:
+        return err(e, 422)
+
+    flask_app = current_app._get_current_object()
+    stats = g._dbstats
+    results = [None] * len(environs)
+    i = 0
+    while i < len(environs):
+        # run each stretch of consecutive GETs in parallel; writes are barriers
+        j = i
+        while j < len(environs) and environs[j]["REQUEST_METHOD"] == "GET": j += 1
+        if j - i > 1 and BATCH_WORKERS > 1:
+            # worker threads get their own app context, hence their own connection:
+            # the batch's goes back first rather than sit idle while they wait
+            # for theirs, and each keeps its own stats (merged below)
+            _release_db(None)
+            part = [QueryStats() for _ in range(i, j)]
+            for k, r in zip(range(i, j), _batch_executor().map(
+                    lambda env, st: _sub_dispatch(flask_app, env, uid, st), environs[i:j], part)):
+                results[k] = r
+            for st in part: stats.merge(st)
+            i = j
+        else:
+            db()          # acquired by the batch: sequential sub-requests share it
+            results[i] = _sub_dispatch(flask_app, environs[i], uid, stats)
+            i += 1
+    return ok(results)
+
+# =========================================================
+#                 SYNC (delta since a cursor)
+#   cursor = the user's 'sync' sequence; rows carry the
+#   sequence of their last write, deletes leave tombstones
+# =========================================================
+SYNC_TABLES = {
+    "tasks":            "id, user_id, title, urgency, due_date, done, created_at",
+    "diary_entries":    "id, user_id, entry_date, title, content, mood, created_at, updated_at",
+    "nutrient_history": "id, user_id, eaten_at, local_day, food_id, name, veg_g, carb_g, protein_g, amount_g, note",
+    "calendar_events":  "id, user_id, title, note, starts_at, ends_at, all_day, color, created_at, rrule, exdates",
+    "food_items":       "id, user_id, name, veg_g, carb_g, protein_g, per_unit_g, created_at",
+}
+
+@api.get("/sync")
+def sync():
+    uid = get_user_id()
+    try:
+        since = int(request.args.get("since", "0"))
+    except ValueError:
+        return err("since must be a cursor returned by /sync", 422)
+
+    # read the sequence first; the SELECTs below see the same snapshot
+    cn = db(); cur = cn.cursor()
+    cur.execute("SELECT version FROM data_versions WHERE user_id=%s AND resource='sync'", (uid,))
+    row = cur.fetchone()
+    cursor = int(row[0]) if row else 0
+    if since > cursor: since = 0            # cursor from another database: start over
+    lo = since if since else -1             # full sync also returns never-stamped rows
+
+    changes = {}
+    for table, cols in SYNC_TABLES.items():
+        changes[table] = query_rows(f"""
+            SELECT {cols} FROM {table}
+            WHERE user_id=%s AND row_version>%s AND row_version<=%s
+            ORDER BY row_version
+        """, (uid, lo, cursor))
+
+    deleted = {table: [] for table in SYNC_TABLES}
+    if since:
+        cur.execute("""
+            SELECT tbl, row_id FROM sync_tombstones
+            WHERE user_id=%s AND row_version>%s AND row_version<=%s
+        """, (uid, since, cursor))
+        for table, row_id in cur.fetchall():
+            deleted.setdefault(table, []).append(row_id)
+    cur.close()
+    return ok({"cursor": cursor, "full": not since, "changes": changes, "deleted": deleted})
+
+# =========================================================
+#                       APP FACTORY
+# =========================================================
+def create_app(config=None) -> Flask:
+    """Build the Flask app. serve.py calls this once in every worker process;
+    DB/bcrypt pools are created lazily per process on first use."""
+    global _signer
+    setup_logging()                      # restarts the listener thread after a fork
+    app = Flask(__name__)
+    app.config['AUTH_SECRET'] = AUTH_SECRET
+    app.config.update(config or {})
+    # tokens are signed/checked outside any app context (asgi.py), so the
+    # process-wide signer follows the app; cached verdicts were for the old key
+    _signer = URLSafeTimedSerializer(app.config['AUTH_SECRET'])
+    token_cache.clear()
+    CORS(app)
+    app.register_blueprint(api)
+    return app
+
+def __getattr__(name):
+    # module-level app for `python app.py`, asgi.py and bench.py, built on first
+    # use: serve.py's master imports the routes before forking and must not
+    # start the logging thread
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ---------- run ----------
+# dev server only; for production: python serve.py --workers 4 --threads 8
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    create_app().run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,196 @@
+# asgi.py
+# ASGI entry point. The hot read endpoints run natively on asyncio (db_aio),
+# so a slow query parks a coroutine instead of a whole worker thread; every
+# other route is handed to the Flask app unchanged.
+#
+#   uvicorn asgi:application --host 0.0.0.0 --port 5000
+import asyncio, time
+from urllib.parse import parse_qsl
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags, quote_etag
+
+import db_aio
+from db_config import PoolTimeout
+from respcache import response_cache
+from accesslog import log_access
+import metrics
+from app import (app, user_id_from, make_etag, cache_key, VERSIONS_SQL,
+                 USER_TZ_SQL, cached_tz, remember_tz, BadQuery, page,
+                 tasks_query, diary_query, history_query, calendar_query, series_query, calendar_rows,
+                 agenda_queries, agenda_payload,
+                 tasks_order, HISTORY_ORDER, HISTORY_PAGE, CALENDAR_ORDER, diary_order,
+                 nutrients_day, nutrients_payload, NUTRIENT_SUMS_SQL, NUTRIENT_GOAL_SQL)
+
+def _closing(wsgi_app):
+    # asgiref never calls close() on the WSGI response (PEP 3333 requires it),
+    # and that is where a streamed response hands back its pooled connection
+    def run(environ, start_response):
+        body = wsgi_app(environ, start_response)
+        try: yield from body
+        finally:
+            if hasattr(body, "close"): body.close()
+    return run
+
+_wsgi = WsgiToAsgi(_closing(app))
+
+# ---------- async views: (uid, args) -> (status, payload) ----------
+async def tasks_list(uid, args):
+    return 200, page(await db_aio.query_rows(*tasks_query(uid, args)), args, tasks_order(args))
+
+async def nutrients_get(uid, args):
+    day = nutrients_day(args, await user_tz(uid))
+    sums, row = await asyncio.gather(db_aio.fetch_one(NUTRIENT_SUMS_SQL, (uid, day)),
+                                     db_aio.fetch_one(NUTRIENT_GOAL_SQL, (uid,)))
+    return 200, nutrients_payload(day, sums, row)
+
+async def nutrients_history_list(uid, args):
+    rows = await db_aio.query_rows(*history_query(uid, args))
+    return 200, page(rows, args, HISTORY_ORDER, HISTORY_PAGE)
+
+async def diary_list(uid, args):
+    return 200, page(await db_aio.query_rows(*diary_query(uid, args)), args, diary_order(args))
+
+async def calendar_events_list(uid, args):
+    try: query, series = calendar_query(uid, args), series_query(uid, args)
+    except ValueError as e: return 422, {"error": str(e)}
+    singles, series = await asyncio.gather(db_aio.query_rows(*query), db_aio.query_rows(*series))
+    return 200, page(calendar_rows(args, singles, series), args, CALENDAR_ORDER)
+
+async def agenda(uid, args):
+    try: queries = agenda_queries(uid, args)
+    except ValueError as e: return 422, {"error": str(e)}
+    rows = await asyncio.gather(*(db_aio.query_rows(*q) for q in queries.values()))
+    return 200, agenda_payload(args, dict(zip(queries, rows)))
+
+ROUTES = {
+    "/tasks": tasks_list,
+    "/nutrients": nutrients_get,
+    "/nutrients/history": nutrients_history_list,
+    "/diary": diary_list,
+    "/calendar/events": calendar_events_list,
+    "/agenda": agenda,
+}
+
+# list routes that can stream (?stream=1, ?format=ndjson): the Flask view
+# streams them off an unbuffered cursor, so those requests go to it
+STREAMED = {"/tasks"}
+
+# ---------- plumbing ----------
+async def user_tz(uid):
+    # app.user_tz over db_aio, sharing its cache
+    tz = cached_tz(uid)
+    if tz is None:
+        row = await db_aio.fetch_one(USER_TZ_SQL, (uid,))
+        tz = remember_tz(uid, row["timezone"] if row else None)
+    return tz
+
+def _args(scope) -> dict:
+    # first value wins, like werkzeug's MultiDict.get
+    args = {}
+    for k, v in parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True):
+        args.setdefault(k, v)
+    return args
+
+def _wants_stream(args, headers) -> bool:
+    # app._wants_stream over the raw scope
+    return (args.get("stream") in ("1", "true") or args.get("format") == "ndjson"
+            or b"application/x-ndjson" in headers.get(b"accept", b""))
+
+def _body(payload) -> bytes:
+    # same bytes as ok() -> jsonify in a non-debug app
+    return (app.json.dumps(payload or {}, separators=(",", ":")) + "\n").encode("utf-8")
+
+def _flask_view(path):
+    # the Flask view for `path`, to read its @conditional / @cached settings
+    try:
+        endpoint, _ = app.url_map.bind("").match(path, "GET")
+    except HTTPException:
+        return None
+    return app.view_functions[endpoint]
+
+def _etag(uid, path, args, tz, versions, versioned):
+    if versioned is None: return None
+    resources, vary = versioned
+    return make_etag(uid, resources, versions, path, args, vary(args, tz) if vary else "")
+
+async def _lifespan(receive, send):
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            if db_aio._pool is not None:
+                await db_aio._pool.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    view = ROUTES.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "GET" else None
+    if view is None:
+        return await _wsgi(scope, receive, send)
+    args = _args(scope)
+    headers = dict(scope["headers"])
+    if scope["path"] in STREAMED and _wants_stream(args, headers):
+        return await _wsgi(scope, receive, send)
+
+    t0 = time.perf_counter()
+    metrics.request_started()
+    auth = headers.get(b"authorization", b"").decode("latin-1")
+    uid = user_id_from(auth, args)
+    inm = parse_etags(headers.get(b"if-none-match", b"").decode("latin-1"))
+
+    # same response cache as the Flask views (@cached), keyed by the current
+    # data versions like theirs (one lookup, shared with the ETag)
+    fview = _flask_view(scope["path"])
+    versioned = getattr(fview, "versioned", None)
+    vary = versioned[1] if versioned else None
+    resources = getattr(fview, "cached", None) if response_cache.enabled else None
+    key = hit = etag = None
+    gen = response_cache.generation(uid)
+    try:
+        tz = await user_tz(uid) if vary else None
+        versions = {}
+        if versioned or resources is not None:
+            versions = dict(await db_aio.fetch_all(VERSIONS_SQL, (uid,)))
+        if resources is not None:
+            key = cache_key(uid, scope["path"], args, resources, versions, vary, tz)
+            hit = response_cache.get(key)
+        if hit is not None:
+            body, etag = hit
+            status = 304 if etag and inm.contains_weak(etag) else 200
+        else:
+            etag = _etag(uid, scope["path"], args, tz, versions, versioned)
+            if etag and inm.contains_weak(etag):
+                status, payload = 304, None
+            else:
+                status, payload = await view(uid, args)
+    except PoolTimeout:
+        app.logger.warning("DB pool exhausted: %s", db_aio.get_pool().stats())
+        status, payload = 503, {"error": "database busy, retry shortly"}
+    except BadQuery as e:
+        status, payload = 422, {"error": str(e)}
+    except Exception:
+        # details go to the log only: they can hold SQL and schema names
+        app.logger.exception("async %s failed", scope["path"])
+        status, payload = 500, {"error": "internal error"}
+    if hit is None:
+        body = b"" if status == 304 else _body(payload)
+        if key is not None and status == 200:
+            response_cache.put(key, resources, body, etag, gen)
+    if status == 304: body = b""
+    headers = [(b"content-type", b"application/json"),
+               (b"content-length", str(len(body)).encode()),
+               (b"access-control-allow-origin", b"*")]
+    if etag and status in (200, 304):
+        headers.append((b"etag", quote_etag(etag, weak=True).encode()))
+    if status == 503:
+        headers.append((b"retry-after", b"1"))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+    dt = time.perf_counter() - t0
+    log_access("GET", scope["path"], status, dt * 1000,
+               size=len(body), mode="async", cached=hit is not None)
+    metrics.request_finished("GET", scope["path"], status, dt)
@@ -0,0 +1,250 @@
+# bench.py
+# Micro/throughput benchmarks for the backend. Needs the `mobile` database
+# from mobile.sql (seed data is enough; more rows make the numbers sharper).
+#
+#   python bench.py aio --clients 1000 --threads 32
+#   python bench.py rows --rows 10000            (no database needed)
+#   python bench.py auth --requests 100000       (no database needed)
+#   python bench.py signup --clients 300         (writes, then deletes, test users)
+#   python bench.py search --entries 20000       (writes, then deletes, a test user)
+import argparse, asyncio, os, random, statistics, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+def _report(label, lat, wall):
+    lat = sorted(lat)
+    print(f"{label:>8}: {len(lat)/wall:8.0f} req/s  "
+          f"p50 {statistics.median(lat)*1000:7.2f} ms  "
+          f"p99 {lat[int(len(lat)*0.99) - 1]*1000:7.2f} ms  "
+          f"wall {wall:.2f} s")
+
+# ---------- aio: threaded sync path vs asyncio path ----------
+def bench_aio(opts):
+    from app import tasks_query, _dict_rows
+    from db_config import ConnectionPool
+    import db_aio
+
+    sql, params = tasks_query(opts.user, {})
+
+    # sync: one thread per in-flight request, like the Flask dev server / gthread workers
+    pool = ConnectionPool(size=opts.pool, max_overflow=0, timeout=60)
+    def one_sync():
+        t0 = time.perf_counter()
+        cn = pool.acquire()
+        try:
+            cur = cn.cursor()
+            cur.execute(sql, params)
+            _dict_rows(cur, sql); cur.close()
+        finally:
+            pool.release(cn)
+        return time.perf_counter() - t0
+    with ThreadPoolExecutor(max_workers=opts.threads) as ex:
+        t0 = time.perf_counter()
+        lat = list(ex.map(lambda _: one_sync(), range(opts.clients)))
+        _report("threads", lat, time.perf_counter() - t0)
+    pool.dispose()
+
+    # async: every client is a coroutine on one loop
+    async def run():
+        db_aio._pool, db_aio._pool_loop = db_aio.AsyncConnectionPool(
+            size=opts.pool, max_overflow=0, timeout=60), asyncio.get_running_loop()
+        async def one_async():
+            t0 = time.perf_counter()
+            await db_aio.query_rows(sql, params)
+            return time.perf_counter() - t0
+        t0 = time.perf_counter()
+        lat = await asyncio.gather(*(one_async() for _ in range(opts.clients)))
+        _report("asyncio", lat, time.perf_counter() - t0)
+        await db_aio._pool.dispose()
+    asyncio.run(run())
+
+# ---------- rows: _coerce per cell vs compiled row converter ----------
+def bench_rows(opts):
+    from datetime import date, datetime, timedelta
+    from decimal import Decimal
+    from mysql.connector.constants import FieldType as T, FieldFlag
+    from app import app, _coerce
+    from rowconv import compile_converter
+
+    # shaped like `SELECT ... FROM food_items` plus a DATE and a VARBINARY column
+    description = [
+        ("id", T.LONG, None, None, None, None, 0, 0, 63),
+        ("user_id", T.LONG, None, None, None, None, 0, 0, 63),
+        ("name", T.VAR_STRING, None, None, None, None, 0, 0, 45),
+        ("veg_g", T.NEWDECIMAL, None, None, None, None, 0, 0, 63),
+        ("carb_g", T.NEWDECIMAL, None, None, None, None, 0, 0, 63),
+        ("protein_g", T.NEWDECIMAL, None, None, None, None, 0, 0, 63),
+        ("due_date", T.DATE, None, None, None, None, 1, 0, 63),
+        ("tag", T.VAR_STRING, None, None, None, None, 1, FieldFlag.BINARY, 63),
+        ("created_at", T.TIMESTAMP, None, None, None, None, 0, 0, 63),
+    ]
+    names = [c[0] for c in description]
+    t0 = datetime(2024, 1, 1, 8, 30, 0)
+    tuples = [(i, 1, f"food {i}", Decimal("12.50"), Decimal("40.00"), Decimal("7.25"),
+               None if i % 3 else date(2024, 1, 1) + timedelta(days=i % 365),
+               b"abc" if i % 2 else None, t0 + timedelta(minutes=i))
+              for i in range(opts.rows)]
+    dicts = [dict(zip(names, r)) for r in tuples]   # what a dictionary=True cursor hands back
+
+    def old(): return [{k: _coerce(v) for k, v in r.items()} for r in dicts]
+    convert = compile_converter(description)
+    def new(): return convert(tuples)
+
+    dumps = lambda rows: app.json.dumps(rows, separators=(",", ":"))
+    assert dumps(old()) == dumps(new()), "converter output differs from _coerce"
+
+    for label, fn in (("_coerce", old), ("compiled", new)):
+        best = min(_timed(fn) for _ in range(opts.repeat))
+        print(f"{label:>8}: {best*1000:8.2f} ms / {opts.rows} rows")
+
+# ---------- auth: bearer token verified per request vs token cache ----------
+def bench_auth(opts):
+    from app import _make_token, _verify_token
+    from tokencache import TokenCache
+
+    tokens = [f"Bearer {_make_token(uid)}" for uid in range(1, opts.devices + 1)]
+    headers = [tokens[i % len(tokens)] for i in range(opts.requests)]
+    cache = TokenCache(_verify_token, size=opts.devices)
+
+    def old(): return [_verify_token(h[7:].strip()) for h in headers]
+    def new(): return [cache.uid(h[7:].strip()) for h in headers]
+    assert [r[0] for r in old()] == new(), "cached uids differ"
+
+    for label, fn in (("verify", old), ("cached", new)):
+        best = min(_timed(fn) for _ in range(opts.repeat))
+        print(f"{label:>8}: {best / opts.requests * 1e6:8.2f} us / request")
+    print(f"   cache: {cache.stats()}")
+
+# ---------- signup: concurrent signups must all get distinct ids ----------
+def bench_signup(opts):
+    # cheap hashes and room for every client: this checks id allocation, not bcrypt
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("PW_QUEUE", str(opts.clients))
+    from app import app
+    from db_config import get_connection
+
+    tag = uuid.uuid4().hex[:8]
+    def one(i):
+        t0 = time.perf_counter()
+        r = app.test_client().post("/auth/signup", json={
+            "email": f"bench-{tag}-{i}@example.com", "password": "pw", "display_name": "bench"})
+        return time.perf_counter() - t0, r.status_code, (r.get_json() or {}).get("user_id")
+
+    try:
+        with ThreadPoolExecutor(max_workers=opts.threads) as ex:
+            t0 = time.perf_counter()
+            res = list(ex.map(one, range(opts.clients)))
+            _report("signup", [r[0] for r in res], time.perf_counter() - t0)
+        # the same emails again: every one must be a clean 409, not a 500
+        with ThreadPoolExecutor(max_workers=opts.threads) as ex:
+            dup = list(ex.map(one, range(opts.clients)))
+    finally:
+        cn = get_connection(); cur = cn.cursor()
+        cur.execute("DELETE FROM profile WHERE email LIKE %s", (f"bench-{tag}-%",))
+        cn.commit(); cur.close(); cn.close()
+
+    codes = sorted({r[1] for r in res})
+    ids = [r[2] for r in res if r[1] == 201]
+    print(f"   201: {len(ids)}/{opts.clients}  distinct ids: {len(set(ids))}  "
+          f"duplicates -> {sorted({r[1] for r in dup})}")
+    assert len(ids) == opts.clients == len(set(ids)), f"signup failures/collisions (statuses {codes})"
+    assert all(r[1] == 409 for r in dup), "re-used emails must answer 409"
+
+# ---------- search: /search latency for a user with a big diary ----------
+def bench_search(opts):
+    # every request must reach the database, not the response cache
+    os.environ.setdefault("RESP_CACHE_MB", "0")
+    from app import app
+    from db_config import get_connection
+    import search
+
+    # a made-up vocabulary with Zipf word frequencies, like real text
+    rnd = random.Random(1)
+    vocab = set()
+    while len(vocab) < opts.vocab:
+        vocab.add("".join(rnd.choice("bdfgklmnprstvz") + rnd.choice("aeiou") for _ in range(rnd.randint(2, 4))))
+    vocab = sorted(vocab, key=lambda _: rnd.random())
+    weights = [1 / (r + 1) for r in range(len(vocab))]
+    words = lambda k: " ".join(rnd.choices(vocab, weights, k=k))
+
+    tag = uuid.uuid4().hex[:8]
+    cn = get_connection(); cur = cn.cursor()
+    cur.execute("INSERT INTO profile (display_name, email) VALUES ('bench', %s)",
+                (f"bench-{tag}@example.com",))
+    uid = cur.lastrowid
+    try:
+        t0 = time.perf_counter()
+        rows = [(uid, f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}", words(4), words(opts.words))
+                for i in range(opts.entries)]
+        for i in range(0, len(rows), 1000):
+            cur.executemany("INSERT INTO diary_entries (user_id, entry_date, title, content)"
+                            " VALUES (%s,%s,%s,%s)", rows[i:i + 1000])
+        terms = search.rebuild(cn, uid)
+        cn.commit()
+        print(f"   {opts.entries} diary entries, {terms} index rows in {time.perf_counter() - t0:.1f} s")
+
+        client = app.test_client()
+        get = lambda qs: client.get(f"/search?userId={uid}&{qs}")
+        cursor = get(f"q={vocab[0]}&cursor=&limit=20").get_json()["next_cursor"]
+        cases = (("rare", f"q={vocab[len(vocab) // 2]}"),
+                 ("common", f"q={vocab[0]}"),
+                 ("2 words", f"q={vocab[1]}+{vocab[20]}"),
+                 ("prefix", f"q={vocab[2][:3]}"),
+                 ("page 2", f"q={vocab[0]}&cursor={cursor}&limit=20"))
+        for label, qs in cases:
+            body = get(qs).get_json() or []      # warm up
+            n = len(body["items"] if "cursor=" in qs else body)
+            lat = []
+            t0 = time.perf_counter()
+            for _ in range(opts.requests):
+                t1 = time.perf_counter(); r = get(qs)
+                lat.append(time.perf_counter() - t1)
+                assert r.status_code == 200, r.get_data(as_text=True)
+            _report(label, lat, time.perf_counter() - t0)
+            print(f"          {qs.split('&')[0]} -> {n} results")
+    finally:
+        cur.execute("DELETE FROM profile WHERE id=%s", (uid,))    # cascades
+        cn.commit(); cur.close(); cn.close()
+
+def _timed(fn):
+    t0 = time.perf_counter(); fn()
+    return time.perf_counter() - t0
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("aio", help="threaded sync DB path vs asyncio path under concurrency")
+    p.add_argument("--clients", type=int, default=1000, help="concurrent requests")
+    p.add_argument("--threads", type=int, default=32, help="sync worker threads")
+    p.add_argument("--pool", type=int, default=10, help="DB connections for either path")
+    p.add_argument("--user", type=int, default=1)
+    p.set_defaults(fn=bench_aio)
+
+    p = sub.add_parser("rows", help="per-cell _coerce vs compiled row converters")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--repeat", type=int, default=7)
+    p.set_defaults(fn=bench_rows)
+
+    p = sub.add_parser("auth", help="per-request token verification vs token cache")
+    p.add_argument("--requests", type=int, default=100000)
+    p.add_argument("--devices", type=int, default=50, help="distinct tokens in flight")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(fn=bench_auth)
+
+    p = sub.add_parser("signup", help="parallel /auth/signup: no collisions, no 500s")
+    p.add_argument("--clients", type=int, default=300)
+    p.add_argument("--threads", type=int, default=64)
+    p.set_defaults(fn=bench_signup)
+
+    p = sub.add_parser("search", help="/search latency over a large diary (target p99 < 10 ms)")
+    p.add_argument("--entries", type=int, default=20000, help="diary entries of the test user")
+    p.add_argument("--words", type=int, default=60, help="words per entry")
+    p.add_argument("--vocab", type=int, default=20000, help="distinct words")
+    p.add_argument("--requests", type=int, default=200, help="per query")
+    p.set_defaults(fn=bench_search)
+
+    opts = ap.parse_args()
+    opts.fn(opts)
+
+if __name__ == "__main__":
+    main()
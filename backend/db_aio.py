@@ -0,0 +1,153 @@
+import asyncio, time
+from collections import deque
+from contextlib import asynccontextmanager
+import mysql.connector.aio
+from db_config import (DB_CONFIG, POOL_SIZE, POOL_MAX_OVERFLOW, POOL_RECYCLE,
+                       POOL_TIMEOUT, POOL_PRE_PING, PoolTimeout)
+from rowconv import row_converter
+
+async def get_connection():
+    """Open a new, unpooled async connection."""
+    return await mysql.connector.aio.connect(**DB_CONFIG)
+
+# ---------- pool ----------
+class AsyncConnectionPool:
+    """asyncio twin of db_config.ConnectionPool (same knobs, same stats).
+    Bound to the event loop it is first used on."""
+
+    def __init__(self, size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                 recycle=POOL_RECYCLE, timeout=POOL_TIMEOUT,
+                 pre_ping=POOL_PRE_PING, connect=get_connection):
+        self.size, self.max_overflow = size, max_overflow
+        self.recycle, self.timeout, self.pre_ping = recycle, timeout, pre_ping
+        self._connect = connect
+        self._cond = asyncio.Condition()
+        self._idle = deque()          # (conn, born_at)
+        self._born = {}
+        self._in_use = 0
+        self._waits = 0; self._wait_time = 0.0; self._timeouts = 0
+        self._created = 0; self._recycled = 0
+
+    async def acquire(self):
+        async with self._cond:
+            if not self._idle and self._in_use >= self.size + self.max_overflow:
+                self._waits += 1
+                t_wait = time.monotonic()
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self._idle or
+                                            self._in_use < self.size + self.max_overflow),
+                        self.timeout)
+                except asyncio.TimeoutError:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"no DB connection free after {self.timeout:.1f}s")
+                finally:
+                    self._wait_time += time.monotonic() - t_wait
+            conn, born = self._idle.pop() if self._idle else (None, None)
+            self._in_use += 1
+
+        try:
+            if conn is not None and not await self._usable(conn, born):
+                await self._discard(conn)
+                conn = None
+                self._recycled += 1
+            if conn is None:
+                conn, born = await self._connect(), time.monotonic()
+                self._created += 1
+        except BaseException:
+            async with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        self._born[id(conn)] = born
+        return conn
+
+    async def release(self, conn):
+        born = self._born.pop(id(conn), None)
+        keep = born is not None
+        if keep:
+            try:
+                if conn.in_transaction: await conn.rollback()
+            except Exception:
+                keep = False
+        async with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.size:
+                self._idle.append((conn, born))
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            await self._discard(conn)
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def _usable(self, conn, born):
+        if self.recycle > 0 and time.monotonic() - born > self.recycle:
+            return False
+        if self.pre_ping:
+            try:
+                await conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    @staticmethod
+    async def _discard(conn):
+        try: await conn.close()
+        except Exception: pass
+
+    def stats(self):
+        return {
+            "size": self.size, "max_overflow": self.max_overflow,
+            "in_use": self._in_use, "idle": len(self._idle),
+            "waits": self._waits, "wait_time_ms": round(self._wait_time * 1000, 1),
+            "timeouts": self._timeouts,
+            "created": self._created, "recycled": self._recycled,
+        }
+
+    async def dispose(self):
+        idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            await self._discard(conn)
+
+_pool = None
+_pool_loop = None
+
+def get_pool() -> AsyncConnectionPool:
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool_loop is not loop:
+        _pool, _pool_loop = AsyncConnectionPool(), loop
+    return _pool
+
+# ---------- cursor helpers ----------
+async def query_rows(sql, params=()):
+    """Async app.query_rows: JSON-ready dicts via the compiled row converter."""
+    async with get_pool().connection() as cn:
+        cur = await cn.cursor()
+        await cur.execute(sql, params)
+        rows = row_converter(sql, cur.description)(await cur.fetchall())
+        await cur.close()
+    return rows
+
+async def fetch_all(sql, params=()):
+    async with get_pool().connection() as cn:
+        cur = await cn.cursor()
+        await cur.execute(sql, params)
+        rows = await cur.fetchall()
+        await cur.close()
+    return rows
+
+async def fetch_one(sql, params=()):
+    async with get_pool().connection() as cn:
+        cur = await cn.cursor(dictionary=True)
+        await cur.execute(sql, params)
+        row = await cur.fetchone()
+        await cur.close()
+    return row
@@ -1,14 +1,161 @@
+import os, threading, time
+from collections import deque
 import mysql.connector
 
+DB_CONFIG = dict(
+    host=os.environ.get('DB_HOST', 'localhost'),
+    port=int(os.environ.get('DB_PORT', '3306')),
+    user=os.environ.get('DB_USER', 'root'),
+    password=os.environ.get('DB_PASSWORD', '123456789'),
+    database=os.environ.get('DB_NAME', 'mobile'),
+    charset='utf8mb4'
+)
+
+# Pool sizing (per worker process)
+POOL_SIZE         = int(os.environ.get('DB_POOL_SIZE', '5'))       # connections kept idle
+POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', '10'))  # extra, closed on return
+POOL_RECYCLE      = int(os.environ.get('DB_POOL_RECYCLE', '3600'))  # seconds, <= 0 disables
+POOL_TIMEOUT      = float(os.environ.get('DB_POOL_TIMEOUT', '10'))  # wait for a free slot
+POOL_PRE_PING     = os.environ.get('DB_POOL_PRE_PING', '1') not in ('0', 'false', 'no')
+
 def get_connection():
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='123456789',
-        database='mobile',
-        charset='utf8mb4'  
-    )
+    """Open a new, unpooled connection."""
+    return mysql.connector.connect(**DB_CONFIG)
 
 def rows_to_dicts(cur):
     cols = [c[0] for c in cur.description]
     return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+# ---------- pool ----------
+class PoolTimeout(Exception):
+    """No connection became free within the pool's wait timeout."""
+
+class ConnectionPool:
+    """Thread-safe pool: `size` idle connections plus up to `max_overflow`
+    extra ones that are closed when returned."""
+
+    def __init__(self, size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                 recycle=POOL_RECYCLE, timeout=POOL_TIMEOUT,
+                 pre_ping=POOL_PRE_PING, connect=get_connection):
+        self.size, self.max_overflow = size, max_overflow
+        self.recycle, self.timeout, self.pre_ping = recycle, timeout, pre_ping
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = deque()          # (conn, born_at)
+        self._born = {}               # id(conn) -> born_at, for checked-out conns
+        self._in_use = 0
+        self._waits = 0; self._wait_time = 0.0; self._timeouts = 0
+        self._created = 0; self._recycled = 0
+
+    def acquire(self):
+        deadline = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, born = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.size + self.max_overflow:
+                    conn, born = None, None
+                    self._in_use += 1
+                    break
+                # exhausted: wait for a release
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                    self._waits += 1
+                    t_wait = now
+                if now >= deadline or not self._cond.wait(deadline - now):
+                    self._timeouts += 1
+                    self._wait_time += time.monotonic() - t_wait
+                    raise PoolTimeout(f"no DB connection free after {self.timeout:.1f}s")
+            if deadline is not None:
+                self._wait_time += time.monotonic() - t_wait
+
+        # network I/O happens outside the lock
+        try:
+            if conn is not None and not self._usable(conn, born):
+                self._discard(conn)
+                conn = None
+                with self._cond: self._recycled += 1
+            if conn is None:
+                conn, born = self._connect(), time.monotonic()
+                with self._cond: self._created += 1
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._born[id(conn)] = born
+        return conn
+
+    def release(self, conn):
+        with self._cond:
+            born = self._born.pop(id(conn), None)
+        # a streamed response cut short leaves unread rows behind: drop that conn
+        keep = born is not None and not getattr(conn, "unread_result", False)
+        if keep:
+            try:
+                # never hand a half-finished transaction (or a stale snapshot) to the next request
+                if conn.in_transaction: conn.rollback()
+            except Exception:
+                keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.size:
+                self._idle.append((conn, born))
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    def _usable(self, conn, born):
+        if self.recycle > 0 and time.monotonic() - born > self.recycle:
+            return False
+        if self.pre_ping:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    @staticmethod
+    def _discard(conn):
+        try: conn.close()
+        except Exception: pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size, "max_overflow": self.max_overflow,
+                "in_use": self._in_use, "idle": len(self._idle),
+                "waits": self._waits, "wait_time_ms": round(self._wait_time * 1000, 1),
+                "timeouts": self._timeouts,
+                "created": self._created, "recycled": self._recycled,
+            }
+
+    def dispose(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._discard(conn)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    # one pool per process: a forked worker never reuses its parent's sockets
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool, _pool_pid = ConnectionPool(), os.getpid()
+    return _pool
+
+def set_pool(pool: ConnectionPool):
+    """Serve this process from `pool` (e.g. one whose `connect` wraps connections)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        _pool, _pool_pid = pool, os.getpid()
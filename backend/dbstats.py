@@ -0,0 +1,119 @@
+# dbstats.py
+# Thin wrappers around a mysql.connector connection/cursor that record, for
+# the current request, every statement run (text, time, rows) plus the time
+# spent in the driver, getting a connection and serializing the response.
+import logging, os, time
+from collections import Counter
+
+SLOW_QUERY_MS  = float(os.environ.get('SLOW_QUERY_MS', '200'))  # log statements slower than this
+QUERY_WARN     = int(os.environ.get('QUERY_WARN', '25'))        # warn above this many per request
+STATEMENTS_MAX = 200                                            # statements kept per request
+
+log = logging.getLogger("db")
+
+class QueryStats:
+    __slots__ = ("db_time", "queries", "connect_time", "serialize_time", "statements")
+
+    def __init__(self):
+        self.db_time = 0.0      # seconds in execute/fetch/commit/rollback
+        self.queries = 0
+        self.connect_time = 0.0     # seconds waiting for a pooled connection
+        self.serialize_time = 0.0   # seconds encoding the JSON body
+        self.statements = []        # [sql, seconds, rows, n_params]
+
+    def server_timing(self) -> str:
+        return (f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+                f'connect;dur={self.connect_time * 1000:.1f}, '
+                f'serialize;dur={self.serialize_time * 1000:.1f}')
+
+    def merge(self, other):
+        """Add another QueryStats' numbers to these (a /batch worker's)."""
+        self.db_time += other.db_time
+        self.queries += other.queries
+        self.connect_time += other.connect_time
+        self.serialize_time += other.serialize_time
+        self.statements += other.statements[:STATEMENTS_MAX - len(self.statements)]
+
+    def report(self, route):
+        """Log slow statements and suspected N+1 loops. Only the SQL text is
+        logged; bound parameters never are."""
+        for sql, secs, rows, n_params in self.statements:
+            if secs * 1000 >= SLOW_QUERY_MS:
+                log.warning("slow query %.1f ms, %d rows, %s [%d params redacted]: %s",
+                            secs * 1000, rows, route, n_params, sql)
+        if self.queries > QUERY_WARN:
+            sql, n = Counter(s[0] for s in self.statements).most_common(1)[0]
+            log.warning("%s ran %d queries (QUERY_WARN=%d); most repeated x%d: %s",
+                        route, self.queries, QUERY_WARN, n, sql)
+
+class TimedCursor:
+    __slots__ = ("_cur", "_stats", "_stmt")
+
+    def __init__(self, cur, stats):
+        self._cur, self._stats, self._stmt = cur, stats, None
+
+    def execute(self, sql, params=()):
+        stats = self._stats
+        stmt = self._stmt = [" ".join(sql.split()), 0.0, 0, len(params or ())]
+        if len(stats.statements) < STATEMENTS_MAX:
+            stats.statements.append(stmt)
+        t0 = time.perf_counter()
+        try:
+            return self._cur.execute(sql, params)
+        finally:
+            dt = time.perf_counter() - t0
+            stats.db_time += dt
+            stats.queries += 1
+            stmt[1] += dt
+            if self._cur.description is None:            # DML; SELECTs count rows as fetched
+                stmt[2] = max(self._cur.rowcount or 0, 0)
+
+    def _timed(self, fn, *a):
+        t0 = time.perf_counter()
+        try:
+            return fn(*a)
+        finally:
+            dt = time.perf_counter() - t0
+            self._stats.db_time += dt
+            if self._stmt is not None: self._stmt[1] += dt
+
+    def _fetched(self, n):
+        if self._stmt is not None: self._stmt[2] += n
+
+    def fetchone(self):
+        row = self._timed(self._cur.fetchone)
+        if row is not None: self._fetched(1)
+        return row
+
+    def fetchall(self):
+        rows = self._timed(self._cur.fetchall)
+        self._fetched(len(rows)); return rows
+
+    def fetchmany(self, size=1):
+        rows = self._timed(self._cur.fetchmany, size)
+        self._fetched(len(rows)); return rows
+
+    def __iter__(self): return iter(self._cur)
+    def __getattr__(self, name): return getattr(self._cur, name)
+
+class TimedConnection:
+    """Proxy for a pooled connection; `raw` is what goes back to the pool."""
+    __slots__ = ("raw", "stats")
+
+    def __init__(self, raw, stats):
+        self.raw, self.stats = raw, stats
+
+    def cursor(self, *a, **kw):
+        return TimedCursor(self.raw.cursor(*a, **kw), self.stats)
+
+    def commit(self):
+        t0 = time.perf_counter()
+        try: self.raw.commit()
+        finally: self.stats.db_time += time.perf_counter() - t0
+
+    def rollback(self):
+        t0 = time.perf_counter()
+        try: self.raw.rollback()
+        finally: self.stats.db_time += time.perf_counter() - t0
+
+    def __getattr__(self, name): return getattr(self.raw, name)
@@ -0,0 +1,223 @@
+# manage.py
+# Maintenance commands for the `mobile` database.
+#
+#   python manage.py daily-verify              (exit 1 on any mismatch)
+#   python manage.py daily-rebuild [--user 1]
+#   python manage.py counts-verify             (exit 1 on any mismatch)
+#   python manage.py counts-rebuild [--user 1]
+#   python manage.py calendar-verify           (exit 1 on any mismatch)
+#   python manage.py calendar-rebuild [--user 1]
+#   python manage.py search-verify             (exit 1 on any mismatch)
+#   python manage.py search-rebuild [--user 1]
+import argparse, sys
+from db_config import get_connection
+import search
+
+DAILY_FROM_HISTORY_SQL = """
+    SELECT user_id, local_day AS day,
+           SUM(veg_g), SUM(carb_g), SUM(protein_g), COUNT(*)
+    FROM nutrient_history {where}
+    GROUP BY user_id, local_day
+"""
+
+COUNTS_FROM_TASKS_SQL = """
+    SELECT user_id, urgency, due_date IS NOT NULL AS dated, COUNT(*), SUM(done<>0)
+    FROM tasks {where}
+    GROUP BY user_id, urgency, dated
+"""
+
+# same as app.CALENDAR_DAYS_SQL, without the INSERT
+DAYS_FROM_EVENTS_SQL = """
+    WITH RECURSIVE d (user_id, event_id, day, span_end) AS (
+      SELECT user_id, id, DATE(starts_at), span_end FROM calendar_events
+      WHERE long_span=0 AND recurring=0 {where}
+      UNION ALL
+      SELECT user_id, event_id, day + INTERVAL 1 DAY, span_end FROM d
+      WHERE day + INTERVAL 1 DAY < span_end
+    )
+    SELECT user_id, day, event_id FROM d
+"""
+
+def _where(opts):
+    return ("WHERE user_id=%s", (opts.user,)) if opts.user else ("", ())
+
+# ---------- nutrient_daily: rebuild / verify against nutrient_history ----------
+def daily_rebuild(opts):
+    where, params = _where(opts)
+    cn = get_connection(); cur = cn.cursor()
+    try:
+        # one transaction: GET /nutrients never sees the table half-built
+        cur.execute(f"DELETE FROM nutrient_daily {where}", params)
+        cur.execute("INSERT INTO nutrient_daily (user_id, day, veg_g, carb_g, protein_g, entries)"
+                    + DAILY_FROM_HISTORY_SQL.format(where=where), params)
+        rows = cur.rowcount
+        cn.commit()
+    except Exception:
+        cn.rollback()
+        raise
+    finally:
+        cur.close(); cn.close()
+    print(f"nutrient_daily rebuilt: {rows} day rows")
+
+def daily_verify(opts):
+    where, params = _where(opts)
+    cn = get_connection(); cur = cn.cursor()
+    cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+    cur.execute(DAILY_FROM_HISTORY_SQL.format(where=where), params)
+    want = {(r[0], r[1]): tuple(r[2:]) for r in cur.fetchall()}
+    cur.execute(f"SELECT user_id, day, veg_g, carb_g, protein_g, entries FROM nutrient_daily {where}",
+                params)
+    have = {(r[0], r[1]): tuple(r[2:]) for r in cur.fetchall()}
+    cn.rollback(); cur.close(); cn.close()
+
+    zero = (0, 0, 0, 0)
+    bad = sorted(k for k in want.keys() | have.keys() if want.get(k, zero) != have.get(k, zero))
+    for uid, day in bad:
+        print(f"user {uid} {day}: history {want.get((uid, day), zero)} "
+              f"!= daily {have.get((uid, day), zero)}")
+    print(f"{len(want)} day rows checked, {len(bad)} mismatched")
+    if bad:
+        sys.exit(1)
+
+# ---------- task_counts: rebuild / verify against tasks ----------
+def counts_rebuild(opts):
+    where, params = _where(opts)
+    cn = get_connection(); cur = cn.cursor()
+    try:
+        cur.execute(f"DELETE FROM task_counts {where}", params)
+        cur.execute("INSERT INTO task_counts (user_id, urgency, dated, total, done)"
+                    + COUNTS_FROM_TASKS_SQL.format(where=where), params)
+        rows = cur.rowcount
+        cn.commit()
+    except Exception:
+        cn.rollback()
+        raise
+    finally:
+        cur.close(); cn.close()
+    print(f"task_counts rebuilt: {rows} rows")
+
+def counts_verify(opts):
+    where, params = _where(opts)
+    cn = get_connection(); cur = cn.cursor()
+    cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+    cur.execute(COUNTS_FROM_TASKS_SQL.format(where=where), params)
+    want = {tuple(r[:3]): tuple(map(int, r[3:])) for r in cur.fetchall()}
+    cur.execute(f"SELECT user_id, urgency, dated, total, done FROM task_counts {where}", params)
+    have = {tuple(r[:3]): tuple(map(int, r[3:])) for r in cur.fetchall()}
+    cn.rollback(); cur.close(); cn.close()
+
+    zero = (0, 0)
+    bad = sorted(k for k in want.keys() | have.keys() if want.get(k, zero) != have.get(k, zero))
+    for uid, urgency, dated in bad:
+        print(f"user {uid} urgency {urgency} dated {dated}: tasks (total, done) "
+              f"{want.get((uid, urgency, dated), zero)} != counts {have.get((uid, urgency, dated), zero)}")
+    print(f"{len(want)} counter rows checked, {len(bad)} mismatched")
+    if bad:
+        sys.exit(1)
+
+# ---------- calendar_days: rebuild / verify against calendar_events ----------
+def calendar_rebuild(opts):
+    where, params = _where(opts)
+    cn = get_connection(); cur = cn.cursor()
+    try:
+        cur.execute(f"DELETE FROM calendar_days {where}", params)
+        cur.execute("INSERT INTO calendar_days (user_id, day, event_id)"
+                    + DAYS_FROM_EVENTS_SQL.format(where=where.replace("WHERE", "AND")), params)
+        rows = cur.rowcount
+        cn.commit()
+    except Exception:
+        cn.rollback()
+        raise
+    finally:
+        cur.close(); cn.close()
+    print(f"calendar_days rebuilt: {rows} day rows")
+
+def calendar_verify(opts):
+    where, params = _where(opts)
+    cn = get_connection(); cur = cn.cursor()
+    cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+    cur.execute(DAYS_FROM_EVENTS_SQL.format(where=where.replace("WHERE", "AND")), params)
+    want = set(map(tuple, cur.fetchall()))
+    cur.execute(f"SELECT user_id, day, event_id FROM calendar_days {where}", params)
+    have = set(map(tuple, cur.fetchall()))
+    cn.rollback(); cur.close(); cn.close()
+
+    for uid, day, eid in sorted(want - have):
+        print(f"user {uid} {day}: event {eid} missing from calendar_days")
+    for uid, day, eid in sorted(have - want):
+        print(f"user {uid} {day}: event {eid} in calendar_days but not on that day")
+    print(f"{len(want)} day rows checked, {len(want ^ have)} mismatched")
+    if want != have:
+        sys.exit(1)
+
+# ---------- search_index: rebuild / verify against the indexed tables ----------
+def search_rebuild(opts):
+    cn = get_connection()
+    try:
+        rows = search.rebuild(cn, opts.user)
+        cn.commit()
+    except Exception:
+        cn.rollback()
+        raise
+    finally:
+        cn.close()
+    print(f"search_index rebuilt: {rows} term rows")
+
+def search_verify(opts):
+    where, params = _where(opts)
+    cn = get_connection(); cur = cn.cursor()
+    cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+    want = {tuple(r[:4]): r[4] for r in search.source_rows(cur, opts.user)}
+    cur.execute(f"SELECT user_id, term, kind, row_id, weight FROM search_index {where}", params)
+    have = {tuple(r[:4]): r[4] for r in cur.fetchall()}
+    cn.rollback(); cur.close(); cn.close()
+
+    bad = sorted(k for k in want.keys() | have.keys() if want.get(k) != have.get(k))
+    for uid, term, kind, row_id in bad[:50]:
+        print(f"user {uid} {kind} {row_id} {term!r}: weight {want.get((uid, term, kind, row_id))} "
+              f"!= indexed {have.get((uid, term, kind, row_id))}")
+    print(f"{len(want)} term rows checked, {len(bad)} mismatched")
+    if bad:
+        sys.exit(1)
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("daily-rebuild", help="recompute nutrient_daily from nutrient_history")
+    p.add_argument("--user", type=int, help="only this user (default: everyone)")
+    p.set_defaults(fn=daily_rebuild)
+
+    p = sub.add_parser("daily-verify", help="compare nutrient_daily with nutrient_history")
+    p.add_argument("--user", type=int, help="only this user (default: everyone)")
+    p.set_defaults(fn=daily_verify)
+
+    p = sub.add_parser("counts-rebuild", help="recompute task_counts from tasks")
+    p.add_argument("--user", type=int, help="only this user (default: everyone)")
+    p.set_defaults(fn=counts_rebuild)
+
+    p = sub.add_parser("counts-verify", help="compare task_counts with tasks")
+    p.add_argument("--user", type=int, help="only this user (default: everyone)")
+    p.set_defaults(fn=counts_verify)
+
+    p = sub.add_parser("calendar-rebuild", help="recompute calendar_days from calendar_events")
+    p.add_argument("--user", type=int, help="only this user (default: everyone)")
+    p.set_defaults(fn=calendar_rebuild)
+
+    p = sub.add_parser("calendar-verify", help="compare calendar_days with calendar_events")
+    p.add_argument("--user", type=int, help="only this user (default: everyone)")
+    p.set_defaults(fn=calendar_verify)
+
+    p = sub.add_parser("search-rebuild", help="re-index search_index from diary, tasks, events and foods")
+    p.add_argument("--user", type=int, help="only this user (default: everyone)")
+    p.set_defaults(fn=search_rebuild)
+
+    p = sub.add_parser("search-verify", help="compare search_index with diary, tasks, events and foods")
+    p.add_argument("--user", type=int, help="only this user (default: everyone)")
+    p.set_defaults(fn=search_verify)
+
+    opts = ap.parse_args()
+    opts.fn(opts)
+
+if __name__ == "__main__":
+    main()
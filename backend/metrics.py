@@ -0,0 +1,210 @@
+# metrics.py
+# In-process metrics registry rendered in the Prometheus text format.
+# With METRICS_DIR set (serve.py sets it), every process also writes its
+# snapshot to METRICS_DIR/<pid>.json about once a second, and a scrape of
+# any worker merges all of them: counters and histograms are summed (dead
+# workers' totals are kept), gauges are summed over live processes only.
+import fcntl, json, os, threading, time
+
+METRICS_DIR   = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH = float(os.environ.get('METRICS_FLUSH', '1'))   # seconds between snapshots
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "http_requests_total": ("counter", "Requests served, by route and status."),
+    "http_request_duration_seconds": ("histogram", "Request latency, by route."),
+    "http_requests_in_flight": ("gauge", "Requests being served right now."),
+    "db_queries_total": ("counter", "SQL statements run, by route."),
+    "db_query_seconds_total": ("counter", "Time spent in the DB driver, by route."),
+    "db_pool_connections": ("gauge", "Pooled DB connections by state."),
+    "db_pool_waits_total": ("counter", "Acquires that had to wait for a free connection."),
+    "db_pool_timeouts_total": ("counter", "Acquires that gave up (503)."),
+    "cache_hits_total": ("counter", "Cache hits, by cache."),
+    "cache_misses_total": ("counter", "Cache misses, by cache."),
+    "cache_evictions_total": ("counter", "Entries evicted for space, by cache."),
+    "cache_hit_ratio": ("gauge", "hits / (hits + misses) since start, by cache."),
+    "pwhash_rejected_total": ("counter", "Password hashes refused because the pool was full."),
+}
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}      # (name, labels) -> value
+        self._hists = {}         # (name, labels) -> [per-bucket counts..., +Inf, sum]
+        self._gauges = {}        # (name, labels) -> value
+        self._collectors = []    # () -> [(kind, name, labels, value)], run per snapshot
+        self._flusher_pid = None
+
+    # ---------- recording ----------
+    def inc(self, name, labels=(), value=1.0):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def add_gauge(self, name, labels=(), value=1.0):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0.0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(labels))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            for i, b in enumerate(BUCKETS):
+                if seconds <= b:
+                    h[i] += 1; break
+            else:
+                h[len(BUCKETS)] += 1
+            h[-1] += seconds
+        self._ensure_flusher()
+
+    def collector(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    # ---------- snapshots ----------
+    def snapshot(self) -> dict:
+        with self._lock:
+            snap = {"counters": [[n, list(l), v] for (n, l), v in self._counters.items()],
+                    "hists": [[n, list(l), list(h)] for (n, l), h in self._hists.items()],
+                    "gauges": [[n, list(l), v] for (n, l), v in self._gauges.items()]}
+        for fn in self._collectors:
+            for kind, name, labels, value in fn():
+                snap["counters" if kind == "counter" else "gauges"].append([name, list(labels), value])
+        return snap
+
+    def _ensure_flusher(self):
+        if not METRICS_DIR or self._flusher_pid == os.getpid(): return
+        with self._lock:
+            if self._flusher_pid == os.getpid(): return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="metrics", daemon=True).start()
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            self.flush()
+            time.sleep(METRICS_FLUSH)
+
+    def flush(self):
+        if not METRICS_DIR: return
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    # ---------- scrape ----------
+    def merged(self) -> dict:
+        if not METRICS_DIR:
+            return self.snapshot()
+        self.flush()
+        snaps = []
+        with open(os.path.join(METRICS_DIR, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = os.path.join(METRICS_DIR, "archive.json")
+            for fn in os.listdir(METRICS_DIR):
+                if not fn.endswith(".json") or fn == "archive.json": continue
+                snap = _read(os.path.join(METRICS_DIR, fn))
+                if snap is None: continue
+                if _alive(int(fn[:-5])):
+                    snaps.append(snap)
+                else:
+                    # a recycled/dead worker: keep its totals, forget its gauges
+                    snap["gauges"] = []
+                    _write(archive, _merge([_read(archive) or {}, snap]))
+                    os.unlink(os.path.join(METRICS_DIR, fn))
+            snaps.append(_read(archive) or {})
+        return _merge(snaps)
+
+    def render(self) -> str:
+        m = self.merged()
+        samples = {}                          # name -> [(labels, value)]
+        for name, labels, v in m["counters"] + m["gauges"]:
+            samples.setdefault(name, []).append((labels, v))
+        hits = {tuple(map(tuple, l)): v for l, v in samples.get("cache_hits_total", [])}
+        misses = {tuple(map(tuple, l)): v for l, v in samples.get("cache_misses_total", [])}
+        for l, h in hits.items():
+            total = h + misses.get(l, 0)
+            samples.setdefault("cache_hit_ratio", []).append(([list(p) for p in l], h / total if total else 0.0))
+
+        out = []
+        for name in sorted(samples):
+            _header(out, name)
+            for labels, v in sorted(samples[name]):
+                out.append(f"{name}{_labels(labels)} {_num(v)}")
+        hists = {}
+        for name, labels, h in m["hists"]:
+            hists.setdefault(name, []).append((labels, h))
+        for name in sorted(hists):
+            _header(out, name)
+            for labels, h in sorted(hists[name]):
+                cum = 0
+                for b, c in zip(BUCKETS + ("+Inf",), h[:-1]):
+                    cum += c
+                    out.append(f"{name}_bucket{_labels(labels + [['le', str(b)]])} {cum}")
+                out.append(f"{name}_sum{_labels(labels)} {_num(h[-1])}")
+                out.append(f"{name}_count{_labels(labels)} {cum}")
+        return "\n".join(out) + "\n"
+
+def _merge(snaps) -> dict:
+    acc = {"counters": {}, "hists": {}, "gauges": {}}
+    for s in snaps:
+        for kind in ("counters", "gauges"):
+            for name, labels, v in s.get(kind, ()):
+                key = (name, tuple(map(tuple, labels)))
+                acc[kind][key] = acc[kind].get(key, 0.0) + v
+        for name, labels, h in s.get("hists", ()):
+            key = (name, tuple(map(tuple, labels)))
+            cur = acc["hists"].get(key)
+            acc["hists"][key] = list(h) if cur is None else [a + b for a, b in zip(cur, h)]
+    return {kind: [[n, [list(p) for p in l], v] for (n, l), v in d.items()]
+            for kind, d in acc.items()}
+
+def _read(path):
+    try:
+        with open(path) as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write(path, snap):
+    with open(path + ".tmp", "w") as f:
+        json.dump(snap, f)
+    os.replace(path + ".tmp", path)
+
+def _alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def _header(out, name):
+    kind, text = HELP.get(name, ("untyped", name))
+    out.append(f"# HELP {name} {text}")
+    out.append(f"# TYPE {name} {kind}")
+
+def _labels(labels) -> str:
+    if not labels: return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+def _num(v) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+registry = Registry()
+
+# ---------- request hooks (app.py and asgi.py) ----------
+def request_started():
+    registry.add_gauge("http_requests_in_flight", (), 1)
+
+def request_finished(method, route, status, seconds, queries=None, db_seconds=None):
+    registry.add_gauge("http_requests_in_flight", (), -1)
+    registry.inc("http_requests_total", (("method", method), ("route", route), ("status", str(status))))
+    registry.observe("http_request_duration_seconds", (("method", method), ("route", route)), seconds)
+    if queries:
+        registry.inc("db_queries_total", (("route", route),), queries)
+        registry.inc("db_query_seconds_total", (("route", route),), db_seconds or 0.0)
@@ -11,12 +11,13 @@ USE mobile;
 -- -------------------------------------------------
 DROP TABLE IF EXISTS profile;
 CREATE TABLE profile (
-  id            INT            NOT NULL PRIMARY KEY,
+  id            INT            NOT NULL AUTO_INCREMENT PRIMARY KEY,
   display_name  VARCHAR(190)   NOT NULL,
   email         VARCHAR(190)   NOT NULL,
   password_hash VARBINARY(100) NULL,   -- nullable for quick seeded users
   avatar_url    VARCHAR(255)   NULL,
   bio           VARCHAR(500)   NULL,
+  timezone      VARCHAR(64)    NOT NULL DEFAULT 'UTC',  -- IANA name: the user's "today"
   updated_at    TIMESTAMP      NULL DEFAULT NULL,
   UNIQUE KEY uq_profile_email (email)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -40,13 +41,38 @@ CREATE TABLE tasks (
   due_date   DATE          NULL,
   done       TINYINT(1)    NOT NULL DEFAULT 0,
   created_at TIMESTAMP     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  row_version BIGINT       NOT NULL DEFAULT 0,      -- /sync sequence of the last write
   CONSTRAINT fk_tasks_user FOREIGN KEY (user_id)
     REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE INDEX idx_tasks_user ON tasks(user_id);
 CREATE INDEX idx_tasks_user_due ON tasks(user_id, due_date);
-CREATE INDEX idx_tasks_user_done ON tasks(user_id, done);
+-- GET /tasks order (done, newest first; id breaks ties for keyset pages)
+CREATE INDEX idx_tasks_user_done ON tasks(user_id, done, created_at DESC, id DESC);
+CREATE INDEX idx_tasks_user_ver ON tasks(user_id, row_version);
+
+-- -----------------------------------------
+-- Task counters  (/goal/progress)
+--   one row per user, urgency and dated (has a due_date), kept in step
+--   with tasks by the backend in the same transaction
+--   rebuild/verify: python manage.py counts-rebuild | counts-verify
+-- -----------------------------------------
+DROP TABLE IF EXISTS task_counts;
+CREATE TABLE task_counts (
+  user_id  INT        NOT NULL,
+  urgency  TINYINT    NOT NULL,
+  dated    TINYINT(1) NOT NULL,
+  total    INT        NOT NULL DEFAULT 0,
+  done     INT        NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, urgency, dated),
+  CONSTRAINT fk_tc_user FOREIGN KEY (user_id)
+    REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT INTO task_counts (user_id, urgency, dated, total, done)
+SELECT user_id, urgency, due_date IS NOT NULL, COUNT(*), SUM(done<>0)
+FROM tasks GROUP BY user_id, urgency, due_date IS NOT NULL;
 
 -- -----------------------------------------
 -- Goal  (/goal GET/PUT)
@@ -96,12 +122,14 @@ CREATE TABLE food_items (
   protein_g   DECIMAL(7,2) NOT NULL DEFAULT 0,
   per_unit_g  DECIMAL(7,2) NOT NULL DEFAULT 100,  -- 100 -> values are per 100g
   created_at  TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  row_version BIGINT       NOT NULL DEFAULT 0,
   CONSTRAINT fk_food_user FOREIGN KEY (user_id)
     REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE,
   UNIQUE KEY uq_food_user_name (user_id, name)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE INDEX idx_food_user ON food_items(user_id);
+CREATE INDEX idx_food_user_ver ON food_items(user_id, row_version);
 
 -- Sample foods for user 1
 INSERT INTO food_items (user_id, name, veg_g, carb_g, protein_g, per_unit_g) VALUES
@@ -114,12 +142,16 @@ ON DUPLICATE KEY UPDATE
 -- -----------------------------------------
 -- Nutrient history (what the user ate)
 --   used by /nutrients/history (GET/POST/PUT/DELETE)
+--   eaten_at is UTC; local_day is its date in the user's timezone at
+--   the time of the write (set by the backend), so day filters are
+--   index lookups instead of DATE(eaten_at)
 -- -----------------------------------------
 DROP TABLE IF EXISTS nutrient_history;
 CREATE TABLE nutrient_history (
   id         INT AUTO_INCREMENT PRIMARY KEY,
   user_id    INT          NOT NULL,
   eaten_at   DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  local_day  DATE         NOT NULL,
   food_id    INT          NULL,                  -- optional link to catalog
   name       VARCHAR(190) NULL,                  -- ad-hoc name when no food_id
   veg_g      DECIMAL(7,2) NOT NULL DEFAULT 0,    -- actual grams for this entry
@@ -128,6 +160,7 @@ CREATE TABLE nutrient_history (
   amount_g   DECIMAL(7,2) NULL,
   note       VARCHAR(255) NULL,
   created_at TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  row_version BIGINT      NOT NULL DEFAULT 0,
   CONSTRAINT fk_nh_user FOREIGN KEY (user_id)
     REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE,
   CONSTRAINT fk_nh_food FOREIGN KEY (food_id)
@@ -135,10 +168,35 @@ CREATE TABLE nutrient_history (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE INDEX idx_nh_user_time ON nutrient_history(user_id, eaten_at);
+CREATE INDEX idx_nh_user_day ON nutrient_history(user_id, local_day, eaten_at);
+CREATE INDEX idx_nh_user_ver ON nutrient_history(user_id, row_version);
 
 -- Seed one history item for today (user 1)
-INSERT INTO nutrient_history (user_id, eaten_at, food_id, name, veg_g, carb_g, protein_g, amount_g, note)
-VALUES (1, NOW(), NULL, 'Seafood Paella', 40, 55, 25, 300, 'Lunch');
+INSERT INTO nutrient_history (user_id, eaten_at, local_day, food_id, name, veg_g, carb_g, protein_g, amount_g, note)
+VALUES (1, UTC_TIMESTAMP(), UTC_DATE(), NULL, 'Seafood Paella', 40, 55, 25, 300, 'Lunch');
+
+-- -----------------------------------------
+-- Daily nutrient totals (GET /nutrients)
+--   one row per user per local_day, kept in step with
+--   nutrient_history by the backend in the same transaction
+--   rebuild/verify: python manage.py daily-rebuild | daily-verify
+-- -----------------------------------------
+DROP TABLE IF EXISTS nutrient_daily;
+CREATE TABLE nutrient_daily (
+  user_id    INT           NOT NULL,
+  day        DATE          NOT NULL,
+  veg_g      DECIMAL(12,2) NOT NULL DEFAULT 0,
+  carb_g     DECIMAL(12,2) NOT NULL DEFAULT 0,
+  protein_g  DECIMAL(12,2) NOT NULL DEFAULT 0,
+  entries    INT           NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, day),
+  CONSTRAINT fk_nd_user FOREIGN KEY (user_id)
+    REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT INTO nutrient_daily (user_id, day, veg_g, carb_g, protein_g, entries)
+SELECT user_id, local_day, SUM(veg_g), SUM(carb_g), SUM(protein_g), COUNT(*)
+FROM nutrient_history GROUP BY user_id, local_day;
 
 -- -----------------------------------------
 -- Diary (/diary GET/POST/DELETE)
@@ -153,11 +211,13 @@ CREATE TABLE diary_entries (
   mood       VARCHAR(30)  NULL,
   created_at TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
   updated_at TIMESTAMP    NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
+  row_version BIGINT      NOT NULL DEFAULT 0,
   CONSTRAINT fk_diary_user FOREIGN KEY (user_id)
     REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
-CREATE INDEX idx_diary_user_date ON diary_entries(user_id, entry_date);
+CREATE INDEX idx_diary_user_date ON diary_entries(user_id, entry_date, created_at);
+CREATE INDEX idx_diary_user_ver ON diary_entries(user_id, row_version);
 
 -- -----------------------------------------
 -- Calendar (/calendar/events GET/POST/DELETE)
@@ -173,11 +233,117 @@ CREATE TABLE calendar_events (
   all_day    TINYINT(1)   NOT NULL DEFAULT 0,
   color      VARCHAR(16)  NULL,                  -- e.g. '#FFAA00'
   created_at TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  row_version BIGINT      NOT NULL DEFAULT 0,
+  -- recurring series: one row, expanded per request window by the backend
+  --   rrule      FREQ=DAILY|WEEKLY|MONTHLY[;INTERVAL=n][;COUNT=n|;UNTIL=YYYYMMDD]
+  --   exdates    skipped occurrences (their starts_at, comma-separated)
+  --   series_end end of the last occurrence, NULL if endless
+  rrule      VARCHAR(255) NULL,
+  exdates    TEXT         NULL,
+  series_end DATETIME     NULL,
+  recurring  TINYINT(1) AS (rrule IS NOT NULL) STORED,
+  -- the event occupies [starts_at, span_end): all-day events whole days
+  -- (starts_at's day through ends_at's day), a timed event without ends_at
+  -- is an instant
+  span_end   DATETIME AS (CASE WHEN all_day
+                                THEN DATE(COALESCE(ends_at, starts_at)) + INTERVAL 1 DAY
+                                ELSE COALESCE(ends_at, starts_at) END) STORED,
+  -- longer than 62 days: no calendar_days rows (see below)
+  long_span  TINYINT(1) AS (span_end > starts_at + INTERVAL 62 DAY) STORED,
   CONSTRAINT fk_cal_user FOREIGN KEY (user_id)
     REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE INDEX idx_cal_user_time ON calendar_events(user_id, starts_at);
+CREATE INDEX idx_cal_user_long ON calendar_events(user_id, long_span, starts_at);
+CREATE INDEX idx_cal_user_series ON calendar_events(user_id, recurring, starts_at);
+CREATE INDEX idx_cal_user_ver ON calendar_events(user_id, row_version);
+
+-- -----------------------------------------
+-- Calendar day index (/calendar/events)
+--   one row per day each event touches, so "what is still running at the
+--   start of the window" is one primary-key range; written with the event
+--   (long_span events are looked up through idx_cal_user_long instead,
+--   and recurring series through idx_cal_user_series)
+--   rebuild/verify: python manage.py calendar-rebuild | calendar-verify
+-- -----------------------------------------
+DROP TABLE IF EXISTS calendar_days;
+CREATE TABLE calendar_days (
+  user_id   INT  NOT NULL,
+  day       DATE NOT NULL,
+  event_id  INT  NOT NULL,
+  PRIMARY KEY (user_id, day, event_id),
+  CONSTRAINT fk_cd_event FOREIGN KEY (event_id)
+    REFERENCES calendar_events(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- -----------------------------------------
+-- Search index (/search)
+--   one row per word (term) of each diary entry, task, calendar event and
+--   food, with its weight in that row (title words 3, body words 1); a
+--   prefix query is a range of the primary key. Written by the backend
+--   with the row, in the same transaction (search.py tokenizes)
+--   kind: 'diary', 'task', 'event', 'food'
+--   fill / check after loading data: python manage.py search-rebuild | search-verify
+-- -----------------------------------------
+DROP TABLE IF EXISTS search_index;
+CREATE TABLE search_index (
+  user_id  INT               NOT NULL,
+  term     VARCHAR(32)       NOT NULL,
+  kind     VARCHAR(16)       NOT NULL,
+  row_id   INT               NOT NULL,
+  weight   SMALLINT UNSIGNED NOT NULL,
+  PRIMARY KEY (user_id, term, kind, row_id),
+  KEY idx_search_row (user_id, kind, row_id),
+  CONSTRAINT fk_search_user FOREIGN KEY (user_id)
+    REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin;
+
+-- index the sample foods above, so /foods?q= and /search find them on a fresh
+-- install (their names are plain lower-case words once split on spaces;
+-- anything else loaded with SQL needs manage.py search-rebuild)
+INSERT INTO search_index (user_id, term, kind, row_id, weight)
+SELECT f.user_id, w.term, 'food', f.id, 3 * COUNT(*)
+FROM food_items f,
+     JSON_TABLE(CONCAT('["', REPLACE(LOWER(f.name), ' ', '","'), '"]'),
+                '$[*]' COLUMNS (term VARCHAR(32) PATH '$')) AS w
+WHERE CHAR_LENGTH(w.term) > 1
+GROUP BY f.user_id, w.term, f.id;
+
+-- -----------------------------------------
+-- Per-user data versions (ETag / If-None-Match, /sync)
+--   resource: 'tasks', 'profile', 'nutrient_goal', 'nutrient_history',
+--             'diary', 'calendar', 'foods', 'goal', and 'sync' = the user's
+--             change sequence stamped into row_version on every write
+--   bumped by the backend in the same transaction as every write
+-- -----------------------------------------
+DROP TABLE IF EXISTS data_versions;
+CREATE TABLE data_versions (
+  user_id  INT         NOT NULL,
+  resource VARCHAR(32) NOT NULL,
+  version  BIGINT      NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, resource),
+  CONSTRAINT fk_dv_user FOREIGN KEY (user_id)
+    REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- -----------------------------------------
+-- Sync tombstones (/sync?since=<cursor> deletes)
+--   tbl: tasks, diary_entries, nutrient_history, calendar_events, food_items
+-- -----------------------------------------
+DROP TABLE IF EXISTS sync_tombstones;
+CREATE TABLE sync_tombstones (
+  user_id     INT         NOT NULL,
+  tbl         VARCHAR(32) NOT NULL,
+  row_id      INT         NOT NULL,
+  row_version BIGINT      NOT NULL,
+  deleted_at  TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_id, tbl, row_id),
+  CONSTRAINT fk_tomb_user FOREIGN KEY (user_id)
+    REFERENCES profile(id) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE INDEX idx_tomb_user_ver ON sync_tombstones(user_id, row_version);
 
 -- -------------------------------------------------
 -- Done.
@@ -0,0 +1,383 @@
+# plancheck.py
+# Query-plan regression check. Loads mobile.sql into a scratch database,
+# seeds it with realistic volumes, calls every route through the Flask app
+# while recording the SQL it sends, then EXPLAINs each distinct statement.
+# Exits 1 when a plan reads more than --max-rows rows of a table with a full
+# table/index scan or a filesort, or when a statement reads --max-rows more
+# rows than it returns, whatever the access type (e.g. a ref on user_id with
+# the real condition applied row by row), so an unusable index is caught
+# before deploy.
+#
+#   python plancheck.py                                   (scratch db: mobile_plancheck)
+#   python plancheck.py --users 50 --rows 5000 --max-rows 1000 --keep -v
+#
+# Uses DB_HOST/DB_PORT/DB_USER/DB_PASSWORD like the app; never touches DB_NAME.
+import argparse, os, random, re, sys
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+import db_config
+import search
+from db_config import DB_CONFIG, ConnectionPool
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mobile.sql")
+TODAY = date.today().isoformat()
+MONTH_AGO = (date.today() - timedelta(days=30)).isoformat()
+MONTH_AHEAD = (date.today() + timedelta(days=30)).isoformat()
+
+# (method, path, json body or ids -> body[, save the new row's id / next_cursor as])
+REQUESTS = [
+    ("GET",    "/auth/me", None),
+    ("POST",   "/auth/login", {"email": "user1@example.com", "password": "plancheck"}),
+    ("GET",    "/profile", None),
+    ("PUT",    "/profile", {"bio": "plancheck"}),
+    ("GET",    "/tasks", None),
+    ("GET",    "/tasks?cursor=&limit=20", None, "tasks_page"),
+    ("GET",    "/tasks?cursor={tasks_page}&limit=20", None),
+    ("GET",    "/tasks?done=0&urgency=1,2", None),
+    ("GET",    "/tasks?done=0&cursor=&limit=20", None, "open_page"),
+    ("GET",    "/tasks?done=0&cursor={open_page}&limit=20", None),
+    ("GET",    f"/tasks?due_on={TODAY}", None),
+    ("GET",    f"/tasks?done=0&due_before={TODAY}&sort=due", None),
+    ("GET",    f"/tasks?due_after={MONTH_AGO}&due_before={TODAY}&sort=due&cursor=&limit=20", None, "due_page"),
+    ("GET",    f"/tasks?due_after={MONTH_AGO}&due_before={TODAY}&sort=due&cursor={{due_page}}&limit=20", None),
+    ("GET",    "/tasks?sort=due&cursor=&limit=20", None, "undated_page"),
+    ("GET",    "/tasks?sort=due&cursor={undated_page}&limit=20", None),
+    ("POST",   "/tasks", {"title": "plancheck", "due_date": TODAY}, "task"),
+    ("PUT",    "/tasks/{task}", {"done": 1}),
+    ("DELETE", "/tasks/{task}", None),
+    ("GET",    "/goal", None),
+    ("GET",    "/goal/progress", None),
+    ("PUT",    "/goal", {"progress": 0.5}),
+    ("GET",    "/nutrients", None),
+    ("GET",    f"/nutrients?date={TODAY}", None),
+    ("PUT",    "/nutrients/goal", {"veg": 0.4, "carb": 0.4, "protein": 0.2}),
+    ("GET",    "/nutrients/history", None),
+    ("GET",    f"/nutrients/history?date={TODAY}", None),
+    ("GET",    "/nutrients/history?cursor=", None, "history_page"),
+    ("GET",    "/nutrients/history?cursor={history_page}", None),
+    ("POST",   "/foods", {"name": "plancheck food", "veg_g": 10}, "food"),
+    ("GET",    "/foods", None),
+    ("GET",    "/foods?q=apple", None),
+    ("GET",    "/foods?cursor=&limit=20", None, "foods_page"),
+    ("GET",    "/foods?cursor={foods_page}&limit=20", None),
+    ("PUT",    "/foods/{food}", {"veg_g": 12}),
+    ("POST",   "/nutrients/history", lambda ids: {"food_id": ids["food"], "amount_g": 150}),
+    ("POST",   "/nutrients/history", {"name": "plancheck", "veg_g": 5}, "meal"),
+    ("PUT",    "/nutrients/history/{meal}", {"veg_g": 6}),
+    ("DELETE", "/nutrients/history/{meal}", None),
+    ("DELETE", "/foods/{food}", None),
+    ("GET",    "/diary", None),
+    ("GET",    f"/diary?date={TODAY}", None),
+    ("GET",    "/diary?cursor=&limit=20", None, "diary_page"),
+    ("GET",    "/diary?cursor={diary_page}&limit=20", None),
+    ("POST",   "/diary", {"title": "plancheck", "content": "plancheck"}, "entry"),
+    ("DELETE", "/diary/{entry}", None),
+    ("GET",    f"/calendar/events?start={MONTH_AGO}&end={TODAY}", None),
+    ("GET",    f"/calendar/events?start={MONTH_AGO}&end={TODAY}&cursor=&limit=5", None, "events_page"),
+    ("GET",    f"/calendar/events?start={MONTH_AGO}&end={TODAY}&cursor={{events_page}}&limit=5", None),
+    ("GET",    f"/calendar/events?start={TODAY}&end={TODAY}", None),
+    ("POST",   "/calendar/events", {"title": "plancheck", "starts_at": f"{TODAY} 09:00:00",
+                                    "ends_at": f"{MONTH_AHEAD} 10:00:00"}, "event"),
+    ("DELETE", "/calendar/events/{event}", None),
+    ("POST",   "/calendar/events", {"title": "plancheck weekly", "starts_at": f"{MONTH_AGO} 09:00:00",
+                                    "ends_at": f"{MONTH_AGO} 10:00:00", "rrule": "FREQ=WEEKLY"}, "series"),
+    ("DELETE", f"/calendar/events/{{series}}?occurrence={MONTH_AGO} 09:00:00", None),
+    ("GET",    f"/calendar/events?start={MONTH_AGO}&end={MONTH_AHEAD}", None),
+    ("GET",    f"/agenda?start={MONTH_AGO}&end={TODAY}", None),
+    ("GET",    f"/agenda?start={MONTH_AGO}&end={TODAY}&counts=1", None),
+    ("GET",    "/foods?q=a", None),
+    ("GET",    "/search?q=note7", None),
+    ("GET",    "/search?q=note7%20note8&kind=diary,food", None),
+    ("GET",    "/search?q=note12", None),
+    ("GET",    "/search?q=note12&cursor=&limit=5", None, "search_page"),
+    ("GET",    "/search?q=note12&cursor={search_page}&limit=5", None),
+    ("GET",    "/sync", None),
+    ("GET",    "/sync?since=1", None),
+]
+
+NOTES = 500     # note0..note499: words rare enough for a selective /search
+WORDS = ("apple", "banana", "rice", "chicken", "salad", "oats", "yogurt", "beans",
+         "bread", "salmon", "tofu", "pasta", "soup", "cheese", "egg", "lentils")
+
+# ---------- schema ----------
+def _schema_statements():
+    sql = open(SCHEMA, encoding="utf-8").read()
+    sql = re.sub(r"--[^\n]*", "", sql)
+    for stmt in sql.split(";"):
+        stmt = stmt.strip()
+        # the scratch database replaces mobile.sql's own DROP/CREATE/USE
+        if stmt and not re.match(r"(DROP|CREATE)\s+DATABASE|USE\s", stmt, re.I):
+            yield stmt
+
+def load_schema(opts):
+    server = {k: v for k, v in DB_CONFIG.items() if k != "database"}
+    cn = mysql.connector.connect(**server); cur = cn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS `{opts.db}`")
+    cur.execute(f"CREATE DATABASE `{opts.db}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+    cur.execute(f"USE `{opts.db}`")
+    for stmt in _schema_statements():
+        cur.execute(stmt)
+        if cur.with_rows: cur.fetchall()
+    cn.commit(); cur.close(); cn.close()
+
+def drop_schema(opts):
+    server = {k: v for k, v in DB_CONFIG.items() if k != "database"}
+    cn = mysql.connector.connect(**server); cur = cn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS `{opts.db}`")
+    cur.close(); cn.close()
+
+# ---------- seed ----------
+def _insert(cur, table, cols, rows, batch=1000):
+    sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join(['%s'] * len(cols))})"
+    for i in range(0, len(rows), batch):
+        cur.executemany(sql, rows[i:i + batch])
+
+def seed(opts):
+    """--users users (the demo users 1 and 2 included) with --rows rows each in
+    every per-user table, spread over the past year (calendar: +-6 months)."""
+    rnd = random.Random(opts.seed)
+    now = datetime.now().replace(microsecond=0)
+    ago = lambda days: now - timedelta(seconds=rnd.randrange(days * 86400))
+    grams = lambda: round(rnd.uniform(0, 80), 2)
+    n = n_foods = opts.rows
+
+    zones = ("UTC", "Europe/Paris", "America/New_York", "Asia/Tokyo", "Australia/Sydney")
+    cn = db_config.get_connection(); cur = cn.cursor()
+    _insert(cur, "profile", ("id", "display_name", "email", "timezone"),
+            [(u, f"Seed User #{u}", f"user{u}@example.com", rnd.choice(zones))
+             for u in range(3, opts.users + 1)])
+    for uid in range(1, opts.users + 1):
+        _insert(cur, "tasks", ("user_id", "title", "urgency", "due_date", "done", "created_at", "row_version"),
+                [(uid, f"task {i}", rnd.randint(1, 3),
+                  (now + timedelta(days=rnd.randint(-60, 60))).date() if rnd.random() < 0.7 else None,
+                  int(rnd.random() < 0.5), ago(365), i) for i in range(1, n + 1)])
+        _insert(cur, "food_items", ("user_id", "name", "veg_g", "carb_g", "protein_g", "created_at", "row_version"),
+                [(uid, f"{rnd.choice(WORDS)} {i}", grams(), grams(), grams(), ago(365), i)
+                 for i in range(1, n_foods + 1)])
+        meals = [ago(365) for _ in range(n)]
+        _insert(cur, "nutrient_history", ("user_id", "eaten_at", "local_day", "name", "veg_g", "carb_g",
+                                          "protein_g", "amount_g", "row_version"),
+                [(uid, t, t.date(), rnd.choice(WORDS), grams(), grams(), grams(), 100, i)
+                 for i, t in enumerate(meals, 1)])
+        _insert(cur, "diary_entries", ("user_id", "entry_date", "title", "content", "mood", "created_at",
+                                       "row_version"),
+                [(uid, ago(365).date(), f"entry {i}",
+                  " ".join(rnd.choices(WORDS, k=20) + [f"note{rnd.randrange(NOTES)}" for _ in range(2)]),
+                  rnd.choice(("good", "ok", "bad")), ago(365), i) for i in range(1, n + 1)])
+        events = []
+        for i in range(1, n + 1):
+            start = now + timedelta(minutes=rnd.randrange(-180 * 1440, 180 * 1440))
+            minutes = rnd.choice((30, 60, 120, 1440, 3 * 1440)) if rnd.random() < 0.99 else 90 * 1440
+            events.append((uid, f"event {i}", start, start + timedelta(minutes=minutes)
+                           if rnd.random() < 0.95 else None, int(rnd.random() < 0.1), i))
+        _insert(cur, "calendar_events", ("user_id", "title", "starts_at", "ends_at", "all_day", "row_version"),
+                events)
+        rules = ("FREQ=DAILY", "FREQ=WEEKLY", "FREQ=WEEKLY;INTERVAL=2;COUNT=20", "FREQ=MONTHLY")
+        starts = [ago(365) for _ in rules]      # series_end left NULL: only widens the lookup
+        _insert(cur, "calendar_events", ("user_id", "title", "starts_at", "ends_at", "rrule", "row_version"),
+                [(uid, f"series {i}", s, s + timedelta(hours=1), rule, n + i)
+                 for i, (rule, s) in enumerate(zip(rules, starts), 1)])
+        _insert(cur, "sync_tombstones", ("user_id", "tbl", "row_id", "row_version"),
+                [(uid, "tasks", n + i, n + i) for i in range(1, n // 10 + 1)])
+        _insert(cur, "data_versions", ("user_id", "resource", "version"),
+                [(uid, r, n) for r in ("tasks", "profile", "nutrient_goal", "nutrient_history",
+                                       "diary", "calendar", "foods", "goal")] + [(uid, "sync", 2 * n)])
+        cn.commit()
+    cur.execute("""
+        INSERT INTO nutrient_daily (user_id, day, veg_g, carb_g, protein_g, entries)
+        SELECT user_id, local_day, SUM(veg_g), SUM(carb_g), SUM(protein_g), COUNT(*)
+        FROM nutrient_history GROUP BY user_id, local_day
+        ON DUPLICATE KEY UPDATE veg_g=VALUES(veg_g), carb_g=VALUES(carb_g),
+                                protein_g=VALUES(protein_g), entries=VALUES(entries)
+    """)
+    cur.execute("""
+        INSERT INTO task_counts (user_id, urgency, dated, total, done)
+        SELECT user_id, urgency, due_date IS NOT NULL, COUNT(*), SUM(done<>0)
+        FROM tasks GROUP BY user_id, urgency, due_date IS NOT NULL
+        ON DUPLICATE KEY UPDATE total=VALUES(total), done=VALUES(done)
+    """)
+    cur.execute("""
+        INSERT INTO calendar_days (user_id, day, event_id)
+        WITH RECURSIVE d (user_id, event_id, day, span_end) AS (
+          SELECT user_id, id, DATE(starts_at), span_end FROM calendar_events
+          WHERE long_span=0 AND recurring=0
+          UNION ALL
+          SELECT user_id, event_id, day + INTERVAL 1 DAY, span_end FROM d
+          WHERE day + INTERVAL 1 DAY < span_end
+        )
+        SELECT user_id, day, event_id FROM d
+    """)
+    search.rebuild(cn)
+    cn.commit()
+    cur.execute("SHOW TABLES")
+    for (table,) in cur.fetchall():
+        cur.execute(f"ANALYZE TABLE `{table}`"); cur.fetchall()
+    cur.close(); cn.close()
+
+# ---------- record what the app sends ----------
+class _RecordingCursor:
+    # keeps the first run of each statement and the rows it returned
+    def __init__(self, cur, seen, label):
+        self._cur, self._seen, self._label = cur, seen, label
+        self._entry = None
+
+    def execute(self, sql, params=()):
+        norm = " ".join(sql.split())
+        self._entry = None if norm in self._seen else [sql, params, self._label[0], 0]
+        if self._entry: self._seen[norm] = self._entry
+        res = self._cur.execute(sql, params)
+        if self._entry and self._cur.description is None:
+            self._entry[3] = max(self._cur.rowcount or 0, 0)
+        return res
+
+    def _returned(self, rows):
+        if self._entry: self._entry[3] += len(rows)
+        return rows
+
+    def fetchall(self): return self._returned(self._cur.fetchall())
+    def fetchmany(self, size=1): return self._returned(self._cur.fetchmany(size))
+
+    def fetchone(self):
+        row = self._cur.fetchone()
+        if row is not None: self._returned([row])
+        return row
+
+    def __iter__(self):
+        for row in self._cur:
+            self._returned([row])
+            yield row
+
+    def __getattr__(self, name): return getattr(self._cur, name)
+
+class _RecordingConnection:
+    def __init__(self, raw, seen, label):
+        self._raw, self._seen, self._label = raw, seen, label
+
+    def cursor(self, *a, **kw):
+        return _RecordingCursor(self._raw.cursor(*a, **kw), self._seen, self._label)
+
+    def __getattr__(self, name): return getattr(self._raw, name)
+
+def record(opts) -> dict:
+    """normalized sql -> [sql, params, route, rows returned] for everything REQUESTS runs."""
+    seen, label = {}, [None]
+    db_config.set_pool(ConnectionPool(
+        connect=lambda: _RecordingConnection(db_config.get_connection(), seen, label)))
+    from app import create_app, _make_token
+    from respcache import response_cache
+    response_cache.max_bytes = 0                 # every GET must reach MySQL
+    client = create_app().test_client()
+    headers = {"Authorization": f"Bearer {_make_token(1)}"}
+
+    ids = {}
+    for method, path, body, *save in REQUESTS:
+        label[0] = f"{method} {path.split('?')[0]}"
+        resp = client.open(path.format(**ids), method=method, headers=headers,
+                           json=body(ids) if callable(body) else body)
+        if resp.status_code >= 500 or (save and resp.status_code >= 400):
+            print(f"warning: {method} {path.format(**ids)} -> {resp.status_code} "
+                  f"{resp.get_data(as_text=True)[:200]}", file=sys.stderr)
+        elif save:
+            data = resp.get_json()
+            ids[save[0]] = data["id"] if "id" in data else data.get("next_cursor") or ""
+    db_config.get_pool().dispose()
+    return seen
+
+# ---------- explain ----------
+EXPLAINABLE = re.compile(r"\s*(SELECT\s.*\bFROM\b|UPDATE\s|DELETE\s|INSERT\s.*\bSELECT\s)", re.I | re.S)
+
+# "-> Index lookup on t using idx (user_id=1) (cost=.. rows=..) (actual time=.. rows=21 loops=1)"
+ACCESS = re.compile(r"-> [^:]*? on (\S+) .*\(actual time=\S+ rows=([\d.e+]+) loops=(\d+)\)")
+LIMITED = re.compile(r"\bLIMIT\s+\d+\s*$", re.I)
+
+def examined(plan) -> int:
+    """Estimated rows read: each table's `rows` per lookup times the rows the
+    tables before it in the same SELECT pass on (rows * filtered / 100)."""
+    total, fanout = 0.0, {}
+    for row in plan:
+        if (row.get("table") or "").startswith("<"): continue   # see problems()
+        rows, prefix = float(row.get("rows") or 0), fanout.get(row.get("id"), 1.0)
+        total += rows * prefix
+        fanout[row.get("id")] = prefix * rows * float(row.get("filtered") or 100) / 100
+    return int(total)
+
+def rows_read(cur, sql, params) -> int:
+    """Rows actually read from tables (EXPLAIN ANALYZE runs the statement)."""
+    cur.execute("EXPLAIN ANALYZE " + sql, params)
+    text = next(iter(cur.fetchone().values()))
+    return int(sum(float(m[2]) * int(m[3]) for m in ACCESS.finditer(text)
+                   if not m[1].startswith("<")))
+
+def problems(plan, max_rows, read=0, returned=0) -> list:
+    out = []
+    for row in plan:
+        rows = int(row.get("rows") or 0)
+        if rows <= max_rows: continue
+        table, extra = row.get("table"), row.get("Extra") or ""
+        # <derived2>, <union2,3>: the output of the ranges above it, already counted
+        if (table or "").startswith("<"): continue
+        if row.get("type") == "ALL":
+            out.append(f"full scan of {table} (~{rows} rows)")
+        elif row.get("type") == "index":
+            out.append(f"full index scan of {table} via {row.get('key')} (~{rows} rows)")
+        if "filesort" in extra:
+            out.append(f"filesort over ~{rows} rows of {table}")
+    # any access type: rows read only to be thrown away by a condition the
+    # index could not apply (returning them all is the payload, not the plan)
+    if read - returned > max_rows:
+        out.append(f"reads ~{read} rows to return {returned}")
+    return out
+
+def explain(seen, opts) -> int:
+    cn = db_config.get_connection(); cur = cn.cursor(dictionary=True)
+    failed = checked = 0
+    for norm, (sql, params, route, returned) in sorted(seen.items(), key=lambda kv: kv[1][2]):
+        if not EXPLAINABLE.match(sql): continue
+        cur.execute("EXPLAIN " + sql, params)
+        plan = cur.fetchall()
+        checked += 1
+        read = examined(plan)
+        if read - returned > opts.max_rows and LIMITED.search(sql) and norm.upper().startswith(("SELECT", "WITH")):
+            # estimates ignore LIMIT: an index-ordered page stops early
+            read = min(read, rows_read(cur, sql, params))
+        bad = problems(plan, opts.max_rows, read, returned)
+        failed += bool(bad)
+        if bad or opts.verbose:
+            print(f"{'FAIL' if bad else 'ok  '} {route}: {norm[:160]} (returned {returned})")
+            for row in plan:
+                print(f"       {row.get('table')}: type={row.get('type')} key={row.get('key')} "
+                      f"rows={row.get('rows')} {row.get('Extra') or ''}")
+            for p in bad:
+                print(f"       -> {p}")
+    cn.rollback(); cur.close(); cn.close()
+    print(f"{checked} statements explained, {failed} over --max-rows {opts.max_rows}")
+    return failed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=os.environ.get("PLANCHECK_DB", "mobile_plancheck"),
+                    help="scratch database (dropped and recreated)")
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--rows", type=int, default=2000, help="rows per user per table")
+    ap.add_argument("--max-rows", type=int, default=500,
+                    help="scans/filesorts estimated above this many rows fail")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--keep", action="store_true", help="leave the scratch database behind")
+    ap.add_argument("--reuse", action="store_true", help="skip load/seed: use a kept database")
+    ap.add_argument("-v", "--verbose", action="store_true", help="print every plan")
+    opts = ap.parse_args()
+    if opts.db == DB_CONFIG["database"]:
+        sys.exit(f"--db {opts.db} is the app's own database; pick a scratch name")
+
+    if not opts.reuse: load_schema(opts)
+    DB_CONFIG["database"] = opts.db          # everything below, the app included, uses it
+    try:
+        if not opts.reuse: seed(opts)
+        failed = explain(record(opts), opts)
+    finally:
+        if not opts.keep: drop_schema(opts)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
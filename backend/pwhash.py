@@ -0,0 +1,92 @@
+# pwhash.py
+# bcrypt runs in a small process pool so a burst of logins/signups burns
+# other cores instead of holding the GIL in the request workers. At most
+# PW_QUEUE hashes may be running or waiting; beyond that callers get
+# HashBusy (-> 503 + Retry-After) rather than queueing behind the storm.
+import multiprocessing, os, threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PW_WORKERS    = int(os.environ.get('PW_WORKERS', '2'))     # hashing processes
+# running + waiting hashes; kept below serve.py's threads per worker, so a
+# login storm gets 503s before it ties up every request thread
+PW_QUEUE      = int(os.environ.get('PW_QUEUE', str(PW_WORKERS * 2)))
+PW_TIMEOUT    = float(os.environ.get('PW_TIMEOUT', '10'))  # seconds per hash
+
+class HashBusy(Exception):
+    """Too many password hashes in flight."""
+
+# ---------- run in the worker processes ----------
+def _hashpw(plain: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(plain, bcrypt.gensalt(rounds=rounds))
+
+def _checkpw(plain: bytes, hashed: bytes) -> bool:
+    try:    return bcrypt.checkpw(plain, hashed)
+    except ValueError: return False
+
+# ---------- pool ----------
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PW_QUEUE)
+_stats = {"hashed": 0, "checked": 0, "rejected": 0, "timeouts": 0}
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                # spawn: never fork a process that already runs request threads
+                _executor = ProcessPoolExecutor(
+                    max_workers=PW_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+                _executor_pid = os.getpid()
+    return _executor
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        with _lock: _stats["rejected"] += 1
+        raise HashBusy("password hashing saturated")
+    try:
+        future = _pool().submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # the slot is freed when the hash is done, not when we give up on it:
+    # a timed-out hash still occupies a worker process
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PW_TIMEOUT)
+    except FutureTimeout:
+        future.cancel()                   # dropped if it never started
+        with _lock: _stats["timeouts"] += 1
+        raise HashBusy(f"password hash took over {PW_TIMEOUT:g}s")
+
+def _b(v) -> bytes:
+    return v if isinstance(v, bytes) else bytes(v) if isinstance(v, bytearray) else v.encode('utf-8')
+
+def hash_pw(plain: str, rounds: int = None) -> bytes:
+    h = _run(_hashpw, plain.encode('utf-8'), rounds or BCRYPT_ROUNDS)
+    with _lock: _stats["hashed"] += 1
+    return h
+
+def check_pw(plain: str, hashed) -> bool:
+    ok = _run(_checkpw, plain.encode('utf-8'), _b(hashed))
+    with _lock: _stats["checked"] += 1
+    return ok
+
+def needs_rehash(hashed) -> bool:
+    # "$2b$12$<salt+hash>": cost is the second field
+    try:    return int(_b(hashed).split(b"$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError): return False
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats, workers=PW_WORKERS, queue=PW_QUEUE, rounds=BCRYPT_ROUNDS)
+
+def shutdown():
+    global _executor
+    with _lock:
+        ex, _executor = _executor, None
+    if ex is not None and _executor_pid == os.getpid():
+        ex.shutdown(wait=False, cancel_futures=True)
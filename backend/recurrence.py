@@ -0,0 +1,155 @@
+# recurrence.py
+# Recurring calendar events. A series is one calendar_events row with an
+# RRULE (subset of RFC 5545: FREQ=DAILY|WEEKLY|MONTHLY, INTERVAL, COUNT or
+# UNTIL) and optional exception dates. Occurrences are never stored: they
+# are computed for the requested window only, starting from the first one
+# that can reach it, and memoised per (series, row_version, window).
+import calendar, os, threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+RRULE_CACHE_SIZE = int(os.environ.get('RRULE_CACHE_SIZE', '4096'))   # windows; 0 disables
+RRULE_MAX = int(os.environ.get('RRULE_MAX', '5000'))   # occurrences of one series per window
+
+FREQS = ("DAILY", "WEEKLY", "MONTHLY")
+Rule = namedtuple("Rule", "freq interval count until")
+
+def parse(text: str) -> Rule:
+    """'FREQ=WEEKLY;INTERVAL=2;COUNT=10' -> Rule. Raises ValueError."""
+    parts = {}
+    for item in (text or "").upper().removeprefix("RRULE:").split(";"):
+        if not item: continue
+        k, sep, v = item.partition("=")
+        if not sep or k in parts: raise ValueError(f"bad rrule part {item!r}")
+        parts[k] = v
+    unknown = parts.keys() - {"FREQ", "INTERVAL", "COUNT", "UNTIL"}
+    if unknown: raise ValueError(f"unsupported rrule parts: {', '.join(sorted(unknown))}")
+    if parts.get("FREQ") not in FREQS: raise ValueError(f"FREQ must be one of {', '.join(FREQS)}")
+    if "COUNT" in parts and "UNTIL" in parts: raise ValueError("COUNT and UNTIL are exclusive")
+    try:
+        interval = int(parts.get("INTERVAL", "1"))
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+    except ValueError:
+        raise ValueError("INTERVAL and COUNT must be numbers")
+    if interval < 1 or (count is not None and count < 1):
+        raise ValueError("INTERVAL and COUNT must be positive")
+    until = None
+    if "UNTIL" in parts:
+        u = parts["UNTIL"].rstrip("Z")
+        try: until = datetime.strptime(u, "%Y%m%dT%H%M%S" if "T" in u else "%Y%m%d")
+        except ValueError: raise ValueError("UNTIL must be YYYYMMDD[THHMMSS]")
+        if "T" not in u: until += timedelta(days=1, microseconds=-1)   # the whole day
+    return Rule(parts["FREQ"], interval, count, until)
+
+def _nth(start: datetime, rule: Rule, k: int):
+    """Start of step k (0 = the series start); None for a month without that day."""
+    if rule.freq != "MONTHLY":
+        return start + timedelta(days=k * rule.interval * (7 if rule.freq == "WEEKLY" else 1))
+    y, m = divmod(start.month - 1 + k * rule.interval, 12)
+    y += start.year
+    if start.day > calendar.monthrange(y, m + 1)[1]: return None
+    return start.replace(year=y, month=m + 1)
+
+def _first_step(start: datetime, rule: Rule, t: datetime) -> int:
+    """A step k with every step before it starting before `t` (k <= exact)."""
+    if t <= start: return 0
+    if rule.freq != "MONTHLY":
+        step = timedelta(days=rule.interval * (7 if rule.freq == "WEEKLY" else 1))
+        return (t - start) // step
+    months = (t.year - start.year) * 12 + t.month - start.month
+    return max(months // rule.interval - 1, 0)
+
+def _index(start: datetime, rule: Rule, k: int) -> int:
+    """How many occurrences come before step k (months without the day are skipped)."""
+    if rule.freq != "MONTHLY" or start.day <= 28: return k
+    return sum(_nth(start, rule, i) is not None for i in range(k))
+
+def span(start: datetime, length: timedelta, all_day: bool):
+    """[begin, end) an occurrence occupies; as calendar_events.span_end."""
+    if not all_day: return start, start + length
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day, (start + length).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+def occurrences(start: datetime, length: timedelta, all_day: bool, rule: Rule,
+                ws: datetime, we: datetime, exdates=()) -> list:
+    """Occurrence starts overlapping [ws, we), as a single event would have to:
+    starts_at < we AND (starts_at >= ws OR span end > ws). Raises ValueError
+    past RRULE_MAX of them."""
+    reach = length + (timedelta(days=1) if all_day else timedelta(0))   # longest span
+    k = _first_step(start, rule, ws - reach)
+    n = _index(start, rule, k) if rule.count else k
+    out, skip = [], set(exdates)
+    while True:
+        s = _nth(start, rule, k)
+        k += 1
+        if s is None: continue
+        if s >= we or (rule.count and n >= rule.count) or (rule.until and s > rule.until): break
+        n += 1
+        if s in skip: continue
+        if s >= ws or span(s, length, all_day)[1] > ws:
+            out.append(s)
+            if len(out) > RRULE_MAX:
+                raise ValueError(f"more than {RRULE_MAX} occurrences of one series; narrow the window")
+    return out
+
+def series_end(start: datetime, length: timedelta, all_day: bool, rule: Rule):
+    """End of the last occurrence's span, None for an endless series.
+    Raises ValueError if the rule yields no occurrence at all."""
+    if rule.count is None and rule.until is None: return None
+    if rule.until is not None and rule.until < start: raise ValueError("UNTIL is before the first occurrence")
+    if rule.freq != "MONTHLY" or start.day <= 28:
+        if rule.count: k = rule.count - 1
+        else: k = _first_step(start, rule, rule.until + timedelta(microseconds=1))
+        while _nth(start, rule, k) > (rule.until or datetime.max): k -= 1
+        last = _nth(start, rule, k)
+    else:
+        k, n, last = 0, 0, start
+        while True:
+            s = _nth(start, rule, k); k += 1
+            if s is None: continue
+            if (rule.count and n >= rule.count) or (rule.until and s > rule.until): break
+            last, n = s, n + 1
+    return span(last, length, all_day)[1]
+
+# ---------- memoised expansions ----------
+class ExpansionCache:
+    """Thread-safe LRU of (series id, row_version, ws, we) -> occurrence
+    starts. row_version moves on every write to the series, so entries
+    never go stale; they just age out."""
+
+    def __init__(self, size=RRULE_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0; self._misses = 0; self._evictions = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return hit
+            self._misses += 1
+        value = tuple(compute())
+        if self.size > 0:
+            with self._lock:
+                self._entries[key] = value
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {"entries": len(self._entries), "size": self.size,
+                    "hits": self._hits, "misses": self._misses,
+                    "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                    "evictions": self._evictions}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+expansions = ExpansionCache()
@@ -0,0 +1,106 @@
+# respcache.py
+# Per-process cache of serialized GET responses, keyed by
+# (user_id, path, normalized query, resource versions). LRU + TTL, bounded
+# by total bytes. Entries are tagged with the data_versions resources they
+# were built from and dropped when a write in this process bumps one of
+# them (app.bump_version); other processes' writes change the key instead.
+import os, threading, time
+from collections import OrderedDict
+
+RESP_CACHE_MB  = float(os.environ.get('RESP_CACHE_MB', '32'))   # 0 disables
+RESP_CACHE_TTL = float(os.environ.get('RESP_CACHE_TTL', '30'))  # seconds
+
+_OVERHEAD = 200     # rough per-entry cost of key, tuple and bookkeeping
+
+class ResponseCache:
+    """Thread-safe LRU of `key -> (body, etag)`, bounded by `max_bytes`."""
+
+    def __init__(self, max_bytes=int(RESP_CACHE_MB * 1024 * 1024), ttl=RESP_CACHE_TTL):
+        self.max_bytes, self.ttl = max_bytes, ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (body, etag, resources, expires, size)
+        self._by_user = {}              # uid -> set(keys)
+        # generations: a user's is the tick of its last invalidation while it has
+        # entries, else _floor (the newest tick forgotten), so _gen stays as
+        # small as _by_user and a generation never comes back once moved on
+        self._gen = {}                  # uid -> generation
+        self._tick = self._floor = 0
+        self._bytes = 0
+        self._hits = 0; self._misses = 0; self._evictions = 0
+        self._expired = 0; self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.ttl > 0
+
+    def generation(self, uid) -> int:
+        """Take before building a response; hand to put() so a write that
+        lands in between keeps the stale result out."""
+        with self._lock:
+            return self._gen.get(uid, self._floor)
+
+    def get(self, key):
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                self._misses += 1
+                return None
+            if e[3] < time.monotonic():
+                self._drop(key)
+                self._expired += 1; self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return e[0], e[1]
+
+    def put(self, key, resources, body: bytes, etag=None, gen=None):
+        uid = key[0]
+        size = len(body) + _OVERHEAD
+        if size > self.max_bytes // 8: return       # one response must not flush the cache
+        with self._lock:
+            if gen is not None and self._gen.get(uid, self._floor) != gen: return
+            if key in self._entries: self._drop(key)
+            self._entries[key] = (body, etag, frozenset(resources),
+                                  time.monotonic() + self.ttl, size)
+            self._by_user.setdefault(uid, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def invalidate(self, uid, resources):
+        resources = set(resources)
+        with self._lock:
+            self._tick += 1
+            if uid in self._by_user: self._gen[uid] = self._tick
+            else: self._floor = self._tick
+            for key in list(self._by_user.get(uid, ())):
+                if self._entries[key][2] & resources:
+                    self._drop(key)
+                    self._invalidations += 1
+
+    def _drop(self, key):
+        e = self._entries.pop(key)
+        self._bytes -= e[4]
+        keys = self._by_user[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_user[key[0]]
+            self._floor = max(self._floor, self._gen.pop(key[0], 0))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries), "bytes": self._bytes,
+                "max_bytes": self.max_bytes, "ttl": self.ttl,
+                "hits": self._hits, "misses": self._misses,
+                "evictions": self._evictions, "expired": self._expired,
+                "invalidations": self._invalidations,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear(); self._by_user.clear(); self._bytes = 0
+            self._gen.clear(); self._floor = self._tick
+
+response_cache = ResponseCache()
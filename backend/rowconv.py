@@ -0,0 +1,60 @@
+# rowconv.py
+# Row -> JSON-ready dict converters, compiled once per query from
+# cursor.description. Only DATETIME/DATE/DECIMAL/binary columns get touched;
+# everything else is copied straight through. Output matches app._coerce.
+from mysql.connector.constants import FieldType, FieldFlag
+
+def _datetime(v):
+    return v.isoformat(' ', 'seconds')        # == strftime('%Y-%m-%d %H:%M:%S')
+
+def _date(v):
+    return v.isoformat()
+
+def _bytes(v):
+    if isinstance(v, (bytes, bytearray)):
+        try:
+            return v.decode('utf-8')
+        except Exception:
+            return str(v)
+    return v
+
+_BY_TYPE = {
+    FieldType.DATETIME: _datetime, FieldType.TIMESTAMP: _datetime,
+    FieldType.DATE: _date, FieldType.NEWDATE: _date,
+    FieldType.DECIMAL: float, FieldType.NEWDECIMAL: float,
+}
+_MAYBE_BYTES = {FieldType.STRING, FieldType.VAR_STRING, FieldType.VARCHAR,
+                FieldType.TINY_BLOB, FieldType.MEDIUM_BLOB, FieldType.LONG_BLOB,
+                FieldType.BLOB, FieldType.GEOMETRY, FieldType.JSON}
+
+def _column_fn(col):
+    type_code = col[1]
+    flags = col[7] if len(col) > 7 else 0
+    if type_code in _BY_TYPE:
+        return _BY_TYPE[type_code]
+    if type_code in _MAYBE_BYTES and (flags or 0) & FieldFlag.BINARY:
+        return _bytes
+    return None
+
+def compile_converter(description):
+    """Build `rows -> [dict]` for tuple rows shaped like `description`."""
+    env, items = {}, []
+    for i, col in enumerate(description):
+        fn = _column_fn(col)
+        if fn is None:
+            items.append(f"{col[0]!r}: r[{i}]")
+        else:
+            env[f"c{i}"] = fn
+            items.append(f"{col[0]!r}: (None if r[{i}] is None else c{i}(r[{i}]))")
+    src = f"def convert(rows):\n    return [{{{', '.join(items)}}} for r in rows]\n"
+    exec(src, env)
+    return env["convert"]
+
+_cache = {}   # sql text -> (description, converter)
+
+def row_converter(sql, description):
+    description = tuple(description)
+    hit = _cache.get(sql)
+    if hit is None or hit[0] != description:
+        hit = _cache[sql] = (description, compile_converter(description))
+    return hit[1]
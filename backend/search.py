@@ -0,0 +1,80 @@
+# search.py
+# Per-user inverted index behind GET /search. search_index holds one row
+# per (user, term, kind, row) with a weight: a word in a title counts 3, in
+# a body 1, summed over the row. A query term matches by prefix through the
+# (user_id, term) primary key, so the cost follows the matching rows, not
+# the size of the user's diary. The write handlers re-index a row in their
+# own transaction (app.search_apply); rebuild() fills it from scratch.
+import re, unicodedata
+
+SOURCES = {     # kind -> (table, {column: weight})
+    "diary": ("diary_entries", {"title": 3, "content": 1}),
+    "task":  ("tasks", {"title": 3}),
+    "event": ("calendar_events", {"title": 3, "note": 1}),
+    "food":  ("food_items", {"name": 3}),
+}
+TERM_MAX = 32           # = search_index.term
+QUERY_TERMS_MAX = 8
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from had has have he her his i if in into is it its
+    me my no not of on or our she so that the their them then there they this to too
+    us was we were what when which who will with you your
+""".split())
+_WORD = re.compile(r"\w+")
+
+INSERT_SQL = "INSERT INTO search_index (user_id, term, kind, row_id, weight) VALUES (%s,%s,%s,%s,%s)"
+
+def terms(text) -> list:
+    """Lower-cased, accent-folded words of 2+ characters, stopwords dropped."""
+    if not text: return []
+    if isinstance(text, (bytes, bytearray)): text = text.decode("utf-8", "replace")
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [w[:TERM_MAX] for w in _WORD.findall(text) if len(w) > 1 and w not in STOPWORDS]
+
+def query_terms(q) -> list:
+    """Distinct terms of a query, in order, at most QUERY_TERMS_MAX."""
+    return list(dict.fromkeys(terms(q)))[:QUERY_TERMS_MAX]
+
+def like_prefix(term: str) -> str:
+    """LIKE pattern for words starting with `term` (its % and _ escaped)."""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def index_rows(uid: int, kind: str, row_id: int, fields: dict) -> list:
+    """search_index rows for one source row; `fields` is {column: text}."""
+    weights = {}
+    for col, w in SOURCES[kind][1].items():
+        for t in terms(fields.get(col)):
+            weights[t] = weights.get(t, 0) + w
+    return [(uid, t, kind, row_id, min(w, 65535)) for t, w in weights.items()]
+
+def snippet(text, qterms, width=160) -> str:
+    """About `width` characters of `text` around the first query term."""
+    if not text: return ""
+    if isinstance(text, (bytes, bytearray)): text = text.decode("utf-8", "replace")
+    low = text.lower()
+    hits = [i for i in (low.find(t) for t in qterms) if i >= 0]
+    start = max(min(hits) - width // 4, 0) if hits else 0
+    out = text[start:start + width].strip()
+    return ("..." if start else "") + out + ("..." if start + width < len(text) else "")
+
+def source_rows(cur, uid=None) -> list:
+    """What search_index should hold for everyone (or one user), read
+    from the source tables."""
+    where, params = ("WHERE user_id=%s", (uid,)) if uid else ("", ())
+    out = []
+    for kind, (table, weights) in SOURCES.items():
+        cur.execute(f"SELECT user_id, id, {', '.join(weights)} FROM {table} {where}", params)
+        for r in cur.fetchall():
+            out += index_rows(r[0], kind, r[1], dict(zip(weights, r[2:])))
+    return out
+
+def rebuild(cn, uid=None, batch=1000) -> int:
+    """Re-index everything (or one user) on `cn`; the caller commits."""
+    cur = cn.cursor()
+    cur.execute("DELETE FROM search_index" + (" WHERE user_id=%s" if uid else ""), (uid,) if uid else ())
+    rows = source_rows(cur, uid)
+    for i in range(0, len(rows), batch):
+        cur.executemany(INSERT_SQL, rows[i:i + batch])
+    cur.close()
+    return len(rows)
@@ -0,0 +1,224 @@
+# serve.py
+# Production launcher: a master process forks N workers that share one
+# listening socket (or each bind their own with SO_REUSEPORT), every worker
+# serving requests from a fixed pool of threads.
+#
+#   python serve.py --workers 4 --threads 8 --port 5000
+#
+# Signals to the master:
+#   TERM / INT   drain: workers stop accepting, finish in-flight requests, exit
+#   HUP          rolling restart: fresh workers up, old ones drained
+# Routes and modules are imported once in the master (then gc.freeze()), so
+# forked workers share those pages copy-on-write; each worker builds its own
+# Flask app with create_app() and opens its own DB / bcrypt pools on first use.
+import argparse, gc, os, random, shutil, signal, socket, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+def _listen(host, port, reuse_port=False, backlog=1024) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+# ---------- worker ----------
+class _Handler(WSGIRequestHandler):
+    # no keep-alive: an idle client must not pin one of the pool's threads
+    protocol_version = "HTTP/1.0"
+
+    def log_request(self, *args):
+        pass                     # the app writes its own access record
+
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug server handing each connection to a fixed-size thread pool."""
+    multithread = True
+
+    def __init__(self, app, sock, threads, max_requests=0):
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+        self._slots = threading.BoundedSemaphore(threads)
+        self._served = 0
+        self._max_requests = max_requests
+        self._lock = threading.Lock()
+        host, port = sock.getsockname()[:2]
+        super().__init__(host, port, app, handler=_Handler, fd=sock.fileno())
+
+    def process_request(self, request, client_address):
+        # accept only when a thread is free; the rest wait in the kernel backlog
+        self._slots.acquire()
+        self._executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+            with self._lock:
+                self._served += 1
+                recycle = self._max_requests and self._served == self._max_requests
+            if recycle:
+                self.drain()
+
+    def drain(self):
+        # shutdown() blocks until serve_forever() returns: never call it on that thread
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def close(self):
+        self._executor.shutdown(wait=True)      # let in-flight requests finish
+        self.server_close()
+
+def run_worker(sock, opts):
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+    # the master owns reloads; a terminal hangup must not kill workers undrained
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    gc.enable()
+    if opts.reuse_port:
+        sock = _listen(opts.host, opts.port, reuse_port=True, backlog=opts.backlog)
+
+    from app import create_app
+    import accesslog, db_config, metrics, pwhash
+    app = create_app()
+    gc.freeze()        # app/route objects built here never change either
+
+    # jitter so workers started together don't all recycle together
+    max_requests = opts.max_requests
+    if max_requests and opts.max_requests_jitter:
+        max_requests += random.randint(0, opts.max_requests_jitter)
+    server = PooledWSGIServer(app, sock, opts.threads, max_requests)
+    signal.signal(signal.SIGTERM, lambda *_: server.drain())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)      # the master owns Ctrl-C
+    app.logger.info("worker %d serving on %s:%d (%d threads)",
+                    os.getpid(), opts.host, opts.port, opts.threads)
+    try:
+        server.serve_forever()
+    finally:
+        server.close()
+        db_config.get_pool().dispose()
+        pwhash.shutdown()
+        metrics.registry.flush()       # final totals, kept after this pid is gone
+        accesslog.stop_logging()
+    os._exit(0)
+
+# ---------- master ----------
+class Master:
+    def __init__(self, opts):
+        self.opts = opts
+        self.sock = None if opts.reuse_port else _listen(opts.host, opts.port, backlog=opts.backlog)
+        self.workers = {}          # pid -> started_at
+        self.draining = set()      # pids sent SIGTERM: not respawned when they exit
+        self.stopping = False
+        self.reload = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.sock, self.opts)
+            finally:
+                os._exit(1)
+        self.workers[pid] = time.monotonic()
+
+    def send(self, sig, pids):
+        for pid in pids:
+            try: os.kill(pid, sig)
+            except ProcessLookupError: pass
+
+    def reap(self, block=False):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear(); return
+            if pid == 0: return
+            started = self.workers.pop(pid, None)
+            if started is None: continue
+            if pid in self.draining or self.stopping:
+                self.draining.discard(pid)
+                continue
+            # died or recycled itself (--max-requests): replace it
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0:
+                print(f"[serve] worker {pid} exited with {code}", file=sys.stderr)
+                if time.monotonic() - started < 1:
+                    time.sleep(1)              # crashing at boot: don't fork-bomb
+            self.spawn()
+
+    def drain(self, pids):
+        self.draining.update(pids)
+        self.send(signal.SIGTERM, pids)
+        deadline = time.monotonic() + self.opts.graceful_timeout
+        while self.draining & self.workers.keys() and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        stuck = self.draining & self.workers.keys()
+        self.send(signal.SIGKILL, stuck)
+        while self.draining & self.workers.keys():
+            self.reap(block=True)
+
+    def run(self):
+        def on_stop(*_): self.stopping = True
+        def on_hup(*_): self.reload = True
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        signal.signal(signal.SIGHUP, on_hup)
+
+        # workers publish metrics snapshots here so /__metrics covers all of them
+        # (RAM-backed when /dev/shm exists); metrics reads it at import
+        own_metrics_dir = not os.environ.get("METRICS_DIR")
+        if own_metrics_dir:
+            os.environ["METRICS_DIR"] = tempfile.mkdtemp(
+                prefix="metrics-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+        # import the routes once here so workers inherit them copy-on-write; with
+        # gc off and everything frozen, their GC never writes to those pages.
+        # Importing builds no app and starts no threads: a thread running at
+        # fork() time (the log listener) can leave a worker holding its locks
+        gc.disable()
+        import app  # noqa: F401
+        gc.freeze()
+
+        for _ in range(self.opts.workers): self.spawn()
+        print(f"[serve] master {os.getpid()}: {self.opts.workers} workers x "
+              f"{self.opts.threads} threads on {self.opts.host}:{self.opts.port}"
+              f"{' (SO_REUSEPORT)' if self.opts.reuse_port else ''}", file=sys.stderr)
+
+        while not self.stopping:
+            if self.reload:
+                self.reload = False
+                old = list(self.workers)
+                for _ in range(self.opts.workers): self.spawn()
+                self.drain(old)
+            self.reap()
+            time.sleep(0.2)
+
+        self.drain(list(self.workers))
+        if self.sock is not None: self.sock.close()
+        if own_metrics_dir:
+            shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    ap.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5000")))
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", os.cpu_count() or 2)))
+    ap.add_argument("--threads", type=int, default=int(os.environ.get("WEB_THREADS", "8")),
+                    help="request threads per worker (keep <= DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW)")
+    ap.add_argument("--max-requests", type=int, default=int(os.environ.get("WEB_MAX_REQUESTS", "0")),
+                    help="recycle a worker after this many requests (0 = never)")
+    ap.add_argument("--max-requests-jitter", type=int, default=int(os.environ.get("WEB_MAX_REQUESTS_JITTER", "0")))
+    ap.add_argument("--graceful-timeout", type=float, default=float(os.environ.get("WEB_GRACEFUL_TIMEOUT", "30")),
+                    help="seconds a draining worker gets before SIGKILL")
+    ap.add_argument("--reuse-port", action="store_true",
+                    help="each worker binds its own SO_REUSEPORT socket (Linux load-balances accepts)")
+    ap.add_argument("--backlog", type=int, default=1024)
+    Master(ap.parse_args()).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# conftest.py
+# The tests run the Flask app against an in-memory stand-in for MySQL: a
+# FakeDB answers each statement through a handler the test supplies, behind
+# a real db_config.ConnectionPool, so pooling, transactions and teardown
+# are exercised as in production.
+#
+#   cd backend && python -m pytest -q tests
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ACCESS_LOG_SAMPLE", "0")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import pytest
+from mysql.connector import errors
+
+import db_config
+
+class FakeCursor:
+    def __init__(self, db, conn, dictionary=False):
+        self.db, self.conn, self.dictionary = db, conn, dictionary
+        self.description, self.rowcount, self.lastrowid = None, 0, None
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        if self._rows: raise errors.InternalError(msg="Unread result found")
+        sql = " ".join(sql.split())
+        self.db.log.append((sql, tuple(params or ())))
+        if not sql.upper().startswith(("SELECT", "WITH", "SHOW")):
+            self.conn.in_transaction = True
+        res = self.db.handler(sql, tuple(params or ())) or {}
+        cols = res.get("cols")
+        self.description = [(c, 253, None, None, None, None, 1, 0, 45) for c in cols] if cols else None
+        self._rows = [dict(zip(cols, r)) if self.dictionary else tuple(r) for r in res.get("rows", ())]
+        self.rowcount = res.get("rowcount", len(self._rows) if cols else 1)
+        self.lastrowid = res.get("lastrowid", self.db.next_id())
+
+    def executemany(self, sql, seq):
+        for params in seq: self.execute(sql, params)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=1):
+        out, self._rows = self._rows[:size], self._rows[size:]
+        return out
+
+    def fetchall(self):
+        out, self._rows = self._rows, []
+        return out
+
+    def close(self):
+        # like an unbuffered mysql.connector cursor
+        if self._rows: raise errors.InternalError(msg="Unread result found")
+
+    @property
+    def conn_unread(self): return bool(self._rows)
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db, self.in_transaction, self.closed = db, False, False
+        self._cursors = []
+
+    @property
+    def unread_result(self): return any(c.conn_unread for c in self._cursors)
+
+    def cursor(self, dictionary=False, **kw):
+        cur = FakeCursor(self.db, self, dictionary)
+        self._cursors.append(cur)
+        return cur
+
+    def commit(self):
+        self.db.log.append(("COMMIT", ())); self.in_transaction = False
+
+    def rollback(self):
+        self.db.log.append(("ROLLBACK", ())); self.in_transaction = False
+
+    def ping(self, reconnect=False): pass
+    def close(self): self.closed = True
+
+class FakeDB:
+    def __init__(self):
+        self.log = []
+        self.handler = lambda sql, params: None
+        self._id = 100
+
+    def next_id(self):
+        self._id += 1
+        return self._id
+
+    def connect(self):
+        return FakeConnection(self)
+
+    def statements(self):
+        return [sql for sql, _ in self.log]
+
+@pytest.fixture
+def fakedb():
+    db = FakeDB()
+    pool = db_config.ConnectionPool(size=2, max_overflow=0, timeout=0.2, pre_ping=False,
+                                    connect=db.connect)
+    db.pool = pool
+    db_config.set_pool(pool)
+    from respcache import response_cache
+    from app import token_cache
+    response_cache.clear(); token_cache.clear()
+    yield db
+    db_config.set_pool(db_config.ConnectionPool())
+
+@pytest.fixture
+def client(fakedb):
+    import app
+    return app.app.test_client()
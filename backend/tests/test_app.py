@@ -0,0 +1,18 @@
+# create_app: per-app auth secret; importing the module has no side effects
+import os, subprocess, sys
+import app
+
+def test_custom_secret(monkeypatch, fakedb):
+    monkeypatch.setattr(app, "_signer", app._signer)     # restored for the other tests
+    default = app._make_token(5)
+    app.create_app({"AUTH_SECRET": "another-secret"})
+    assert app.uid_from_auth_header("Bearer " + app._make_token(5)) == 5
+    assert app.uid_from_auth_header("Bearer " + default) is None
+
+def test_import_starts_no_threads():
+    # serve.py's master imports the routes, then forks
+    code = "import threading, app; print(threading.active_count(), 'app' in vars(app))"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True,
+                         text=True, check=True, cwd=os.path.dirname(app.__file__)).stdout
+    assert out.split() == ["1", "False"]
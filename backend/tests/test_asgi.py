@@ -0,0 +1,39 @@
+# asgi: streamed list requests are handed to the Flask view
+import asyncio, json
+import asgi
+
+def _get(path, qs=b"", headers=()):
+    out = []
+    async def receive(): return {"type": "http.request", "body": b"", "more_body": False}
+    async def send(m): out.append(m)
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": qs,
+             "headers": list(headers), "http_version": "1.1", "scheme": "http",
+             "server": ("test", 80), "client": ("test", 1), "root_path": ""}
+    asyncio.run(asgi.application(scope, receive, send))
+    hdrs = dict(out[0]["headers"])
+    return out[0]["status"], hdrs, b"".join(m.get("body", b"") for m in out[1:])
+
+def _tasks(fakedb):
+    fakedb.handler = lambda sql, params: (
+        {"cols": ("id", "title"), "rows": [(1, "a"), (2, "b")]} if "FROM task" in sql else None)
+
+def test_tasks_ndjson(fakedb):
+    _tasks(fakedb)
+    status, hdrs, body = _get("/tasks", b"userId=1&format=ndjson")
+    assert status == 200 and hdrs[b"content-type"].startswith(b"application/x-ndjson")
+    assert [json.loads(l) for l in body.splitlines()] == [{"id": 1, "title": "a"}, {"id": 2, "title": "b"}]
+
+def test_tasks_stream(fakedb):
+    _tasks(fakedb)
+    status, hdrs, body = _get("/tasks", b"userId=1&stream=1")
+    assert status == 200 and hdrs[b"content-type"].startswith(b"application/json")
+    assert json.loads(body) == [{"id": 1, "title": "a"}, {"id": 2, "title": "b"}]
+    assert fakedb.pool.stats()["in_use"] == 0
+
+def test_error_text_stays_in_the_log(fakedb, monkeypatch):
+    async def boom(uid, args):
+        raise RuntimeError("Table 'mobile.secret' doesn't exist")
+    monkeypatch.setitem(asgi.ROUTES, "/diary", boom)
+    monkeypatch.setattr(asgi, "_flask_view", lambda path: None)
+    status, _, body = _get("/diary", b"userId=1")
+    assert status == 500 and json.loads(body) == {"error": "internal error"}
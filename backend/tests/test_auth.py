@@ -0,0 +1,92 @@
+# signup / login: duplicate emails and concurrent hashing
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+import pytest
+import pwhash
+
+@pytest.fixture
+def hashing(monkeypatch):
+    # hashing runs on threads here; each hash records how many overlap
+    ex = ThreadPoolExecutor(max_workers=4)
+    state = {"calls": 0, "running": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def timed(fn):
+        def run(*args):
+            with lock:
+                state["calls"] += 1; state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            try:
+                time.sleep(0.03)
+                return fn(*args)
+            finally:
+                with lock: state["running"] -= 1
+        return run
+
+    monkeypatch.setattr(pwhash, "_pool", lambda: ex)
+    monkeypatch.setattr(pwhash, "_slots", threading.BoundedSemaphore(8))
+    monkeypatch.setattr(pwhash, "_hashpw", timed(pwhash._hashpw))
+    monkeypatch.setattr(pwhash, "_checkpw", timed(pwhash._checkpw))
+    yield state
+    ex.shutdown(wait=True)
+
+@pytest.fixture
+def users(fakedb):
+    # profile keyed by email, ids from AUTO_INCREMENT
+    rows, lock = {}, threading.Lock()
+
+    def handler(sql, params):
+        with lock:
+            if sql.startswith("SELECT 1 FROM profile WHERE email"):
+                return {"cols": ("1",), "rows": [(1,)] if params[0] in rows else []}
+            if sql.startswith("SELECT id, password_hash FROM profile WHERE email"):
+                u = rows.get(params[0])
+                return {"cols": ("id", "password_hash"), "rows": [u] if u else []}
+            if sql.startswith("INSERT INTO profile"):
+                uid = 100 + len(rows) + 1
+                rows[params[1]] = (uid, params[2])
+                return {"lastrowid": uid}
+    fakedb.handler = handler
+    return rows
+
+def _post(app_client, path, body):
+    r = app_client.post(path, json=body)
+    return r.status_code, r.get_json()
+
+def test_duplicate_email_skips_hash(hashing, users, client):
+    users["taken@example.com"] = (7, b"x")
+    status, body = _post(client, "/auth/signup", {"email": "Taken@example.com", "password": "pw"})
+    assert status == 409 and body["error"] == "email already in use"
+    assert hashing["calls"] == 0
+
+def test_signup_and_login_run_concurrently(hashing, users):
+    import app
+    pw = bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=4))
+    for i in range(4): users[f"old{i}@example.com"] = (1 + i, pw)
+
+    jobs = [("/auth/signup", {"email": f"new{i}@example.com", "password": "pw"}) for i in range(4)]
+    jobs += [("/auth/login", {"email": f"old{i}@example.com", "password": "secret"}) for i in range(4)]
+    with ThreadPoolExecutor(max_workers=len(jobs)) as ex:
+        results = list(ex.map(lambda j: _post(app.app.test_client(), *j), jobs))
+
+    assert [s for s, _ in results] == [201] * 4 + [200] * 4
+    ids = [b["user_id"] for _, b in results]
+    assert len(set(ids)) == len(ids)
+    assert hashing["peak"] > 1
+
+def test_login_hashes_without_a_connection(hashing, users, fakedb, monkeypatch):
+    import app
+    old = bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=5))     # BCRYPT_ROUNDS is 4: rehashed
+    users["old@example.com"] = (3, old)
+    held = []
+    for name in ("_checkpw", "_hashpw"):
+        fn = getattr(pwhash, name)
+        def run(*args, fn=fn):
+            held.append(fakedb.pool.stats()["in_use"])
+            return fn(*args)
+        monkeypatch.setattr(pwhash, name, run)
+    status, _ = _post(app.app.test_client(), "/auth/login",
+                      {"email": "old@example.com", "password": "secret"})
+    assert status == 200 and held == [0, 0]
+    assert any(s.startswith("UPDATE profile SET password_hash") for s in fakedb.statements())
@@ -0,0 +1,53 @@
+# POST /batch
+from mysql.connector import errors
+
+def test_failed_sub_request_is_rolled_back(client, fakedb):
+    def handler(sql, params):
+        if sql.startswith("UPDATE nutrient_history"):
+            raise errors.DatabaseError(msg="Deadlock found when trying to get lock; secret detail")
+    fakedb.handler = handler
+    r = client.post("/batch?userId=1", json={"requests": [
+        {"method": "PUT", "path": "/nutrients/history/5", "body": {"veg_g": 3}},
+        {"method": "PUT", "path": "/goal", "body": {"progress": 0.5}},
+    ]})
+    assert r.status_code == 200
+    failed, goal = r.get_json()
+    assert failed == {"status": 500, "body": {"error": "internal error"}}
+    assert goal["status"] == 200
+
+    log = fakedb.statements()
+    broke = next(i for i, s in enumerate(log) if s.startswith("UPDATE nutrient_history"))
+    goal_write = next(i for i, s in enumerate(log) if s.startswith("INSERT INTO goals"))
+    # the nutrient_daily decrement and version bumps before the failure are
+    # rolled back before PUT /goal runs, so its COMMIT cannot publish them
+    assert "ROLLBACK" in log[broke:goal_write]
+    assert "COMMIT" not in log[:goal_write]
+    assert fakedb.pool.stats()["in_use"] == 0
+
+def test_sub_requests_after_success_share_one_connection(client, fakedb):
+    r = client.post("/batch?userId=1", json={"requests": [
+        {"method": "PUT", "path": "/goal", "body": {"progress": 0.1}},
+        {"method": "PUT", "path": "/goal", "body": {"progress": 0.2}},
+    ]})
+    assert [x["status"] for x in r.get_json()] == [200, 200]
+    assert fakedb.statements().count("COMMIT") == 2
+    assert fakedb.pool.stats()["created"] == 1
+
+def test_parallel_gets_do_not_wait_on_the_batch_connection(client, fakedb):
+    import threading, time
+    started = threading.Barrier(2, timeout=1)
+    def handler(sql, params):
+        if "FROM goals" in sql:
+            started.wait()                   # both GETs hold a connection at once
+            time.sleep(0.01)
+    fakedb.handler = handler
+    r = client.post("/batch?userId=1", json={"requests": [
+        {"method": "PUT", "path": "/goal", "body": {"progress": 0.1}},
+        {"method": "GET", "path": "/goal"},
+        {"method": "GET", "path": "/goal"},
+        {"method": "PUT", "path": "/goal", "body": {"progress": 0.2}},
+    ]})
+    assert [x["status"] for x in r.get_json()] == [200] * 4
+    assert fakedb.pool.stats()["in_use"] == 0
+    # the workers' statements are counted in the batch's totals
+    assert f'"{len(fakedb.log) - 2} queries"' in r.headers["Server-Timing"]
@@ -0,0 +1,14 @@
+# POST /calendar/events validation
+def test_exdates_need_an_rrule(client, fakedb):
+    r = client.post("/calendar/events?userId=1", json={
+        "title": "Standup", "starts_at": "2026-03-02 09:00", "exdates": ["2026-03-09 09:00"]})
+    assert r.status_code == 422 and r.get_json() == {"error": "exdates need an rrule"}
+    assert not any(s.startswith("INSERT") for s in fakedb.statements())
+
+def test_exdates_of_a_series(client, fakedb):
+    r = client.post("/calendar/events?userId=1", json={
+        "title": "Standup", "starts_at": "2026-03-02 09:00", "rrule": "FREQ=WEEKLY;COUNT=4",
+        "exdates": ["2026-03-09 09:00"]})
+    assert r.status_code == 201
+    params = next(p for s, p in fakedb.log if s.startswith("INSERT INTO calendar_events"))
+    assert params[7:9] == ("FREQ=WEEKLY;COUNT=4", "2026-03-09 09:00:00")
@@ -0,0 +1,11 @@
+# GET /foods?q=
+def test_q_matches_word_prefixes_through_the_index(client, fakedb):
+    client.get("/foods?userId=1&q=Green%20App")
+    sql, params = next((s, p) for s, p in fakedb.log if "FROM food_items" in s)
+    assert "LIKE '%" not in sql and sql.count("FROM search_index") == 2
+    assert params == (1, 1, "green%", 1, "app%")
+
+def test_single_letter_is_a_name_prefix(client, fakedb):
+    client.get("/foods?userId=1&q=a")
+    sql, params = next((s, p) for s, p in fakedb.log if "FROM food_items" in s)
+    assert "name LIKE %s" in sql and params == (1, "a%")
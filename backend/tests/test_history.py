@@ -0,0 +1,12 @@
+# GET /nutrients/history?limit=
+import pytest
+
+@pytest.mark.parametrize("query", ["limit=abc", "limit=abc&cursor="])
+def test_bad_limit_is_422(client, fakedb, query):
+    r = client.get(f"/nutrients/history?userId=1&{query}")
+    assert r.status_code == 422 and r.get_json() == {"error": "limit must be a number"}
+
+def test_limit_without_cursor(client, fakedb):
+    client.get("/nutrients/history?userId=1&limit=5")
+    sql, params = next((s, p) for s, p in fakedb.log if "FROM nutrient_history" in s)
+    assert sql.endswith("LIMIT %s") and params == (1, 5)
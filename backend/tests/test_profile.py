@@ -0,0 +1,34 @@
+# PUT /profile
+from mysql.connector import errors
+
+def _profiles(fakedb, existing=()):
+    """profile rows with data_versions' foreign key to them enforced."""
+    ids = set(existing)
+    def handler(sql, params):
+        if sql.startswith("UPDATE profile"):
+            return {"rowcount": 0}             # new row, or an existing one left unchanged
+        if sql.startswith("SELECT 1 FROM profile"):
+            return {"cols": ("1",), "rows": [(1,)] if params[0] in ids else []}
+        if sql.startswith("INSERT INTO profile"):
+            if params[0] in ids: raise errors.IntegrityError(msg="Duplicate entry", errno=1062)
+            ids.add(params[0])
+        if sql.startswith("INSERT INTO data_versions") and params[0] not in ids:
+            raise errors.IntegrityError(msg="Cannot add or update a child row", errno=1452)
+    fakedb.handler = handler
+    return ids
+
+def test_first_profile_is_created(client, fakedb):
+    ids = _profiles(fakedb)
+    r = client.put("/profile?userId=42", json={"display_name": "New", "timezone": "Europe/Paris"})
+    assert r.status_code == 200, r.get_json()
+    assert 42 in ids
+    log = fakedb.statements()
+    assert log.index(next(s for s in log if s.startswith("INSERT INTO profile"))) < \
+        log.index(next(s for s in log if s.startswith("INSERT INTO data_versions")))
+    assert log[-1] == "COMMIT"
+
+def test_unchanged_profile_is_not_inserted_again(client, fakedb):
+    _profiles(fakedb, existing={7})
+    r = client.put("/profile?userId=7", json={"bio": "same as before"})
+    assert r.status_code == 200, r.get_json()
+    assert not any(s.startswith("INSERT INTO profile") for s in fakedb.statements())
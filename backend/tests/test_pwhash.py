@@ -0,0 +1,40 @@
+# pwhash admission control
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import pwhash
+
+@pytest.fixture
+def pool(monkeypatch):
+    ex = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(pwhash, "_pool", lambda: ex)
+    monkeypatch.setattr(pwhash, "_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(pwhash, "PW_TIMEOUT", 0.05)
+    yield ex
+    ex.shutdown(wait=True)
+
+def test_timeout_is_hash_busy(pool):
+    release = threading.Event()
+    with pytest.raises(pwhash.HashBusy):
+        pwhash._run(release.wait, 5)
+    # the hash is still running: its slot stays taken
+    with pytest.raises(pwhash.HashBusy):
+        pwhash._run(lambda: 1)
+    release.set()
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline:
+        try: assert pwhash._run(lambda: 1) == 1; break
+        except pwhash.HashBusy: time.sleep(0.01)
+    else:
+        pytest.fail("slot was never released")
+
+def test_timeout_answers_503(pool, client, fakedb):
+    fakedb.handler = lambda sql, params: {"cols": ("id", "password_hash"),
+                                          "rows": [(1, b"$2b$04$" + b"x" * 53)]}
+    release = threading.Event()
+    pool.submit(release.wait, 5)          # the only hashing worker is busy
+    try:
+        r = client.post("/auth/login", json={"email": "a@example.com", "password": "pw"})
+    finally:
+        release.set()
+    assert r.status_code == 503 and r.headers["Retry-After"] == "2"
@@ -0,0 +1,47 @@
+# Response cache (@cached) across processes
+from respcache import response_cache
+
+def _goal(fakedb, state):
+    def handler(sql, params):
+        if "FROM data_versions" in sql:
+            return {"cols": ("resource", "version"), "rows": [("goal", state["version"])]}
+        if "FROM goals" in sql:
+            return {"cols": ("user_id", "progress"), "rows": [(1, state["progress"])]}
+    fakedb.handler = handler
+
+def test_hit_skips_the_view(client, fakedb):
+    _goal(fakedb, {"version": 3, "progress": 0.25})
+    assert client.get("/goal?userId=1").get_json()["progress"] == 0.25
+    fakedb.log.clear()
+    assert client.get("/goal?userId=1").get_json()["progress"] == 0.25
+    assert not any("FROM goals" in s for s in fakedb.statements())
+
+def test_write_in_another_worker_is_seen_at_once(client, fakedb):
+    state = {"version": 3, "progress": 0.25}
+    _goal(fakedb, state)
+    invalidations = response_cache.stats()["invalidations"]
+    assert client.get("/goal?userId=1").get_json()["progress"] == 0.25
+    # another serve.py worker commits PUT /goal: this process's cache is not
+    # invalidated, only data_versions moves on
+    state.update(version=4, progress=0.75)
+    r = client.get("/goal?userId=1")
+    assert r.get_json()["progress"] == 0.75
+    assert response_cache.stats()["invalidations"] == invalidations
+
+def test_generations_do_not_pile_up():
+    from respcache import ResponseCache
+    c = ResponseCache(max_bytes=1 << 20, ttl=60)
+    c.put((1, "/goal"), ["goal"], b"a")
+    for uid in range(1, 1000):
+        c.invalidate(uid, ["goal"])
+    assert c.stats()["entries"] == 0 and not c._gen
+
+def test_write_during_build_keeps_result_out():
+    from respcache import ResponseCache
+    c = ResponseCache(max_bytes=1 << 20, ttl=60)
+    for cached in (False, True):
+        if cached: c.put((1, "/goal"), ["goal"], b"a")
+        gen = c.generation(1)
+        c.invalidate(1, ["goal"])                # lands while the response is built
+        c.put((1, "/goal", "x"), ["goal"], b"stale", gen=gen)
+        assert c.get((1, "/goal", "x")) is None
@@ -0,0 +1,37 @@
+# Streamed list responses (?stream=1 / ?format=ndjson)
+import metrics
+
+TASK_COLS = ("id", "user_id", "title", "urgency", "due_date", "done", "created_at")
+
+def _tasks(n):
+    def handler(sql, params):
+        if "FROM tasks" in sql:
+            return {"cols": TASK_COLS, "rows": [(i, 1, f"t{i}", 1, None, 0, None) for i in range(n)]}
+        if "FROM data_versions" in sql:
+            return {"cols": ("resource", "version"), "rows": []}
+    return handler
+
+def _in_flight():
+    return metrics.registry._gauges.get(("http_requests_in_flight", ()), 0.0)
+
+def test_stream_complete(client, fakedb):
+    fakedb.handler = _tasks(1200)
+    r = client.get("/tasks?userId=1&stream=1")
+    assert r.status_code == 200
+    assert len(r.get_json()) == 1200
+    r.close()
+    assert fakedb.pool.stats()["in_use"] == 0
+
+def test_client_drops_stream(client, fakedb):
+    fakedb.handler = _tasks(5000)
+    before = _in_flight()
+    for _ in range(fakedb.pool.size + 1):
+        r = client.get("/tasks?userId=1&format=ndjson", buffered=False)
+        assert next(r.response)          # first batch only, then hang up
+        r.close()
+    stats = fakedb.pool.stats()
+    assert stats["in_use"] == 0 and stats["timeouts"] == 0
+    assert _in_flight() == before
+    # the pool still serves: no slot was leaked
+    fakedb.handler = _tasks(3)
+    assert client.get("/tasks?userId=1").status_code == 200
@@ -0,0 +1,73 @@
+# tokencache.py
+# Bounded LRU of verified bearer tokens -> (uid, expires_at). A device sends
+# the same token thousands of times a day; after the first request it costs
+# a dict lookup instead of base64 + HMAC + timestamp check + JSON parse.
+import os, threading, time
+from collections import OrderedDict
+
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))  # 0 disables
+
+class TokenCache:
+    """`verify(token) -> (uid, expires_at) | None` does the real check.
+    `revoked(uid, token) -> bool`, if set, can veto a token before it is
+    cached; call revoke() to drop cached entries so they get re-checked."""
+
+    def __init__(self, verify, size=TOKEN_CACHE_SIZE, revoked=None):
+        self.size, self.revoked = size, revoked
+        self._verify = verify
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # token -> (uid, expires_at)
+        self._hits = 0; self._misses = 0; self._expired = 0
+        self._rejected = 0; self._evictions = 0
+
+    def uid(self, token: str):
+        now = time.time()
+        with self._lock:
+            e = self._entries.get(token)
+            if e is not None:
+                if now <= e[1]:
+                    self._entries.move_to_end(token)
+                    self._hits += 1
+                    return e[0]
+                del self._entries[token]
+                self._expired += 1
+            self._misses += 1
+
+        res = self._verify(token)
+        if res is not None and self.revoked is not None and self.revoked(res[0], token):
+            res = None
+        if res is None:
+            with self._lock: self._rejected += 1
+            return None
+        uid, expires_at = res
+        if self.size > 0:
+            with self._lock:
+                self._entries[token] = (uid, expires_at)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return uid
+
+    def revoke(self, token=None, uid=None):
+        """Forget one token, or every cached token of `uid`."""
+        with self._lock:
+            if token is not None:
+                self._entries.pop(token, None)
+            if uid is not None:
+                for t in [t for t, e in self._entries.items() if e[0] == uid]:
+                    del self._entries[t]
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries), "size": self.size,
+                "hits": self._hits, "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "expired": self._expired, "rejected": self._rejected,
+                "evictions": self._evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -89,9 +89,29 @@ dynamic _decode(http.Response r, String label) {
 /* =========================
    HTTP helpers
    ========================= */
+/// Last ETag + raw body per GET url; the backend answers 304 when unchanged.
+final Map<String, MapEntry<String, String>> _etagCache = {};
+const int _etagCacheMax = 64;
+
 Future<dynamic> apiGet(String path, [Map<String, String>? q]) async {
-  final r = await http.get(apiUri(path, q), headers: _headersJson()).timeout(_timeout);
-  return _decode(r, 'GET $path');
+  final uri = apiUri(path, q);
+  final key = uri.toString();
+  final headers = _headersJson();
+  final cached = _etagCache[key];
+  if (cached != null) headers['If-None-Match'] = cached.key;
+
+  final r = await http.get(uri, headers: headers).timeout(_timeout);
+  if (r.statusCode == 304 && cached != null) {
+    return cached.value.isEmpty ? {} : jsonDecode(cached.value);
+  }
+  final body = _decode(r, 'GET $path');
+  final etag = r.headers['etag'];
+  if (etag != null) {
+    _etagCache.remove(key);
+    if (_etagCache.length >= _etagCacheMax) _etagCache.remove(_etagCache.keys.first);
+    _etagCache[key] = MapEntry(etag, r.body);
+  }
+  return body;
 }
 
 Future<dynamic> apiPost(String path, Map body, [Map<String, String>? q]) async {
@@ -14,7 +14,7 @@ class _CalendarPageState extends State<CalendarPage> {
   DateTime _focused = DateTime.now();
   DateTime? _selected;
 
-  /// key = 'YYYY-MM-DD', value = list of tasks due that day
+  /// key = 'YYYY-MM-DD', value = open tasks due and events on that day
   Map<String, List<Map<String, dynamic>>> _eventsByDate = {};
   bool _loading = false;
 
@@ -26,11 +26,11 @@ class _CalendarPageState extends State<CalendarPage> {
     _selected = DateTime(_focused.year, _focused.month, _focused.day);
 
     _taskListener = () {
-      _rebuildFromTasks();
+      _loadMonth();
     };
     TaskSync.version.addListener(_taskListener);
 
-    _rebuildFromTasks();
+    _loadMonth();
   }
 
   @override
@@ -51,18 +51,6 @@ class _CalendarPageState extends State<CalendarPage> {
     return false;
   }
 
-  DateTime? _parseDue(dynamic v) {
-    if (v == null) return null;
-    final s = v.toString().trim();
-    if (s.isEmpty) return null;
-    try {
-      final d = DateTime.parse(s);
-      return DateTime(d.year, d.month, d.day);
-    } catch (_) {
-      return null;
-    }
-  }
-
   String _fmtDate(DateTime d) =>
       '${d.year.toString().padLeft(4, "0")}-'
       '${d.month.toString().padLeft(2, "0")}-'
@@ -86,27 +74,38 @@ class _CalendarPageState extends State<CalendarPage> {
     }
   }
 
-  // ==== build from TaskSync.tasks ==========================================
+  // ==== load the focused month from /agenda ================================
 
-  void _rebuildFromTasks() {
+  Future<void> _loadMonth() async {
     setState(() => _loading = true);
-
-    final list = TaskSync.tasks;
-    final byDate = <String, List<Map<String, dynamic>>>{};
-
-    for (final t in list) {
-      if (_isDone(t['done'])) continue;
-      final due = _parseDue(t['due_date']);
-      if (due == null) continue;
-
-      final key = _fmtDate(due);
-      (byDate[key] ??= []).add(t);
+    final first = DateTime(_focused.year, _focused.month, 1);
+    final last = DateTime(_focused.year, _focused.month + 1, 0);
+    try {
+      // {start, end, days: {'YYYY-MM-DD': {tasks: [...], events: [...], diary: [...]}}}
+      final data = await apiGet('/agenda', {'start': _fmtDate(first), 'end': _fmtDate(last)});
+      final days = Map<String, dynamic>.from(data['days'] ?? {});
+      final byDate = <String, List<Map<String, dynamic>>>{};
+
+      days.forEach((key, v) {
+        final day = Map<String, dynamic>.from(v);
+        final items = <Map<String, dynamic>>[
+          for (final t in List<Map<String, dynamic>>.from(day['tasks'] ?? const []))
+            if (!_isDone(t['done'])) t,
+          for (final e in List<Map<String, dynamic>>.from(day['events'] ?? const []))
+            {...e, 'kind': 'event'},
+        ];
+        if (items.isNotEmpty) byDate[key] = items;
+      });
+
+      if (!mounted) return;
+      setState(() {
+        _eventsByDate = byDate;
+        _loading = false;
+      });
+    } catch (_) {
+      if (!mounted) return;
+      setState(() => _loading = false);
     }
-
-    setState(() {
-      _eventsByDate = byDate;
-      _loading = false;
-    });
   }
 
   List<Map<String, dynamic>> _getEventsForDay(DateTime day) {
@@ -163,6 +162,7 @@ class _CalendarPageState extends State<CalendarPage> {
                   },
                   onPageChanged: (newFocused) {
                     _focused = newFocused;
+                    _loadMonth();
                   },
                   eventLoader: (day) => _getEventsForDay(day),
                   headerStyle: const HeaderStyle(
@@ -191,7 +191,7 @@ class _CalendarPageState extends State<CalendarPage> {
                     ),
                     child: selectedEvents.isEmpty
                         ? const Center(
-                            child: Text('No tasks due on this day'),
+                            child: Text('Nothing due on this day'),
                           )
                         : ListView.separated(
                             itemCount: selectedEvents.length,
@@ -201,6 +201,7 @@ class _CalendarPageState extends State<CalendarPage> {
                               final t = selectedEvents[i];
                               final title = (t['title'] ?? '').toString();
                               final urgency = _toInt(t['urgency']) ?? 1;
+                              final isEvent = t['kind'] == 'event';
 
                               return Container(
                                 padding: const EdgeInsets.symmetric(
@@ -224,7 +225,9 @@ class _CalendarPageState extends State<CalendarPage> {
                                       width: 12,
                                       height: 12,
                                       decoration: BoxDecoration(
-                                        color: _dot(urgency),
+                                        color: isEvent
+                                            ? const Color(0xFF42A5F5) // blue
+                                            : _dot(urgency),
                                         shape: BoxShape.circle,
                                       ),
                                     ),
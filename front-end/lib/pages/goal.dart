@@ -30,70 +30,31 @@ class _GoalPageState extends State<GoalPage> {
 
   // -------- helpers ----------
 
-  bool _isDone(dynamic v) {
-    if (v is bool) return v;
-    if (v is num) return v != 0;
-    if (v is String) {
-      final s = v.trim().toLowerCase();
-      return s == '1' || s == 'true' || s == 'yes';
-    }
-    return false;
-  }
-
   void _onTasksChanged() {
-    // TaskSync.tasks was updated somewhere -> recompute progress from cache
-    _computeFromCache();
+    // a task was added / edited / deleted somewhere -> ask the backend again
+    // (counters are kept server-side; an unchanged answer is a 304)
+    _loadFromBackend();
   }
 
-  Future<void> _initLoad() async {
-    // First time: if TaskSync already has tasks, just use them.
-    // If empty (user opens Goal first), load from backend once.
-    if (TaskSync.tasks.isEmpty) {
-      await _loadFromBackend();
-    } else {
-      _computeFromCache();
-    }
-  }
+  Future<void> _initLoad() => _loadFromBackend();
 
   Future<void> _loadFromBackend() async {
     setState(() => _loading = true);
     try {
-      final data = await apiGet('/tasks'); // [{id,title,urgency,due_date,done,...}]
-      final list = List<Map<String, dynamic>>.from(data);
-
-      // Save globally + notify listeners (Calendar, Goal, etc.)
-      TaskSync.setTasks(list);
-
-      // We will also compute locally (though _onTasksChanged will run too)
-      _computeFromList(list);
+      // {total, done, progress, by_urgency, undated}
+      final data = await apiGet('/goal/progress');
+      final p = (data['progress'] as num?)?.toDouble() ?? 0.0;
+      if (!mounted) return;
+      setState(() {
+        progress = p.clamp(0.0, 1.0);
+        _loading = false;
+      });
     } catch (_) {
       if (!mounted) return;
       setState(() => _loading = false);
     }
   }
 
-  void _computeFromCache() {
-    _computeFromList(TaskSync.tasks);
-  }
-
-  void _computeFromList(List<Map<String, dynamic>> list) {
-    setState(() => _loading = true);
-
-    int total = list.length;
-    int done = 0;
-    for (final t in list) {
-      if (_isDone(t['done'])) done++;
-    }
-
-    final p = total == 0 ? 0.0 : done / total;
-
-    if (!mounted) return;
-    setState(() {
-      progress = p.clamp(0.0, 1.0);
-      _loading = false;
-    });
-  }
-
   Future<void> _openMenu() async {
     // Just explain how this page works (user cannot edit progress directly)
     await showDialog<void>(